@@ -201,10 +201,34 @@ public static class NNUE
     public static float[] OutputWeights => outputWeightsf;
     public static float OutputBias => outputBiasf;
 
+    // Header of the quantized format written by nnue/3_quantize.py ("LNUQ" read as little-endian uint)
+    const uint QuantizedMagic = 0x51554E4C;
+    const ushort QuantizedVersion = 1;
+
+    // Header of the float format written by nnue/model_information.py ("LNUF")
+    const uint FloatMagic = 0x46554E4C;
+    const ushort FloatVersion = 1;
+
     public static void Initialize(string path)
     {
         using var reader = new BinaryReader(File.OpenRead(path));
 
+        var magic = reader.BaseStream.Length >= sizeof(uint) ? reader.ReadUInt32() : 0;
+        if (magic == QuantizedMagic)
+        {
+            InitializeQuantized(reader);
+            return;
+        }
+        if (magic == FloatMagic)
+        {
+            ReadFloatHeader(reader);
+        }
+        else
+        {
+            // Headerless float file from older exports
+            reader.BaseStream.Position = 0;
+        }
+
         // We need to determine the hidden layer size from the file
         // The file structure is: hidden_weights, hidden_bias, output_weights, output_bias
         long fileLength = reader.BaseStream.Length;
@@ -246,6 +270,77 @@ public static class NNUE
     }
 
 
+    // Layout after the magic: version, input size, hidden size (ushort), float type (byte, 1 = float32),
+    // reserved byte, CRC32 of the payload (uint). The floats follow in the headerless layout.
+    private static void ReadFloatHeader(BinaryReader reader)
+    {
+        var version = reader.ReadUInt16();
+        var inputSize = reader.ReadUInt16();
+        var hiddenSize = reader.ReadUInt16();
+        var floatType = reader.ReadByte();
+        reader.ReadByte(); // reserved
+        reader.ReadUInt32(); // CRC32, verified by load_f32_weights
+
+        if (version != FloatVersion)
+            throw new InvalidDataException($"Unsupported NNUE weights version {version}");
+        if (inputSize != InputSize || hiddenSize != HiddenSize)
+            throw new InvalidDataException($"NNUE weights are {inputSize}x{hiddenSize}, expected {InputSize}x{HiddenSize}");
+        if (floatType != 1)
+            throw new InvalidDataException($"Unknown NNUE weight type {floatType}");
+    }
+
+    // Layout after the magic: version, input size, hidden size, QA, QB (ushort), output weight
+    // type (byte, 1 = sbyte, 2 = short), reserved byte, CRC32 of the payload (uint), then
+    // hidden weights short[InputSize][HiddenSize] (feature-major), hidden bias short[HiddenSize],
+    // output weights sbyte/short[HiddenSize] and output bias int, all at the QA / QB scales.
+    private static void InitializeQuantized(BinaryReader reader)
+    {
+        var version = reader.ReadUInt16();
+        var inputSize = reader.ReadUInt16();
+        var hiddenSize = reader.ReadUInt16();
+        var qa = reader.ReadUInt16();
+        var qb = reader.ReadUInt16();
+        var outputType = reader.ReadByte();
+        reader.ReadByte(); // reserved
+        reader.ReadUInt32(); // CRC32, verified by the exporter when it reads the file back
+
+        if (version != QuantizedVersion)
+            throw new InvalidDataException($"Unsupported quantized NNUE version {version}");
+        if (inputSize != InputSize || hiddenSize != HiddenSize)
+            throw new InvalidDataException($"Quantized NNUE is {inputSize}x{hiddenSize}, expected {InputSize}x{HiddenSize}");
+        if (qa != QA || qb != QB)
+            throw new InvalidDataException($"Quantized NNUE uses QA={qa}, QB={qb}, expected {QA}, {QB}");
+        if (outputType != 1 && outputType != 2)
+            throw new InvalidDataException($"Unknown output weight type {outputType}");
+
+        for (int i = 0; i < InputSize; i++)
+        {
+            hiddenWeightsTensor[i] = new float[HiddenSize];
+            for (int h = 0; h < HiddenSize; h++)
+            {
+                short q = reader.ReadInt16();
+                hiddenWeightsTensor[i][h] = (float)q / QA;
+                hiddenWeightsf[h * InputSize + i] = (float)q / QA;
+                hiddenWeights[h * InputSize + i] = (sbyte)Math.Clamp(q, (short)-127, (short)127);
+            }
+        }
+
+        for (int h = 0; h < HiddenSize; h++)
+        {
+            hiddenBias[h] = reader.ReadInt16();
+            hiddenBiasf[h] = (float)hiddenBias[h] / QA;
+        }
+
+        for (int h = 0; h < HiddenSize; h++)
+        {
+            outputWeights[h] = outputType == 1 ? reader.ReadSByte() : reader.ReadInt16();
+            outputWeightsf[h] = (float)outputWeights[h] / QB;
+        }
+
+        outputBias = reader.ReadInt32();
+        outputBiasf = (float)outputBias / (QA * QB);
+    }
+
     internal static short FeedForward()
     {
         // Input to hidden layer (single layer)
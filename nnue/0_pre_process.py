@@ -1,14 +1,38 @@
+import argparse
 import os
+import shutil
 import sys
-from contextlib import closing
+import tempfile
+from contextlib import closing, nullcontext
 from collections import defaultdict
 
 import numpy as np
 
 from data import record_dtype, RECORD_SIZE
+from ingest import count_pieces, ingest_files, load_shard, remove_shard
+from manifest import KeySet, IngestManifest, load_keyset, restore_output, write_keyset
+from packed import PACKED_SUFFIX, pack_file
+from record_index import CATEGORY_ORDER, SourceTable, build_record_index, category_codes, open_record_index
+from rescore import SYZYGY_DEFAULT_PATH, SyzygyRescorer, open_syzygy_prober
+from shuffle import TRAIN_NAME, VAL_NAME, shuffle_records
+from zobrist import zobrist_keys
 
 
-SYZYGY_DEFAULT_PATH = "C:\\dev\\chess-data\\syzygy"
+OUTPUT_NAME = "preprocessed_positions.bin"
+
+# Persistent Syzygy probe cache, created inside the input folder
+SYZYGY_CACHE_NAME = "syzygy_wdl_cache.bin"
+
+DEFAULT_MEMORY_BUDGET = 4 << 30  # 4 GiB
+
+# Rough peak bytes held per in-memory record in the streaming path: the record itself,
+# its copy during deduplication/mirroring, plus sort indices and hash keys.
+WORKING_BYTES_PER_RECORD = 4 * RECORD_SIZE
+
+# How to resolve records that share a position key but disagree on eval/wdl:
+#   first   - keep the first occurrence in input order
+#   average - keep the first occurrence with eval and wdl averaged over all occurrences
+DEDUP_POLICIES = ("first", "average")
 
 # File mirroring lookup table: maps each square to its horizontally mirrored square
 # a1(0)->h1(7), b1(1)->g1(6), etc.
@@ -70,357 +94,518 @@ def mirror_position(pos):
     # stm, eval, wdl stay the same
     return mirrored
 
-def truncate_to_full_records(file_path):
-    """Ensure the file length is an integer multiple of RECORD_SIZE."""
-    try:
-        size = os.path.getsize(file_path)
-    except OSError:
-        return False
+# Bit-reversal of every byte value. A bitboard stores one rank per byte (LERF), so
+# reversing the bits of each of its 8 bytes flips files a<->h, exactly like mirror_bitboard.
+BYTE_MIRROR = np.array([int(f"{b:08b}"[::-1], 2) for b in range(256)], dtype=np.uint8)
 
-    remainder = size % RECORD_SIZE
-    if remainder == 0:
-        return True
+# Castling rights with kingside/queenside swapped for each color (see mirror_position).
+CASTLING_MIRROR = np.array([
+    ((c & 2) >> 1) | ((c & 1) << 1) | ((c & 8) >> 1) | ((c & 4) << 1)
+    for c in range(16)
+], dtype=np.uint8)
 
-    new_size = size - remainder
-    if new_size <= 0:
-        print(f"  Skipping {file_path}: file smaller than one record ({size} bytes)")
-        return False
+# The eight bitboards occupy bytes 0..63 of every record.
+BITBOARD_BYTES = 64
 
-    try:
-        with open(file_path, "rb+") as fh:
-            fh.truncate(new_size)
-        print(f"  Truncated {file_path} from {size} to {new_size} bytes")
-        return True
-    except OSError as exc:
-        print(f"  Failed to truncate {file_path}: {exc}")
-        return False
-
-def read_positions_from_bin(file_path):
-    """Read chess positions from binary file using numpy memmap."""
-    try:
-        # Memory-map the file for efficient reading
-        positions = np.memmap(file_path, dtype=record_dtype, mode='r')
-        return positions
-    except Exception:
-        # Silently ignore files that can't be read
-        return np.array([], dtype=record_dtype)
-
-def categorize_position(pos):
-    """Categorize a position based on evaluation and WDL."""
-    # Convert i16 evaluation to centipawns (assuming it's already in cp)
-    cp = int(pos["eval_i16"])
-    wdl = float(pos["wdl_f32"])
-    almost_equal = abs(cp) <= 100
-    wdl_low = wdl < 0.5
-    return (almost_equal, wdl_low)
-
-
-def record_to_board(rec, chess_module):
-    """Reconstruct a python-chess Board from a record."""
-    board = chess_module.Board(None)
-
-    white_mask = int(rec["bb_white"])
-    black_mask = int(rec["bb_black"])
-
-    piece_masks = (
-        (chess_module.PAWN, int(rec["bb_pawns"])),
-        (chess_module.KNIGHT, int(rec["bb_knights"])),
-        (chess_module.BISHOP, int(rec["bb_bishops"])),
-        (chess_module.ROOK, int(rec["bb_rooks"])),
-        (chess_module.QUEEN, int(rec["bb_queens"])),
-        (chess_module.KING, int(rec["bb_kings"])),
-    )
-
-    for color, color_mask in ((chess_module.WHITE, white_mask), (chess_module.BLACK, black_mask)):
-        for piece_type, mask in piece_masks:
-            color_piece_mask = mask & color_mask
-            while color_piece_mask:
-                lsb = color_piece_mask & -color_piece_mask
-                square_index = lsb.bit_length() - 1
-                board.set_piece_at(square_index, chess_module.Piece(piece_type, color))
-                color_piece_mask ^= lsb
-
-    board.turn = bool(int(rec["stm"]))
-    board.castling_rights = chess_module.BB_EMPTY
-    board.ep_square = None
-    board.halfmove_clock = 0
-    board.fullmove_number = 1
-
-    return board
-
-
-def rescore_with_syzygy(all_positions, piece_counts, syzygy_path):
-    """Apply Syzygy tablebases to rescore eligible endgames."""
-    try:
-        import chess
-        import chess.syzygy
-    except ImportError:
-        print("Syzygy rescoring skipped: python-chess is not installed")
-        return 0, {}
+def mirror_positions(positions, chunk_size=1 << 20, out=None):
+    """
+    Horizontally mirror a whole record array at once.
+    Produces byte-identical records to calling mirror_position on each record.
+    Works in chunks so the lookup temporaries stay bounded on huge arrays.
+    Pass a preallocated contiguous `out` array to mirror into it instead of a new copy.
+    """
+    if out is None:
+        mirrored = np.array(positions, dtype=record_dtype, copy=True)
+    else:
+        mirrored = out
+        mirrored[...] = positions
+    raw = mirrored.view(np.uint8).reshape(-1, RECORD_SIZE)
 
-    wdl_dir = os.path.join(syzygy_path, "3-4-5-wdl")
-    if not os.path.isdir(wdl_dir):
-        print(f"Syzygy rescoring skipped: directory not found ({wdl_dir})")
-        return 0, {}
+    for start in range(0, len(mirrored), chunk_size):
+        end = start + chunk_size
+        raw[start:end, :BITBOARD_BYTES] = BYTE_MIRROR[raw[start:end, :BITBOARD_BYTES]]
 
-    eligible_indices = np.flatnonzero((piece_counts >= 3) & (piece_counts <= 5))
-    if eligible_indices.size == 0:
-        return 0, {}
+        castling = mirrored["castling"][start:end]
+        mirrored["castling"][start:end] = CASTLING_MIRROR[castling & 0x0F]
 
-    distribution = {"win": 0, "draw": 0, "loss": 0}
-    rescored = 0
+        # 0 means "no en passant"; otherwise flip the file within the same rank.
+        ep_sq = mirrored["ep_file"][start:end]
+        mirrored["ep_file"][start:end] = np.where(ep_sq != 0, ep_sq ^ 7, ep_sq)
 
-    try:
-        tablebase = chess.syzygy.Tablebase()
-        tablebase.add_directory(wdl_dir, load_wdl=True, load_dtz=False)
-
-        for idx in eligible_indices:
-            rec = all_positions[idx]
-            try:
-                board = record_to_board(rec, chess)
-            except ValueError:
-                print(f"  Warning: invalid board position at index {idx}, skipping Syzygy probe")
-                continue
+    return mirrored
 
-            try:
-                wdl = tablebase.probe_wdl(board)
-            except chess.syzygy.MissingTableError as err:
-                continue
+def parse_size(text):
+    """Parse a byte size such as '512M', '8G' or '1073741824'."""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    text = str(text).strip().upper().removesuffix("B").removesuffix("I")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
 
-            rescored += 1
-            if wdl > 0:
-                all_positions[idx]["wdl_f32"] = np.float32(1.0)
-                all_positions[idx]["eval_i16"] = np.int16(200)
-                distribution["win"] += 1
-            elif wdl < 0:
-                all_positions[idx]["wdl_f32"] = np.float32(0.0)
-                all_positions[idx]["eval_i16"] = np.int16(-200)
-                distribution["loss"] += 1
-            else:
-                all_positions[idx]["wdl_f32"] = np.float32(0.5)
-                all_positions[idx]["eval_i16"] = np.int16(0)
-                distribution["draw"] += 1
-    except OSError as exc:
-        print(f"Syzygy rescoring skipped: failed to open tablebase ({exc})")
-        return 0, {}
-
-    return rescored, distribution
-
-def process_folder(folder_path):
-    # Find all files to process
-    bin_files = [f for f in os.listdir(folder_path) if f.endswith('.pgn.evals.bin')]
-    print(f"Found {len(bin_files)} .pgn.evals.bin files to process")
-    
-    all_positions = []
-    successful_files = 0
+
+def parse_ratios(text):
+    """Parse comma-separated category ratios (in CATEGORY_ORDER) into normalized floats."""
+    ratios = np.array([float(r) for r in str(text).split(",")], dtype=np.float64)
+    if len(ratios) != len(CATEGORY_ORDER) or (ratios < 0).any() or ratios.sum() <= 0:
+        raise argparse.ArgumentTypeError(
+            f"expected {len(CATEGORY_ORDER)} non-negative comma-separated ratios, got {text!r}"
+        )
+    return ratios / ratios.sum()
+
+
+def category_targets(counts, ratios):
+    """Largest per-category sample sizes that follow `ratios` without oversampling any category."""
+    counts = np.asarray(counts, dtype=np.int64)
+    wanted = ratios > 0
+    total = np.min(counts[wanted] / ratios[wanted])
+    return np.minimum(np.floor(total * ratios + 1e-9).astype(np.int64), counts)
+
+
+def sample_mask(rng, n, remaining, need):
+    """
+    Select records from the next `n` of `remaining` so that exactly `need` are picked
+    over the whole population (sequential sampling without replacement).
+    Returns (mask, picked).
+    """
+    if need <= 0:
+        return np.zeros(n, dtype=bool), 0
+    if n >= remaining:
+        take = need
+    elif remaining < 10**9:
+        take = int(rng.hypergeometric(n, remaining - n, need))
+    else:
+        take = int(rng.binomial(n, need / remaining))
+    take = min(n, need, max(take, need - (remaining - n)))
+    mask = np.zeros(n, dtype=bool)
+    mask[rng.choice(n, size=take, replace=False)] = True
+    return mask, take
+
+
+def select_balanced(positions, codes, targets, rng, chunk_size=1 << 20):
+    """Mask sampling exactly targets[c] records of each category c, spread over the array."""
+    keep = np.zeros(len(positions), dtype=bool)
+    for code, target in enumerate(targets):
+        members = np.flatnonzero(codes == code)
+        remaining = len(members)
+        need = int(target)
+        for start in range(0, len(members), chunk_size):
+            chunk = members[start:start + chunk_size]
+            mask, picked = sample_mask(rng, len(chunk), remaining, need)
+            keep[chunk[mask]] = True
+            remaining -= len(chunk)
+            need -= picked
+    return keep
+
+
+def print_category_counts(counts, targets=None):
+    print("Category distribution:")
+    for code, (almost_equal, wdl_low) in enumerate(CATEGORY_ORDER):
+        line = f"  Almost equal: {almost_equal}, WDL low: {wdl_low} -> {int(counts[code])} positions"
+        if targets is not None:
+            line += f" (sampled {int(targets[code]):,})"
+        print(line)
+
+
+def dedupe_positions(positions, keys=None, policy="first"):
+    """
+    Deduplicate records by their Zobrist position key instead of the full record.
+    Unique records come back in order of first occurrence.
+    Returns (unique_positions, unique_keys).
+    """
+    if policy not in DEDUP_POLICIES:
+        raise ValueError(f"Unknown dedup policy {policy!r}, expected one of {DEDUP_POLICIES}")
+    if keys is None:
+        keys = zobrist_keys(positions)
+
+    if policy == "average":
+        unique_keys, first_index, inverse, counts = np.unique(
+            keys, return_index=True, return_inverse=True, return_counts=True
+        )
+    else:
+        unique_keys, first_index = np.unique(keys, return_index=True)
+
+    order = np.argsort(first_index)
+    unique_positions = positions[first_index[order]]
+
+    if policy == "average" and len(unique_keys) < len(positions):
+        eval_sum = np.bincount(inverse, weights=positions["eval_i16"], minlength=len(unique_keys))
+        wdl_sum = np.bincount(inverse, weights=positions["wdl_f32"], minlength=len(unique_keys))
+        unique_positions["eval_i16"] = np.rint(eval_sum / counts)[order].astype(np.int16)
+        unique_positions["wdl_f32"] = (wdl_sum / counts)[order].astype(np.float32)
+
+    return unique_positions, unique_keys[order]
+
+
+def _median_from_counts(values, counts):
+    """Median of a multiset given sorted distinct values and their counts (same as np.median)."""
+    cumulative = np.cumsum(counts)
+    n = int(cumulative[-1])
+    lo = values[np.searchsorted(cumulative, (n - 1) // 2, side="right")]
+    hi = values[np.searchsorted(cumulative, n // 2, side="right")]
+    return (float(lo) + float(hi)) / 2.0
+
+
+class DatasetStatistics:
+    """
+    Accumulates the dataset summary chunk by chunk so it never needs the whole
+    dataset in memory. Evals are int16 and WDLs take few distinct values, so the
+    medians are exact.
+    """
+    def __init__(self):
+        self.n = 0
+        self.eval_counts = np.zeros(1 << 16, dtype=np.int64)
+        self.eval_sum = 0.0
+        self.eval_sq_sum = 0.0
+        self.wdl_counts = defaultdict(int)
+        self.wdl_sum = 0.0
+        self.wdl_buckets = np.zeros(3, dtype=np.int64)  # white wins, draws, black wins
+        self.white_to_move = 0
+        self.black_to_move = 0
+        self.piece_count_hist = np.zeros(65, dtype=np.int64)
+        self.agree_white = 0
+        self.agree_black = 0
+        self.disagree = 0
+
+    def update(self, positions):
+        if len(positions) == 0:
+            return
+        self.n += len(positions)
+
+        evals = positions["eval_i16"].astype(np.int32)
+        self.eval_counts += np.bincount(evals + 32768, minlength=1 << 16)
+        self.eval_sum += float(evals.sum(dtype=np.float64))
+        self.eval_sq_sum += float(np.square(evals, dtype=np.float64).sum())
+
+        wdls = positions["wdl_f32"]
+        values, counts = np.unique(wdls, return_counts=True)
+        for value, count in zip(values.tolist(), counts.tolist()):
+            self.wdl_counts[value] += count
+        self.wdl_sum += float(wdls.sum(dtype=np.float64))
+        self.wdl_buckets += [
+            np.sum(wdls > 0.75),
+            np.sum((wdls >= 0.25) & (wdls <= 0.75)),
+            np.sum(wdls < 0.25),
+        ]
+
+        stm = positions["stm"]
+        self.white_to_move += int(np.sum(stm == 7))
+        self.black_to_move += int(np.sum(stm == 0))
+
+        self.piece_count_hist += np.bincount(count_pieces(positions), minlength=65)
+
+        eval_says_white = evals > 50
+        eval_says_black = evals < -50
+        wdl_says_white = wdls > 0.6
+        wdl_says_black = wdls < 0.4
+        self.agree_white += int(np.sum(eval_says_white & wdl_says_white))
+        self.agree_black += int(np.sum(eval_says_black & wdl_says_black))
+        self.disagree += int(np.sum((eval_says_white & wdl_says_black) | (eval_says_black & wdl_says_white)))
+
+    def print_summary(self):
+        print("\n" + "=" * 60)
+        print("DATASET STATISTICS SUMMARY")
+        print("=" * 60)
+
+        n = self.n
+        if n == 0:
+            print("  Dataset is empty")
+            return
+
+        # Evaluation distribution
+        present = np.flatnonzero(self.eval_counts)
+        eval_values = present - 32768
+        eval_mean = self.eval_sum / n
+        eval_std = max(self.eval_sq_sum / n - eval_mean * eval_mean, 0.0) ** 0.5
+        print("\n📊 Evaluation Distribution:")
+        print(f"  Min eval:    {int(eval_values[0]):+,} cp")
+        print(f"  Max eval:    {int(eval_values[-1]):+,} cp")
+        print(f"  Mean eval:   {eval_mean:+.1f} cp")
+        print(f"  Median eval: {_median_from_counts(eval_values, self.eval_counts[present]):+.1f} cp")
+        print(f"  Std dev:     {eval_std:.1f} cp")
+
+        # Eval buckets
+        abs_counts = np.zeros(32769, dtype=np.int64)
+        np.add.at(abs_counts, np.abs(eval_values), self.eval_counts[present])
+        abs_cumulative = np.cumsum(abs_counts)
+        print("\n  Eval buckets:")
+        buckets = [
+            ("  |eval| ≤ 50 cp (equal)", abs_cumulative[50]),
+            ("  |eval| ≤ 100 cp", abs_cumulative[100]),
+            ("  |eval| ≤ 200 cp", abs_cumulative[200]),
+            ("  |eval| ≤ 500 cp", abs_cumulative[500]),
+            ("  |eval| > 500 cp (decisive)", n - abs_cumulative[500]),
+        ]
+        for label, count in buckets:
+            pct = 100 * count / n
+            print(f"    {label}: {count:,} ({pct:.1f}%)")
+
+        # WDL distribution
+        white_wins, draws, black_wins = (int(c) for c in self.wdl_buckets)
+        wdl_values = np.array(sorted(self.wdl_counts), dtype=np.float64)
+        wdl_counts = np.array([self.wdl_counts[v] for v in wdl_values], dtype=np.int64)
+        print("\n📊 WDL (Game Result) Distribution:")
+        print(f"  White wins (WDL > 0.75): {white_wins:,} ({100*white_wins/n:.1f}%)")
+        print(f"  Draws (0.25 ≤ WDL ≤ 0.75): {draws:,} ({100*draws/n:.1f}%)")
+        print(f"  Black wins (WDL < 0.25): {black_wins:,} ({100*black_wins/n:.1f}%)")
+        print(f"  Mean WDL:   {self.wdl_sum / n:.3f}")
+        print(f"  Median WDL: {_median_from_counts(wdl_values, wdl_counts):.3f}")
+
+        # Side to move distribution
+        print("\n📊 Side to Move:")
+        print(f"  White to move: {self.white_to_move:,} ({100*self.white_to_move/n:.1f}%)")
+        print(f"  Black to move: {self.black_to_move:,} ({100*self.black_to_move/n:.1f}%)")
+
+        # Piece count distribution (game phase proxy)
+        hist = self.piece_count_hist
+        occupied = np.flatnonzero(hist)
+        print("\n📊 Piece Count Distribution (Game Phase):")
+        print(f"  Min pieces:  {occupied[0]}")
+        print(f"  Max pieces:  {occupied[-1]}")
+        print(f"  Mean pieces: {float(np.dot(np.arange(65), hist)) / n:.1f}")
+
+        phase_buckets = [
+            ("  Endgame (2-6 pieces)", hist[2:7].sum()),
+            ("  Late middlegame (7-12 pieces)", hist[7:13].sum()),
+            ("  Middlegame (13-20 pieces)", hist[13:21].sum()),
+            ("  Opening (21-32 pieces)", hist[21:33].sum()),
+        ]
+        for label, count in phase_buckets:
+            pct = 100 * count / n
+            print(f"    {label}: {count:,} ({pct:.1f}%)")
+
+        # Eval vs WDL agreement
+        print("\n📊 Eval-WDL Agreement:")
+        print(f"  Eval & WDL agree (white winning): {self.agree_white:,}")
+        print(f"  Eval & WDL agree (black winning): {self.agree_black:,}")
+        print(f"  Eval & WDL disagree: {self.disagree:,} ({100*self.disagree/n:.2f}%)")
+
+
+def verify_output_file(output_file, expected_records):
+    file_size = os.path.getsize(output_file)
+    expected_size = expected_records * RECORD_SIZE
+    print(f"✓ Saved {expected_records:,} positions")
+    print(f"✓ File size: {file_size:,} bytes ({file_size // RECORD_SIZE:,} records × {RECORD_SIZE} bytes)")
+
+    if file_size == expected_size:
+        print("✓ File format validation passed")
+    else:
+        print(f"⚠️  Warning: File size mismatch! Expected {expected_size:,}, got {file_size:,}")
+
+
+def ingest_folder(folder_path, bin_files, shard_dir, workers=None, chunk_records=1 << 20):
+    """Run the parallel ingestion stage over bin_files. Returns the successful shards."""
+    shards = []
     failed_files = 0
-    
-    for i, fname in enumerate(bin_files, 1):
-        print(f"Processing file {i}/{len(bin_files)}: {fname}", end=" ... ")
-        file_path = os.path.join(folder_path, fname)
-        truncate_to_full_records(file_path)
-        positions = read_positions_from_bin(file_path)
-        
-        if len(positions) > 0:
-            all_positions.append(positions)
-            successful_files += 1
-            print(f"OK ({len(positions):,} positions)")
+    paths = [os.path.join(folder_path, fname) for fname in bin_files]
+    for i, shard in enumerate(ingest_files(paths, shard_dir, workers=workers, chunk_records=chunk_records), 1):
+        print(f"Processing file {i}/{len(bin_files)}: {os.path.basename(shard.source)}", end=" ... ")
+        if shard.ok:
+            shards.append(shard)
+            print(f"OK ({shard.loaded:,} positions)")
         else:
             failed_files += 1
+            remove_shard(shard)
             print("FAILED (skipping)")
 
-    print(f"\nProcessing complete: {successful_files} successful, {failed_files} failed")
-    
-    if not all_positions:
-        print("No valid position files found.")
-        return
+    print(f"\nProcessing complete: {len(shards)} successful, {failed_files} failed")
+    return shards
 
-    # Concatenate all position arrays
-    print("\nConcatenating position arrays...")
-    all_positions = np.concatenate(all_positions)
-    print(f"Total positions loaded: {len(all_positions):,}")
-
-    occupancy = np.bitwise_or(all_positions["bb_white"], all_positions["bb_black"])
-    piece_counts = np.fromiter((int(int(val).bit_count()) for val in occupancy), dtype=np.uint8, count=len(all_positions))
-
-    # Filter out mate-score positions unless we are in sparse endgames (<6 pieces)
-    print("Filtering mate-score positions...")
-    evals = all_positions["eval_i16"].astype(np.int32)
-    mate_mask = np.abs(evals) >= 10000
-    mate_indices = np.flatnonzero(mate_mask)
-    if mate_indices.size:
-        filter_mask = np.ones(len(all_positions), dtype=bool)
-        filter_mask[mate_indices] = piece_counts[mate_indices] < 6
-        removed = len(all_positions) - int(filter_mask.sum())
-        if removed > 0:
-            all_positions = all_positions[filter_mask]
-            occupancy = occupancy[filter_mask]
-            piece_counts = piece_counts[filter_mask]
-        print(f"  Removed {removed:,} mate-score positions with >=6 pieces")
-    else:
-        print("  No mate-score positions filtered")
 
-    print("Applying Syzygy tablebases to eligible endgames...")
-    rescored, distribution = rescore_with_syzygy(all_positions, piece_counts, SYZYGY_DEFAULT_PATH)
+def open_rescorer(folder_path, syzygy_path, syzygy_cache=None, prober=None, workers=None):
+    """Context manager yielding a SyzygyRescorer, or None when no tablebase is available."""
+    prober = prober or open_syzygy_prober(syzygy_path)
+    if prober is None:
+        return nullcontext()
+    cache_path = syzygy_cache or os.path.join(folder_path, SYZYGY_CACHE_NAME)
+    return SyzygyRescorer(prober, cache_path=cache_path, workers=workers)
+
+
+def rescore_endgames(positions, piece_counts, keys, rescorer):
+    """Run the Syzygy stage on one array and print what it did."""
+    if rescorer is None:
+        print("  No positions rescored via Syzygy")
+        return
+    rescored, distribution = rescorer.rescore(positions, piece_counts, keys)
     if rescored:
         print(f"  Rescored {rescored:,} positions (wins: {distribution.get('win', 0):,}, draws: {distribution.get('draw', 0):,}, losses: {distribution.get('loss', 0):,})")
     else:
         print("  No positions rescored via Syzygy")
+    print(f"  Syzygy cache hits: {rescorer.cache_hits:,}, probed: {rescorer.probed:,}")
+
+
+def shuffle_output(folder_path, output_file, originals, val_fraction=0.0, memory_budget=DEFAULT_MEMORY_BUDGET, seed=None):
+    """
+    Globally shuffle the output so training can read it sequentially. With
+    val_fraction > 0 it is split into TRAIN_NAME/VAL_NAME (keeping each original
+    with its mirror) and the combined file is removed.
+    """
+    if val_fraction > 0:
+        train_path = os.path.join(folder_path, TRAIN_NAME)
+        val_path = os.path.join(folder_path, VAL_NAME)
+        print(f"Shuffling into {train_path} and {val_path} (validation fraction {val_fraction:.1%})...")
+        train, val = shuffle_records(
+            output_file, train_path, val_path, val_fraction,
+            pair_stride=originals, memory_budget=memory_budget, seed=seed,
+        )
+        os.remove(output_file)
+        print(f"✓ Training records:   {train:,}")
+        print(f"✓ Validation records: {val:,}")
+    else:
+        print(f"Shuffling {output_file}...")
+        shuffled_file = output_file + ".shuffling"
+        shuffle_records(output_file, shuffled_file, memory_budget=memory_budget, seed=seed)
+        os.replace(shuffled_file, output_file)
+        print("✓ Output shuffled")
+
+
+def output_paths(folder_path, output_file, val_fraction=0.0):
+    """The record files a run leaves behind (see shuffle_output)."""
+    if val_fraction > 0:
+        return [os.path.join(folder_path, TRAIN_NAME), os.path.join(folder_path, VAL_NAME)]
+    return [output_file]
+
+
+def write_record_indexes(paths, source_table, source_names):
+    """Build the sidecar record index (see record_index.py) of every output file."""
+    for path in paths:
+        index_path = build_record_index(path, source_table, source_names)
+        print(f"✓ Record index: {index_path}")
+
+
+def write_packed_outputs(paths, compress=False):
+    """Write a packed copy (see packed.py) of every output file to <output>.pk."""
+    for path in paths:
+        packed_path = pack_file(path, path + PACKED_SUFFIX, compress=compress)
+        ratio = os.path.getsize(packed_path) / max(os.path.getsize(path), 1)
+        print(f"✓ Packed records: {packed_path} ({ratio:.1%} of {os.path.basename(path)})")
+
+
+def concat_shards(shards, source_ids):
+    """Load shards into (positions, keys, piece_counts, record_sources), source_ids[i] tagging shard i."""
+    parts = [load_shard(shard) for shard in shards]
+    positions = np.concatenate([part[0] for part in parts])
+    keys = np.concatenate([part[1] for part in parts])
+    piece_counts = np.concatenate([part[2] for part in parts])
+    record_sources = np.repeat(np.asarray(source_ids, dtype=np.uint16), [len(part[0]) for part in parts])
+    return positions, keys, piece_counts, record_sources
+
+
+def process_folder(
+    folder_path,
+    dedup_policy="first",
+    workers=None,
+    syzygy_path=SYZYGY_DEFAULT_PATH,
+    syzygy_cache=None,
+    prober=None,
+    category_ratios=None,
+    seed=None,
+    shuffle=False,
+    val_fraction=0.0,
+    index=True,
+    packed=False,
+    packed_compress=False,
+):
+    # Find all files to process
+    bin_files = [f for f in os.listdir(folder_path) if f.endswith('.pgn.evals.bin')]
+    print(f"Found {len(bin_files)} .pgn.evals.bin files to process")
+
+    work_dir = tempfile.mkdtemp(prefix="preprocess_", dir=folder_path)
+    try:
+        # Workers validate, filter mate scores (unless <6 pieces), count pieces and hash
+        shards = ingest_folder(folder_path, bin_files, work_dir, workers=workers)
+        if not shards:
+            print("No valid position files found.")
+            return
+
+        loaded = sum(shard.loaded for shard in shards)
+        removed = sum(shard.removed for shard in shards)
+        print(f"Total positions loaded: {loaded:,}")
+        if removed:
+            print(f"  Removed {removed:,} mate-score positions with >=6 pieces")
+        else:
+            print("  No mate-score positions filtered")
+
+        # Concatenate all shards
+        print("\nConcatenating position arrays...")
+        all_positions, keys, piece_counts, record_sources = concat_shards(shards, range(len(shards)))
+        source_names = [os.path.basename(shard.source) for shard in shards]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if len(all_positions) == 0:
+        print("No positions left after filtering.")
+        return
+
+    print("Applying Syzygy tablebases to eligible endgames...")
+    with open_rescorer(folder_path, syzygy_path, syzygy_cache, prober, workers) as rescorer:
+        rescore_endgames(all_positions, piece_counts, keys, rescorer)
     
-    # Remove duplicates by converting to structured array and using numpy unique
-    print("Removing duplicates (this may take a while for large datasets)...")
-    unique_positions, unique_indices = np.unique(all_positions, return_index=True)
+    # Remove duplicate positions by Zobrist key
+    print(f"Removing duplicates (policy: {dedup_policy})...")
+    unique_positions, unique_keys = dedupe_positions(all_positions, keys, policy=dedup_policy)
     duplicates_removed = len(all_positions) - len(unique_positions)
     print(f"Duplicates removed: {duplicates_removed:,}")
     print(f"Unique positions: {len(unique_positions):,}")
 
     # Categorize positions
     print("Categorizing positions...")
-    categories = defaultdict(list)
-    for i, pos in enumerate(unique_positions):
-        if i % 100000 == 0 and i > 0:
-            print(f"  Categorized {i:,}/{len(unique_positions):,} positions ({i/len(unique_positions)*100:.1f}%)")
-        cat = categorize_position(pos)
-        categories[cat].append(pos)
-    print(f"  Categorization complete: {len(unique_positions):,} positions processed")
-
-    # Print category distribution
-    print("Category distribution:")
-    category_counts = {}
-    for cat, positions in categories.items():
-        almost_equal, wdl_low = cat
-        count = len(positions)
-        category_counts[cat] = count
-        print(f"  Almost equal: {almost_equal}, WDL low: {wdl_low} -> {count} positions")
-
-    # Collect all positions with their category counts
-    all_processed_positions = []
-    running_counts = {cat: 0 for cat in [(True, True), (True, False), (False, True), (False, False)]}
-    
-    for cat in [(True, True), (True, False), (False, True), (False, False)]:
-        positions = categories.get(cat, [])
-        running_counts[cat] = len(positions)
-        all_processed_positions.extend(positions)
-        
-    print(f"Running category counts: {running_counts}")
-
-    print(f"\nTotal processed positions count: {len(all_processed_positions):,}")
-    
-    # Convert back to numpy array for saving
-    print("Converting to numpy array for saving...")
-    final_positions = np.array(all_processed_positions, dtype=record_dtype)
-    
-    # Create mirrored versions of all positions
+    codes = category_codes(unique_positions)
+    counts = np.bincount(codes, minlength=len(CATEGORY_ORDER))
+    targets = None
+    if category_ratios is not None:
+        targets = category_targets(counts, category_ratios)
+        keep = select_balanced(unique_positions, codes, targets, np.random.default_rng(seed))
+        unique_positions = unique_positions[keep]
+        unique_keys = unique_keys[keep]
+        codes = codes[keep]
+    print_category_counts(counts, targets)
+
+    # Write category blocks and their mirrored copies straight into the output array
+    n = len(unique_positions)
+    print(f"\nTotal processed positions count: {n:,}")
+    final_positions = np.empty(2 * n, dtype=record_dtype)
+    order = np.argsort(codes, kind="stable")
+    np.take(unique_positions, order, out=final_positions[:n])
+    del unique_positions
+
     print("Creating horizontally mirrored positions...")
-    mirrored_positions = np.empty(len(final_positions), dtype=record_dtype)
-    for i in range(len(final_positions)):
-        if i % 1000000 == 0 and i > 0:
-            print(f"  Mirrored {i:,}/{len(final_positions):,} positions ({100*i/len(final_positions):.1f}%)")
-        mirrored_positions[i] = mirror_position(final_positions[i])
-    print(f"  Created {len(mirrored_positions):,} mirrored positions")
-    
-    # Combine original and mirrored
-    final_positions = np.concatenate([final_positions, mirrored_positions])
+    mirror_positions(final_positions[:n], out=final_positions[n:])
     print(f"  Total positions after mirroring: {len(final_positions):,}")
+
+    source_table = None
+    if index:
+        # Mirrors come from the same source as their originals
+        original_keys = unique_keys[order]
+        original_sources = SourceTable.from_keys(keys, record_sources).lookup(original_keys)
+        source_table = SourceTable.from_keys(
+            np.concatenate([original_keys, zobrist_keys(final_positions[n:])]),
+            np.concatenate([original_sources, original_sources]),
+        )
+    del keys, record_sources
     
     # Save processed positions to a new file
-    output_file = os.path.join(folder_path, "preprocessed_positions.bin")
+    output_file = os.path.join(folder_path, OUTPUT_NAME)
     print(f"Saving to: {output_file}")
     final_positions.tofile(output_file)
     
     # Verify the saved file
-    file_size = os.path.getsize(output_file)
-    expected_size = len(final_positions) * RECORD_SIZE
-    print(f"✓ Saved {len(final_positions):,} positions")
-    print(f"✓ File size: {file_size:,} bytes ({file_size // RECORD_SIZE:,} records × {RECORD_SIZE} bytes)")
-    
-    if file_size == expected_size:
-        print("✓ File format validation passed")
-    else:
-        print(f"⚠️  Warning: File size mismatch! Expected {expected_size:,}, got {file_size:,}")
+    verify_output_file(output_file, len(final_positions))
     
     # -------------------------
     # Dataset Statistics Summary
     # -------------------------
-    print("\n" + "=" * 60)
-    print("DATASET STATISTICS SUMMARY")
-    print("=" * 60)
-    
-    # Evaluation distribution
-    evals = final_positions["eval_i16"].astype(np.int32)
-    print("\n📊 Evaluation Distribution:")
-    print(f"  Min eval:    {evals.min():+,} cp")
-    print(f"  Max eval:    {evals.max():+,} cp")
-    print(f"  Mean eval:   {evals.mean():+.1f} cp")
-    print(f"  Median eval: {np.median(evals):+.1f} cp")
-    print(f"  Std dev:     {evals.std():.1f} cp")
-    
-    # Eval buckets
-    print("\n  Eval buckets:")
-    buckets = [
-        ("  |eval| ≤ 50 cp (equal)", np.sum(np.abs(evals) <= 50)),
-        ("  |eval| ≤ 100 cp", np.sum(np.abs(evals) <= 100)),
-        ("  |eval| ≤ 200 cp", np.sum(np.abs(evals) <= 200)),
-        ("  |eval| ≤ 500 cp", np.sum(np.abs(evals) <= 500)),
-        ("  |eval| > 500 cp (decisive)", np.sum(np.abs(evals) > 500)),
-    ]
-    for label, count in buckets:
-        pct = 100 * count / len(evals)
-        print(f"    {label}: {count:,} ({pct:.1f}%)")
-    
-    # WDL distribution
-    wdls = final_positions["wdl_f32"]
-    print("\n📊 WDL (Game Result) Distribution:")
-    white_wins = np.sum(wdls > 0.75)
-    draws = np.sum((wdls >= 0.25) & (wdls <= 0.75))
-    black_wins = np.sum(wdls < 0.25)
-    print(f"  White wins (WDL > 0.75): {white_wins:,} ({100*white_wins/len(wdls):.1f}%)")
-    print(f"  Draws (0.25 ≤ WDL ≤ 0.75): {draws:,} ({100*draws/len(wdls):.1f}%)")
-    print(f"  Black wins (WDL < 0.25): {black_wins:,} ({100*black_wins/len(wdls):.1f}%)")
-    print(f"  Mean WDL:   {wdls.mean():.3f}")
-    print(f"  Median WDL: {np.median(wdls):.3f}")
-    
-    # Side to move distribution
-    stm = final_positions["stm"]
-    white_to_move = np.sum(stm == 7)
-    black_to_move = np.sum(stm == 0)
-    print("\n📊 Side to Move:")
-    print(f"  White to move: {white_to_move:,} ({100*white_to_move/len(stm):.1f}%)")
-    print(f"  Black to move: {black_to_move:,} ({100*black_to_move/len(stm):.1f}%)")
-    
-    # Piece count distribution (game phase proxy)
-    occupancy = np.bitwise_or(final_positions["bb_white"], final_positions["bb_black"])
-    piece_counts = np.array([int(int(val).bit_count()) for val in occupancy], dtype=np.uint8)
-    print("\n📊 Piece Count Distribution (Game Phase):")
-    print(f"  Min pieces:  {piece_counts.min()}")
-    print(f"  Max pieces:  {piece_counts.max()}")
-    print(f"  Mean pieces: {piece_counts.mean():.1f}")
-    
-    phase_buckets = [
-        ("  Endgame (2-6 pieces)", (piece_counts >= 2) & (piece_counts <= 6)),
-        ("  Late middlegame (7-12 pieces)", (piece_counts >= 7) & (piece_counts <= 12)),
-        ("  Middlegame (13-20 pieces)", (piece_counts >= 13) & (piece_counts <= 20)),
-        ("  Opening (21-32 pieces)", (piece_counts >= 21) & (piece_counts <= 32)),
-    ]
-    for label, mask in phase_buckets:
-        count = np.sum(mask)
-        pct = 100 * count / len(piece_counts)
-        print(f"    {label}: {count:,} ({pct:.1f}%)")
-    
-    # Eval vs WDL agreement
-    print("\n📊 Eval-WDL Agreement:")
-    eval_says_white = evals > 50
-    eval_says_black = evals < -50
-    wdl_says_white = wdls > 0.6
-    wdl_says_black = wdls < 0.4
-    
-    agree_white = np.sum(eval_says_white & wdl_says_white)
-    agree_black = np.sum(eval_says_black & wdl_says_black)
-    disagree = np.sum((eval_says_white & wdl_says_black) | (eval_says_black & wdl_says_white))
-    
-    print(f"  Eval & WDL agree (white winning): {agree_white:,}")
-    print(f"  Eval & WDL agree (black winning): {agree_black:,}")
-    print(f"  Eval & WDL disagree: {disagree:,} ({100*disagree/len(evals):.2f}%)")
+    stats = DatasetStatistics()
+    stats.update(final_positions)
+    stats.print_summary()
+
+    if shuffle or val_fraction > 0:
+        print()
+        shuffle_output(folder_path, output_file, n, val_fraction, seed=seed)
+
+    if index:
+        write_record_indexes(output_paths(folder_path, output_file, val_fraction), source_table, source_names)
+    if packed:
+        write_packed_outputs(output_paths(folder_path, output_file, val_fraction), packed_compress)
     
     print("\n" + "=" * 60)
     print("PREPROCESSING COMPLETE")
@@ -428,8 +613,469 @@ def process_folder(folder_path):
     
     return final_positions
 
+
+def process_folder_incremental(
+    folder_path,
+    dedup_policy="first",
+    workers=None,
+    syzygy_path=SYZYGY_DEFAULT_PATH,
+    syzygy_cache=None,
+    prober=None,
+    category_ratios=None,
+    seed=None,
+    index=True,
+    packed=False,
+    packed_compress=False,
+):
+    """
+    Append only what new input files add to the output.
+
+    Input files already in the manifest (manifest.py) with the same size and mtime are
+    skipped. The others are ingested, rescored and deduplicated like in process_folder,
+    then positions whose key is already in the persistent key set are dropped and the
+    rest is appended to the output (category blocks, then their mirrors). Ingestion,
+    rescoring, hashing and mirroring only touch the new records; the sorted key set and
+    the record index columns are extended with one linear copy.
+
+    Duplicates of earlier positions keep their existing record, whatever dedup_policy
+    says ("average" only averages within the new files), and category_ratios are
+    applied to the new positions. A changed file is ingested again: its new positions
+    are appended, the ones it had contributed before stay. The output is not shuffled;
+    sample it with BlockShuffleSampler or shuffle it separately (shuffle.py).
+    Without a manifest and key set the first run starts a new output from all files.
+    """
+    output_file = os.path.join(folder_path, OUTPUT_NAME)
+    manifest = IngestManifest.load(folder_path)
+    history = load_keyset(folder_path) if manifest is not None else None
+    previous_index = None
+    if manifest is None or history is None:
+        print(f"No incremental state in {folder_path}, starting a new {OUTPUT_NAME}")
+        manifest = IngestManifest(folder_path, OUTPUT_NAME)
+        history = KeySet.empty()
+        open(output_file, "wb").close()
+    else:
+        restore_output(output_file, history)
+        if index:
+            # Opened before appending, while it still matches the output
+            previous_index = open_record_index(output_file)
+    history_records = history.output_records
+
+    bin_files = sorted(f for f in os.listdir(folder_path) if f.endswith('.pgn.evals.bin'))
+    new_files, changed_files = manifest.pending(bin_files)
+    print(f"Found {len(bin_files)} .pgn.evals.bin files: {len(new_files)} new, {len(changed_files)} changed, "
+          f"{len(bin_files) - len(new_files) - len(changed_files)} already ingested")
+    if changed_files:
+        print(f"  Re-ingesting changed files (their earlier positions stay): {', '.join(changed_files)}")
+    pending = new_files + changed_files
+    if not pending:
+        print("Nothing new to process.")
+        return output_file
+
+    work_dir = tempfile.mkdtemp(prefix="preprocess_", dir=folder_path)
+    try:
+        shards = ingest_folder(folder_path, pending, work_dir, workers=workers)
+        if not shards:
+            # Recorded so that unreadable or empty files are not re-read on every run
+            for name in pending:
+                manifest.record(name, 0, 0)
+            write_keyset(folder_path, history.keys, output_file)
+            manifest.save()
+            print("No valid position files found.")
+            return output_file
+
+        loaded = sum(shard.loaded for shard in shards)
+        removed = sum(shard.removed for shard in shards)
+        print(f"New positions loaded: {loaded:,}")
+        if removed:
+            print(f"  Removed {removed:,} mate-score positions with >=6 pieces")
+
+        names = [os.path.basename(shard.source) for shard in shards]
+        all_positions, keys, piece_counts, record_sources = concat_shards(
+            shards, [manifest.source_id(name) for name in names]
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if len(all_positions):
+        print("Applying Syzygy tablebases to eligible endgames...")
+        with open_rescorer(folder_path, syzygy_path, syzygy_cache, prober, workers) as rescorer:
+            rescore_endgames(all_positions, piece_counts, keys, rescorer)
+
+    print(f"Removing duplicates (policy: {dedup_policy})...")
+    unique_positions, unique_keys = dedupe_positions(all_positions, keys, policy=dedup_policy)
+    fresh = ~history.contains(unique_keys)
+    print(f"Duplicates within the new files: {len(all_positions) - len(unique_positions):,}")
+    print(f"Already in {OUTPUT_NAME}: {int(np.sum(~fresh)):,}")
+    unique_positions = unique_positions[fresh]
+    unique_keys = unique_keys[fresh]
+
+    codes = category_codes(unique_positions)
+    counts = np.bincount(codes, minlength=len(CATEGORY_ORDER))
+    targets = None
+    if category_ratios is not None and len(unique_positions):
+        targets = category_targets(counts, category_ratios)
+        keep = select_balanced(unique_positions, codes, targets, np.random.default_rng(seed))
+        unique_positions = unique_positions[keep]
+        unique_keys = unique_keys[keep]
+        codes = codes[keep]
+    print_category_counts(counts, targets)
+
+    n = len(unique_positions)
+    print(f"\nNew positions to append: {n:,} (+{n:,} mirrored)")
+    order = np.argsort(codes, kind="stable")
+    appended = np.empty(2 * n, dtype=record_dtype)
+    np.take(unique_positions, order, out=appended[:n])
+    mirror_positions(appended[:n], out=appended[n:])
+    original_keys = unique_keys[order]
+    original_sources = SourceTable.from_keys(keys, record_sources).lookup(original_keys)
+    del unique_positions, all_positions
+
+    # Commit order: output, key set, manifest (see manifest.py)
+    _append_records(output_file, appended)
+    verify_output_file(output_file, history_records + len(appended))
+    write_keyset(folder_path, history.merged(original_keys), output_file)
+    added = np.bincount(original_sources, minlength=len(manifest.files))
+    for shard, name in zip(shards, names):
+        manifest.record(name, shard.loaded, int(added[manifest.source_id(name)]))
+    for name in sorted(set(pending) - set(names)):
+        manifest.record(name, 0, 0)  # failed files: not re-read until they change
+    manifest.save()
+    print(f"✓ Manifest: {manifest.path} ({len(manifest.files)} files)")
+
+    stats = DatasetStatistics()
+    stats.update(appended)
+    stats.print_summary()
+
+    if index:
+        # Only new records are looked up; earlier ones keep their columns from previous_index
+        source_table = SourceTable.from_keys(
+            np.concatenate([original_keys, zobrist_keys(appended[n:])]),
+            np.concatenate([original_sources, original_sources]),
+        )
+        index_path = build_record_index(output_file, source_table, manifest.source_names, previous=previous_index)
+        print(f"✓ Record index: {index_path}")
+        del previous_index
+    if packed:
+        write_packed_outputs([output_file], packed_compress)
+
+    print("\n" + "=" * 60)
+    print("INCREMENTAL PREPROCESSING COMPLETE")
+    print("=" * 60)
+
+    return output_file
+
+
+def _append_records(path, positions):
+    with open(path, "ab") as fh:
+        positions.tofile(fh)
+
+
+def _iter_record_chunks(path, chunk_records, limit=None):
+    """Yield in-memory record arrays of at most chunk_records from a file (first `limit` records)."""
+    remaining = limit
+    with open(path, "rb") as fh:
+        while remaining is None or remaining > 0:
+            count = chunk_records if remaining is None else min(chunk_records, remaining)
+            chunk = np.fromfile(fh, dtype=record_dtype, count=count)
+            if len(chunk) == 0:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def process_folder_streaming(
+    folder_path,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    syzygy_path=SYZYGY_DEFAULT_PATH,
+    dedup_policy="first",
+    workers=None,
+    syzygy_cache=None,
+    prober=None,
+    category_ratios=None,
+    seed=None,
+    shuffle=False,
+    val_fraction=0.0,
+    index=True,
+    packed=False,
+    packed_compress=False,
+):
+    """
+    Out-of-core variant of process_folder for corpora larger than RAM.
+
+    Input files are ingested in parallel into filtered, pre-hashed shards. The shards
+    are read back in fixed-size chunks, rescored and scattered by Zobrist key into
+    bucket files on disk. Each bucket is then deduplicated in memory and split into
+    per-category spill files, which are finally streamed (originals, then mirrored
+    copies) into the output file.
+    Peak memory follows memory_budget rather than the corpus size. Scratch disk
+    peaks right after ingestion: the shards hold 82 bytes (record, key, piece count)
+    per kept 73-byte input record, ~1.15x the input size, and each shard is only
+    freed once it has been scattered into buckets (which keep the key, 81 bytes per
+    record). Later passes need at most the larger of that and the output itself
+    (2 x 73 bytes per unique position). The record index (index=True) additionally
+    keeps the source table in memory, ~10 bytes per unique position.
+    """
+    bin_files = [f for f in os.listdir(folder_path) if f.endswith('.pgn.evals.bin')]
+    print(f"Found {len(bin_files)} .pgn.evals.bin files to process")
+
+    chunk_records = max(1, memory_budget // WORKING_BYTES_PER_RECORD)
+    workers = workers or os.cpu_count() or 1
+
+    work_dir = tempfile.mkdtemp(prefix="preprocess_", dir=folder_path)
+    try:
+        # Ingest in parallel; workers split the budget between them
+        shards = ingest_folder(
+            folder_path, bin_files, work_dir,
+            workers=workers, chunk_records=max(1, chunk_records // workers),
+        )
+        total_records = sum(shard.records for shard in shards)
+        if total_records == 0:
+            print("No valid position files found.")
+            return
+
+        # Leave 2x headroom so hash skew does not push a bucket over the budget.
+        num_buckets = max(1, -(-2 * total_records // chunk_records))
+        print(f"Memory budget: {memory_budget:,} bytes -> {chunk_records:,} records per chunk, {num_buckets:,} buckets")
+
+        bucket_paths = [os.path.join(work_dir, f"bucket_{b:05d}.bin") for b in range(num_buckets)]
+        # The shard keys travel with the records, so pass 2 does not hash them again
+        bucket_key_paths = [os.path.join(work_dir, f"bucket_{b:05d}.keys") for b in range(num_buckets)]
+        category_paths = {cat: os.path.join(work_dir, f"category_{i}.bin") for i, cat in enumerate(CATEGORY_ORDER)}
+        for path in bucket_paths + bucket_key_paths + list(category_paths.values()):
+            open(path, "wb").close()
+
+        # Pass 1: rescore and scatter every shard chunk into hash buckets
+        loaded = sum(shard.loaded for shard in shards)
+        removed_total = sum(shard.removed for shard in shards)
+        rescored_total = 0
+        distribution_total = defaultdict(int)
+        source_names = [os.path.basename(shard.source) for shard in shards]
+        source_keys = []
+        with open_rescorer(folder_path, syzygy_path, syzygy_cache, prober, workers) as rescorer:
+            for source, shard in enumerate(shards):
+                records, keys, pieces = load_shard(shard)
+                if index:
+                    source_keys.append(SourceTable.from_keys(keys, np.full(len(keys), source, dtype=np.uint16)))
+                for start in range(0, len(records), chunk_records):
+                    chunk = np.array(records[start:start + chunk_records])
+                    chunk_keys = np.array(keys[start:start + chunk_records])
+
+                    if rescorer is not None:
+                        piece_counts = np.array(pieces[start:start + chunk_records])
+                        rescored, distribution = rescorer.rescore(chunk, piece_counts, chunk_keys)
+                        rescored_total += rescored
+                        for outcome, count in distribution.items():
+                            distribution_total[outcome] += count
+
+                    buckets = chunk_keys % np.uint64(num_buckets)
+                    order = np.argsort(buckets, kind="stable")
+                    chunk = chunk[order]
+                    chunk_keys = chunk_keys[order]
+                    bounds = np.searchsorted(buckets[order], np.arange(num_buckets + 1, dtype=np.uint64))
+                    for b in np.flatnonzero(np.diff(bounds)):
+                        _append_records(bucket_paths[b], chunk[bounds[b]:bounds[b + 1]])
+                        _append_records(bucket_key_paths[b], chunk_keys[bounds[b]:bounds[b + 1]])
+
+                del records, keys, pieces
+                remove_shard(shard)
+
+        print(f"Total positions loaded: {loaded:,}")
+        print(f"  Removed {removed_total:,} mate-score positions with >=6 pieces")
+        if rescored_total:
+            print(f"  Rescored {rescored_total:,} positions (wins: {distribution_total['win']:,}, draws: {distribution_total['draw']:,}, losses: {distribution_total['loss']:,})")
+        else:
+            print("  No positions rescored via Syzygy")
+        if rescorer is not None:
+            print(f"  Syzygy cache hits: {rescorer.cache_hits:,}, probed: {rescorer.probed:,}")
+
+        source_table = None
+        if index:
+            source_table = SourceTable.from_keys(
+                np.concatenate([table.keys for table in source_keys]),
+                np.concatenate([table.sources for table in source_keys]),
+            )
+            del source_keys
+
+        # Pass 2: dedupe each bucket in memory and split it by category
+        print(f"Removing duplicates bucket by bucket (policy: {dedup_policy})...")
+        unique_total = 0
+        category_counts = np.zeros(len(CATEGORY_ORDER), dtype=np.int64)
+        for b, (path, key_path) in enumerate(zip(bucket_paths, bucket_key_paths)):
+            bucket = np.fromfile(path, dtype=record_dtype)
+            bucket_keys = np.fromfile(key_path, dtype=np.uint64)
+            os.remove(path)
+            os.remove(key_path)
+            if len(bucket) == 0:
+                continue
+            unique_positions, _ = dedupe_positions(bucket, bucket_keys, policy=dedup_policy)
+            del bucket, bucket_keys
+            unique_total += len(unique_positions)
+            codes = category_codes(unique_positions)
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(CATEGORY_ORDER) + 1))
+            unique_positions = unique_positions[order]
+            for code, cat in enumerate(CATEGORY_ORDER):
+                category_counts[code] += bounds[code + 1] - bounds[code]
+                _append_records(category_paths[cat], unique_positions[bounds[code]:bounds[code + 1]])
+            if (b + 1) % 16 == 0:
+                print(f"  Deduplicated {b + 1:,}/{num_buckets:,} buckets")
+
+        total_after_filter = loaded - removed_total
+        print(f"Duplicates removed: {total_after_filter - unique_total:,}")
+        print(f"Unique positions: {unique_total:,}")
+        targets = category_counts
+        if category_ratios is not None:
+            targets = category_targets(category_counts, category_ratios)
+        print_category_counts(category_counts, targets if category_ratios is not None else None)
+
+        # Pass 3: stream (sampled) category blocks into the output, then append their
+        # mirrored copies by reading the originals back
+        output_file = os.path.join(folder_path, OUTPUT_NAME)
+        print(f"Saving originals and mirrored positions to: {output_file}")
+        rng = np.random.default_rng(seed)
+        stats = DatasetStatistics()
+        originals = 0
+        with open(output_file, "wb") as out:
+            for code, cat in enumerate(CATEGORY_ORDER):
+                remaining = int(category_counts[code])
+                need = int(targets[code])
+                for chunk in _iter_record_chunks(category_paths[cat], chunk_records):
+                    if need < remaining:
+                        mask, picked = sample_mask(rng, len(chunk), remaining, need)
+                        remaining -= len(chunk)
+                        need -= picked
+                        chunk = chunk[mask]
+                    else:
+                        remaining -= len(chunk)
+                        need -= len(chunk)
+                    chunk.tofile(out)
+                    stats.update(chunk)
+                    originals += len(chunk)
+                os.remove(category_paths[cat])
+
+        mirrored_keys, mirrored_sources = [], []
+        with open(output_file, "ab") as out:
+            for chunk in _iter_record_chunks(output_file, chunk_records, limit=originals):
+                mirrored = mirror_positions(chunk)
+                mirrored.tofile(out)
+                stats.update(mirrored)
+                if index:
+                    # Mirrors come from the same source as their originals
+                    mirrored_keys.append(zobrist_keys(mirrored))
+                    mirrored_sources.append(source_table.lookup(zobrist_keys(chunk)))
+        if index and mirrored_keys:
+            source_table = SourceTable.from_keys(
+                np.concatenate([source_table.keys] + mirrored_keys),
+                np.concatenate([source_table.sources] + mirrored_sources),
+            )
+        written = 2 * originals
+        print(f"  Total positions after mirroring: {written:,}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    verify_output_file(output_file, written)
+    stats.print_summary()
+
+    if shuffle or val_fraction > 0:
+        print()
+        shuffle_output(folder_path, output_file, originals, val_fraction, memory_budget, seed)
+
+    if index:
+        write_record_indexes(output_paths(folder_path, output_file, val_fraction), source_table, source_names)
+    if packed:
+        write_packed_outputs(output_paths(folder_path, output_file, val_fraction), packed_compress)
+
+    print("\n" + "=" * 60)
+    print("PREPROCESSING COMPLETE")
+    print("=" * 60)
+
+    return output_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Preprocess .pgn.evals.bin files into preprocessed_positions.bin")
+    parser.add_argument("folder_path", help="Folder containing .pgn.evals.bin files")
+    parser.add_argument("--stream", action="store_true",
+                        help="Process out-of-core in chunks instead of loading the whole corpus into memory")
+    parser.add_argument("--memory-budget", type=parse_size, default=DEFAULT_MEMORY_BUDGET,
+                        help="Approximate peak memory for --stream, e.g. 512M or 8G (default: 4G)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Ingestion worker processes (default: all cores)")
+    parser.add_argument("--syzygy-path", default=SYZYGY_DEFAULT_PATH,
+                        help="Folder containing the 3-4-5-wdl tablebases")
+    parser.add_argument("--syzygy-cache", default=None,
+                        help=f"Persistent Syzygy probe cache (default: <folder_path>/{SYZYGY_CACHE_NAME})")
+    parser.add_argument("--dedup-policy", choices=DEDUP_POLICIES, default="first",
+                        help="How to resolve duplicate positions with different eval/wdl (default: first)")
+    parser.add_argument("--category-ratios", type=parse_ratios, default=None,
+                        help="Rebalance categories to target ratios, comma-separated in the order "
+                             "(equal, wdl low), (equal, wdl high), (unequal, wdl low), (unequal, wdl high)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for category sampling and shuffling")
+    parser.add_argument("--shuffle", action="store_true",
+                        help="Globally shuffle the output with an external-memory shuffle")
+    parser.add_argument("--val-fraction", type=float, default=0.0,
+                        help=f"Shuffle and split the output into {TRAIN_NAME} and {VAL_NAME} "
+                             "with this validation fraction")
+    parser.add_argument("--no-index", action="store_true",
+                        help="Skip writing the sidecar record index (<output>.index, see record_index.py)")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Only process input files that are not in the manifest yet and append their new "
+                             f"positions to {OUTPUT_NAME} (see process_folder_incremental)")
+    parser.add_argument("--packed", action="store_true",
+                        help=f"Also write every output in the compact packed format (<output>{PACKED_SUFFIX}, see packed.py)")
+    parser.add_argument("--packed-compress", action="store_true",
+                        help="zlib-compress the chunks of the --packed outputs")
+    args = parser.parse_args(argv)
+    if args.incremental and (args.stream or args.shuffle or args.val_fraction > 0):
+        parser.error("--incremental appends to an unshuffled output and cannot be combined with "
+                     "--stream, --shuffle or --val-fraction")
+
+    if args.incremental:
+        process_folder_incremental(
+            args.folder_path,
+            dedup_policy=args.dedup_policy,
+            workers=args.workers,
+            syzygy_path=args.syzygy_path,
+            syzygy_cache=args.syzygy_cache,
+            category_ratios=args.category_ratios,
+            seed=args.seed,
+            index=not args.no_index,
+            packed=args.packed,
+            packed_compress=args.packed_compress,
+        )
+    elif args.stream:
+        process_folder_streaming(
+            args.folder_path,
+            memory_budget=args.memory_budget,
+            syzygy_path=args.syzygy_path,
+            dedup_policy=args.dedup_policy,
+            workers=args.workers,
+            syzygy_cache=args.syzygy_cache,
+            category_ratios=args.category_ratios,
+            seed=args.seed,
+            shuffle=args.shuffle,
+            val_fraction=args.val_fraction,
+            index=not args.no_index,
+            packed=args.packed,
+            packed_compress=args.packed_compress,
+        )
+    else:
+        process_folder(
+            args.folder_path,
+            dedup_policy=args.dedup_policy,
+            workers=args.workers,
+            syzygy_path=args.syzygy_path,
+            syzygy_cache=args.syzygy_cache,
+            category_ratios=args.category_ratios,
+            seed=args.seed,
+            shuffle=args.shuffle,
+            val_fraction=args.val_fraction,
+            index=not args.no_index,
+            packed=args.packed,
+            packed_compress=args.packed_compress,
+        )
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python 0_pre_process.py <folder_path>")
-        sys.exit(1)
-    process_folder(sys.argv[1])
\ No newline at end of file
+    main()
@@ -1,15 +1,21 @@
+import argparse
 import os
 import random
 import math
 import sys
+import time
 import numpy as np
 import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
 from torch.optim.lr_scheduler import CosineAnnealingLR, LinearLR, SequentialLR
 
-from data import ChessBitboardDataset, make_dataloader
-from model_information import print_model_summary, save_f32_weights
+from data import ChessBitboardDataset, make_dataloader, set_sampler_epoch
+from model_information import load_f32_weights, print_model_summary, save_f32_weights
 
 # # --------------------------
 # # Repro / determinism helpers
@@ -33,12 +39,106 @@ class NNUE(nn.Module):
         self.hidden = nn.Linear(input_size, hidden_size, dtype=torch.float32)
         self.output = nn.Linear(hidden_size, 1, dtype=torch.float32)
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(self, x) -> torch.Tensor:
+        if isinstance(x, (tuple, list)):
+            # Sparse input (indices, offsets): sum the weight columns of the active
+            # features, like the engine's accumulator. self.hidden stays an nn.Linear
+            # so the weights keep the save_f32_weights / NNUE.cs layout.
+            indices, offsets = x
+            weight = self.hidden.weight.t().contiguous()
+            h = F.embedding_bag(indices, weight, offsets, mode="sum") + self.hidden.bias
+        else:
+            h = self.hidden(x)
         # CReLU-like clamp activation in hidden layer
-        x = torch.clamp(self.hidden(x), 0.0, 1.0)
+        x = torch.clamp(h, 0.0, 1.0)
         logits = self.output(x)  # NO sigmoid here
         return logits
 
+def to_device(x, device):
+    """Move a dense input tensor or a sparse (indices, offsets) pair to device."""
+    if isinstance(x, (tuple, list)):
+        return tuple(t.to(device, non_blocking=True) for t in x)
+    return x.to(device, non_blocking=True)
+
+# --------------------------
+# Distributed helpers (no-ops in a single process)
+# --------------------------
+def is_main_process() -> bool:
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+def all_reduce_sum(values: list[float]) -> list[float]:
+    """Sum per-rank totals (losses, sample counts) over all ranks."""
+    if not dist.is_initialized():
+        return values
+    t = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(t)
+    return t.tolist()
+
+class DeviceSum:
+    """
+    Running float32 sums kept on the device with Kahan compensation, so accumulating
+    does not sync with the host every batch. No float64 on the device: consumer XPUs
+    (Intel Arc) have no fp64. tolist() converts to float64 on the CPU, plus `offset`.
+    """
+    def __init__(self, size: int, device: torch.device, offset: float = 0.0):
+        self.sum = torch.zeros(size, dtype=torch.float32, device=device)
+        self.compensation = torch.zeros_like(self.sum)
+        self.offset = offset
+
+    def add(self, values: torch.Tensor):
+        y = values.float() - self.compensation
+        t = self.sum + y
+        self.compensation = (t - self.sum) - y
+        self.sum = t
+
+    def tolist(self) -> list[float]:
+        total, compensation = torch.stack([self.sum, self.compensation]).cpu().double()
+        return (total - compensation + self.offset).tolist()
+
+def unwrap(model: nn.Module) -> nn.Module:
+    """The NNUE inside DistributedDataParallel / torch.compile wrappers (for state_dict and evaluation)."""
+    while True:
+        if isinstance(model, DistributedDataParallel):
+            model = model.module
+        elif hasattr(model, "_orig_mod"):  # torch.compile's OptimizedModule
+            model = model._orig_mod
+        else:
+            return model
+
+# --------------------------
+# Resumable training state
+# --------------------------
+def save_training_state(path: str, model, optimizer, scheduler, **progress):
+    """
+    Write everything needed to continue a run exactly: model, AdamW and LR-scheduler state,
+    the progress counters (epoch, samples already seen this epoch, running train loss,
+    best test BCE, shuffle seed) and the RNG states. Written atomically so a preempted
+    save never leaves a truncated checkpoint behind.
+    """
+    state = {
+        "model": unwrap(model).state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "scheduler": scheduler.state_dict(),
+        "rng": {
+            "torch": torch.get_rng_state(),
+            "numpy": np.random.get_state(),
+            "python": random.getstate(),
+        },
+        **progress,
+    }
+    tmp_path = path + ".tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+def load_training_state(path: str) -> dict:
+    # weights_only=False: the checkpoint also holds numpy/python RNG state (our own file)
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+def restore_rng_state(rng: dict):
+    torch.set_rng_state(rng["torch"])
+    np.random.set_state(rng["numpy"])
+    random.setstate(rng["python"])
+
 # --------------------------
 # Evaluation
 # --------------------------
@@ -59,20 +159,20 @@ def evaluate_model(model, loader, device, wdl_lambda: float = 1.0, eval_scale: f
       - mse (avg per sample) on probabilities
       - baseline_mse (predict mean target) on this loader
       - r2 (on probabilities vs targets)
+    In distributed mode each rank evaluates its shard and the totals are summed.
     """
+    model = unwrap(model)
     model.eval()
 
     bce = nn.BCEWithLogitsLoss(reduction="sum")  # sum then /N
-    total_bce = 0.0
 
-    # For MSE / baseline / R2 we work in probability space
-    total_mse = 0.0
-    total_targets_sum = 0.0
-    total_targets_sq_sum = 0.0
+    # Sums of bce, squared error (MSE / baseline / R2 work in probability space), target and
+    # target^2, accumulated on the device: one host sync at the end instead of four per batch.
+    totals = DeviceSum(4, device)
     total_samples = 0
 
     for x, wdl, eval_cp in loader:
-        x = x.to(device, non_blocking=True)
+        x = to_device(x, device)
         wdl = wdl.to(device, non_blocking=True).float().view(-1, 1)
         eval_cp = eval_cp.to(device, non_blocking=True).float().view(-1, 1)
         
@@ -80,15 +180,18 @@ def evaluate_model(model, loader, device, wdl_lambda: float = 1.0, eval_scale: f
         y = blend_targets(wdl, eval_cp, wdl_lambda, eval_scale)
 
         logits = model(x)
-        total_bce += bce(logits, y).item()
-
         p = torch.sigmoid(logits)
-        total_mse += torch.sum((p - y) ** 2).item()
-
-        total_targets_sum += torch.sum(y).item()
-        total_targets_sq_sum += torch.sum(y ** 2).item()
+        totals.add(torch.stack([
+            bce(logits, y),
+            torch.sum((p - y) ** 2),
+            torch.sum(y),
+            torch.sum(y ** 2),
+        ]))
         total_samples += y.numel()
 
+    total_bce, total_mse, total_targets_sum, total_targets_sq_sum, total_samples = all_reduce_sum(
+        totals.tolist() + [total_samples]
+    )
     avg_bce = total_bce / total_samples
     avg_mse = total_mse / total_samples
 
@@ -102,6 +205,38 @@ def evaluate_model(model, loader, device, wdl_lambda: float = 1.0, eval_scale: f
 
     return avg_bce, avg_mse, baseline_mse, r2
 
+class EarlyStopping:
+    """
+    Plateau detection on the validation BCE: a value counts as an improvement when it beats
+    the best so far by more than min_delta; after `patience` evaluations in a row without
+    one, should_stop is set. patience=0 never stops.
+    """
+    def __init__(self, patience: int = 0, min_delta: float = 0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best = float("inf")
+        self.bad_evals = 0
+
+    @property
+    def should_stop(self) -> bool:
+        return self.patience > 0 and self.bad_evals >= self.patience
+
+    def update(self, value: float) -> bool:
+        """Record one evaluation; returns True if it improved on the best."""
+        if value < self.best - self.min_delta:
+            self.best = value
+            self.bad_evals = 0
+            return True
+        self.bad_evals += 1
+        return False
+
+    def state_dict(self) -> dict:
+        return {"best": self.best, "bad_evals": self.bad_evals}
+
+    def load_state_dict(self, state: dict):
+        self.best = state["best"]
+        self.bad_evals = state["bad_evals"]
+
 # --------------------------
 # Training
 # --------------------------
@@ -119,7 +254,35 @@ def train_phase(
     min_lr_ratio: float = 0.01,
     wdl_lambda: float = 1.0,
     eval_scale: float = 400.0,
+    checkpoint_path: str | None = None,
+    checkpoint_every: int = 0,
+    resume_state: dict | None = None,
+    seed: int | None = None,
+    eval_loader=None,
+    eval_every: int = 0,
+    patience: int = 0,
+    min_delta: float = 0.0,
+    precision: str = "fp32",
 ):
+    """
+    With checkpoint_path, the full training state is saved there after every epoch and,
+    with checkpoint_every > 0, every checkpoint_every batches (see save_training_state).
+    resume_state (from load_training_state) continues such a run at the exact batch it
+    stopped at; the train loader must use the same seed so the epoch order is the same.
+
+    Early stopping: eval_loader (typically a fixed subsample of the test split, defaults to
+    test_loader) is evaluated every eval_every batches and at the end of each epoch; after
+    `patience` evaluations without a min_delta improvement of its BCE, training ends.
+    The full test_loader evaluation (report, best-weights checkpoint) still runs per epoch.
+
+    precision="bf16" runs the training forward pass under bfloat16 autocast; the parameters,
+    optimizer state, loss and evaluation stay fp32, so save_f32_weights exports fp32 master
+    weights either way. Pass a torch.compile'd model for the compiled path.
+    """
+    if precision not in ("fp32", "bf16"):
+        raise ValueError(f"precision must be 'fp32' or 'bf16', got {precision!r}")
+    use_bf16 = precision == "bf16"
+    mode = precision + (" compiled" if hasattr(model, "_orig_mod") else "")
     print(f"\n=== Starting {phase_name} ===")
 
     optimizer = optim.AdamW(model.parameters(), lr=learning_rate, weight_decay=weight_decay)
@@ -150,17 +313,62 @@ def train_phase(
         print(f"  Using cosine annealing (min_lr={min_lr:.2e})")
 
     best_test_bce = float("inf")
+    start_epoch = 1
+    start_seen = 0
+    stopper = EarlyStopping(patience, min_delta)
+    if eval_loader is None:
+        eval_loader = test_loader
+
+    if resume_state is not None:
+        unwrap(model).load_state_dict(resume_state["model"])
+        optimizer.load_state_dict(resume_state["optimizer"])
+        scheduler.load_state_dict(resume_state["scheduler"])
+        restore_rng_state(resume_state["rng"])
+        best_test_bce = resume_state["best_test_bce"]
+        start_epoch = resume_state["epoch"]
+        start_seen = resume_state["seen"]
+        if "early_stopping" in resume_state:
+            stopper.load_state_dict(resume_state["early_stopping"])
+        print(f"  Resuming at epoch {start_epoch} after {start_seen:,} samples")
+
+    def checkpoint(epoch, seen, total_bce, total_samples):
+        # Collective in distributed mode, so every rank calls it at the same step.
+        # Rank 0 keeps the loss totals of all ranks; seen is per rank (equal shards).
+        total_bce, total_samples = all_reduce_sum([total_bce, total_samples])
+        if is_main_process():
+            save_training_state(
+                checkpoint_path, model, optimizer, scheduler,
+                epoch=epoch, seen=seen, total_bce=total_bce, total_samples=total_samples,
+                best_test_bce=best_test_bce, seed=seed, early_stopping=stopper.state_dict(),
+            )
+
+    def validate(epoch, step):
+        bce = evaluate_model(model, eval_loader, device, wdl_lambda, eval_scale)[0]
+        improved = stopper.update(bce)
+        print(f"  [epoch {epoch} step {step}] Val BCE: {bce:.6f}"
+              f"{' (best)' if improved else f' ({stopper.bad_evals}/{patience} without improvement)'}")
 
     print(f"  Target blend: {wdl_lambda:.0%} WDL + {1-wdl_lambda:.0%} eval (scale={eval_scale})")
 
-    for epoch in range(1, num_epochs + 1):
+    for epoch in range(start_epoch, num_epochs + 1):
         model.train()
-        total_bce = 0.0
+        # Summed on the device like in evaluate_model; read back once per epoch/checkpoint
+        total_bce = DeviceSum(1, device)
         total_samples = 0
+        seen = 0
+        if epoch == start_epoch and start_seen:
+            seen = start_seen
+            if is_main_process():
+                total_bce.offset = resume_state["total_bce"]
+                total_samples = resume_state["total_samples"]
         current_lr = optimizer.param_groups[0]['lr']
+        set_sampler_epoch(train_loader, epoch, start=seen)
+        step = 0
+        epoch_start = time.perf_counter()
+        epoch_samples = 0
 
         for x, wdl, eval_cp in train_loader:
-            x = x.to(device, non_blocking=True)
+            x = to_device(x, device)
             wdl = wdl.to(device, non_blocking=True).float().view(-1, 1)
             eval_cp = eval_cp.to(device, non_blocking=True).float().view(-1, 1)
             
@@ -168,9 +376,10 @@ def train_phase(
             y = blend_targets(wdl, eval_cp, wdl_lambda, eval_scale)
 
             optimizer.zero_grad(set_to_none=True)
-            logits = model(x)
+            with torch.autocast(device.type, dtype=torch.bfloat16, enabled=use_bf16):
+                logits = model(x)
 
-            loss = loss_fn(logits, y)  # summed
+            loss = loss_fn(logits.float(), y)  # summed
             loss.backward()
 
             if grad_clip is not None and grad_clip > 0:
@@ -178,35 +387,122 @@ def train_phase(
 
             optimizer.step()
 
-            total_bce += loss.item()
+            total_bce.add(loss.detach().view(1))
             total_samples += y.numel()
+            seen += y.numel()
+            epoch_samples += y.numel()
+            step += 1
+
+            if eval_every > 0 and step % eval_every == 0:
+                eval_start = time.perf_counter()
+                validate(epoch, step)
+                model.train()
+                epoch_start += time.perf_counter() - eval_start  # keep it out of the throughput
+                if stopper.should_stop:
+                    break
+
+            if checkpoint_path and checkpoint_every > 0 and step % checkpoint_every == 0:
+                checkpoint(epoch, seen, total_bce.tolist()[0], total_samples)
+
+        # Training throughput of this epoch, without validation
+        epoch_time = time.perf_counter() - epoch_start
+        samples_per_sec = all_reduce_sum([epoch_samples])[0] / max(epoch_time, 1e-9)
 
         # Step the scheduler after each epoch
         scheduler.step()
 
+        total_bce, total_samples = all_reduce_sum([total_bce.tolist()[0], total_samples])
         train_bce = total_bce / total_samples
 
         # Evaluate every epoch (your epochs=5 anyway)
         test_bce, test_mse, baseline_mse, r2 = evaluate_model(model, test_loader, device, wdl_lambda, eval_scale)
 
         print(f"Epoch [{epoch}/{num_epochs}] (lr={current_lr:.2e})")
-        print(f"  Train BCE: {train_bce:.6f}")
+        print(f"  Train BCE: {train_bce:.6f} | {samples_per_sec:,.0f} samples/s ({mode})")
         print(f"  Test  BCE: {test_bce:.6f}")
         print(f"  Test  MSE(prob): {test_mse:.6f} | baseline MSE: {baseline_mse:.6f} | R^2: {r2:.4f}")
 
         if test_bce < best_test_bce:
             best_test_bce = test_bce
             checkpoint_name = f"nnue_weights_{phase_name.lower().replace(' ', '_')}.pth"
-            torch.save(model.state_dict(), checkpoint_name)
+            if is_main_process():
+                torch.save(unwrap(model).state_dict(), checkpoint_name)
             print(f"  New best test BCE! Saved to {checkpoint_name}")
 
+        if not stopper.should_stop:
+            if eval_loader is test_loader:
+                stopper.update(test_bce)
+            else:
+                validate(epoch, step)
+
+        if checkpoint_path:
+            checkpoint(epoch + 1, 0, 0.0, 0)
+
+        if stopper.should_stop:
+            print(f"  Early stopping: no improvement in {patience} evaluations "
+                  f"(best val BCE {stopper.best:.6f})")
+            break
+
     print(f"=== Completed {phase_name} ===")
     return best_test_bce
 
 # --------------------------
 # Main
 # --------------------------
-if __name__ == "__main__":
+def build_datasets(path: str, val_path: str | None = None, sparse: bool = False, feature_cache: bool = False):
+    """
+    (train_ds, test_ds, shuffle_train): the pre-split files when val_path is given,
+    otherwise an interleaved 90/10 split of `path`.
+    """
+    if val_path is not None:
+        # Pre-shuffled train/validation files: stream both sequentially.
+        train_ds = ChessBitboardDataset(path, sparse=sparse, feature_cache=feature_cache)
+        test_ds = ChessBitboardDataset(val_path, sparse=sparse, feature_cache=feature_cache)
+        shuffle_train = False
+    else:
+        # NOTE: Without --shuffle/--val-fraction the preprocessor writes category blocks.
+        # A contiguous 90/10 split will therefore create a big distribution shift.
+        # Use an interleaved split without huge index lists (Windows-friendly):
+        #   train = records where (idx % 10) in [0..8]
+        #   test  = records where (idx % 10) == 9
+        split_mod = 10
+        train_keep = 9
+        train_ds = ChessBitboardDataset(
+            path,
+            start_idx=0,
+            split_modulus=split_mod,
+            split_remainder_start=0,
+            split_remainder_count=train_keep,
+            sparse=sparse,
+            feature_cache=feature_cache,
+        )
+        test_ds = ChessBitboardDataset(
+            path,
+            start_idx=0,
+            split_modulus=split_mod,
+            split_remainder_start=train_keep,
+            split_remainder_count=1,
+            sparse=sparse,
+            feature_cache=feature_cache,
+        )
+        shuffle_train = True
+    return train_ds, test_ds, shuffle_train
+
+def run(rank: int, world_size: int, args):
+    """
+    Train in this process. With world_size > 1 this is one of world_size local gloo ranks
+    (started by mp.spawn or torchrun): each rank trains on a disjoint shard of the data,
+    DistributedDataParallel averages the gradients, and only rank 0 prints and writes files.
+    """
+    if world_size > 1:
+        os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+        os.environ.setdefault("MASTER_PORT", str(args.master_port))
+        dist.init_process_group("gloo", rank=rank, world_size=world_size)
+        # Split the cores between the ranks instead of oversubscribing them
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+        if rank != 0:
+            sys.stdout = open(os.devnull, "w")
+
     # seed_all(1234)
 
     print(f"XPU: {torch.xpu.is_available()}")
@@ -220,39 +516,28 @@ if __name__ == "__main__":
     wdl_lambda = 0.6  # 0.0 = pure eval, 1.0 = pure game result
     eval_scale = 400.0  # scale factor for eval -> probability conversion
 
-    if len(sys.argv) < 2:
-        print("Usage: uv run 1_train.py <path_to_data_file>")
-        sys.exit(1)
-    path = sys.argv[1]
-
-    # Get total size without loading memmap
-    import os
-    total_positions = os.path.getsize(path) // 73  # RECORD_SIZE = 73
-    print(f"Total positions in file: {total_positions:,}")
-
-    # NOTE: The preprocessor currently does NOT shuffle the file; it writes category blocks.
-    # A contiguous 90/10 split will therefore create a big distribution shift.
-    # Use an interleaved split without huge index lists (Windows-friendly):
-    #   train = records where (idx % 10) in [0..8]
-    #   test  = records where (idx % 10) == 9
-    split_mod = 10
-    train_keep = 9
-    train_ds = ChessBitboardDataset(
-        path,
-        start_idx=0,
-        end_idx=total_positions,
-        split_modulus=split_mod,
-        split_remainder_start=0,
-        split_remainder_count=train_keep,
-    )
-    test_ds = ChessBitboardDataset(
-        path,
-        start_idx=0,
-        end_idx=total_positions,
-        split_modulus=split_mod,
-        split_remainder_start=train_keep,
-        split_remainder_count=1,
+    path = args.path
+
+    resume_state = None
+    if args.resume:
+        if not os.path.exists(args.checkpoint):
+            raise FileNotFoundError(f"--resume: no training state at {args.checkpoint}")
+        resume_state = load_training_state(args.checkpoint)
+        print(f"Loaded training state from {args.checkpoint}")
+
+    # A fixed shuffle seed makes every epoch's order reproducible, which --resume relies on.
+    # Distributed ranks must agree on it, so they default to 0.
+    seed = args.seed
+    if resume_state is not None:
+        seed = resume_state["seed"]
+    elif seed is None:
+        seed = 0 if world_size > 1 else random.randrange(2**31)
+
+    train_ds, test_ds, shuffle_train = build_datasets(
+        path, args.val, sparse=args.sparse, feature_cache=args.feature_cache,
     )
+    # Record count from the file header or size (raw or packed, see data.open_records)
+    print(f"Total positions in file: {train_ds.total_n:,}")
 
     train_size = len(train_ds)
     test_size = len(test_ds)
@@ -264,7 +549,9 @@ if __name__ == "__main__":
     
     # Load existing weights if available
     weights_path = "nnue_weights_final.pth"
-    if os.path.exists(weights_path):
+    if resume_state is not None:
+        print("Weights come from the resumed training state.")
+    elif os.path.exists(weights_path):
         print(f"Loading existing weights from {weights_path}...")
         model.load_state_dict(torch.load(weights_path, weights_only=True))
         print("Weights loaded successfully!")
@@ -273,13 +560,57 @@ if __name__ == "__main__":
     
     print_model_summary(model)
 
-    device = torch.device("xpu" if torch.xpu.is_available() else "cpu")
-    model = model.to(device)
+    if world_size > 1:
+        # gloo ranks train on the CPU
+        device = torch.device("cpu")
+        model = DistributedDataParallel(model.to(device))
+        print(f"Distributed training on {world_size} processes (gloo), "
+              f"{torch.get_num_threads()} threads each")
+    else:
+        device = torch.device("xpu" if torch.xpu.is_available() else "cpu")
+        model = model.to(device)
+
+    if args.precision == "bf16" and device.type == "cpu":
+        # bf16 matmuls are only fast with AVX512-BF16/AMX; elsewhere they are emulated
+        print(f"bf16 autocast on CPU (capability: {torch.backends.cpu.get_cpu_capability()})")
+    if args.compile:
+        print("Compiling the model with torch.compile (the first batches are slow)...")
+        model = torch.compile(model)
 
     print(f"Training on {train_size:,} positions, testing on {test_size:,} positions...")
 
-    train_loader = make_dataloader(train_ds, batch_size=batch_size, shuffle=True)
-    test_loader = make_dataloader(test_ds, batch_size=batch_size, shuffle=False)
+    train_loader = make_dataloader(
+        train_ds,
+        batch_size=batch_size,
+        num_workers=args.loader_workers,
+        shuffle=shuffle_train,
+        block_size=args.block_size,
+        window_blocks=args.window_blocks,
+        seed=seed,
+        rank=rank,
+        world_size=world_size,
+    )
+    test_loader = make_dataloader(
+        test_ds,
+        batch_size=batch_size,
+        num_workers=args.loader_workers,
+        shuffle=False,
+        rank=rank,
+        world_size=world_size,
+    )
+    eval_loader = None
+    if args.eval_every > 0:
+        # Fixed random subsample of the test split (same positions every evaluation)
+        eval_loader = make_dataloader(
+            test_ds,
+            batch_size=batch_size,
+            num_workers=args.loader_workers,
+            shuffle=False,
+            seed=seed,
+            rank=rank,
+            world_size=world_size,
+            subsample=args.eval_samples,
+        )
 
     print("\n" + "=" * 60)
     print("PHASE: Training WDL (prob targets in [0,1])")
@@ -295,6 +626,15 @@ if __name__ == "__main__":
         learning_rate=lr,
         wdl_lambda=wdl_lambda,
         eval_scale=eval_scale,
+        checkpoint_path=args.checkpoint,
+        checkpoint_every=args.checkpoint_every,
+        resume_state=resume_state,
+        seed=seed,
+        eval_loader=eval_loader,
+        eval_every=args.eval_every,
+        patience=args.patience,
+        min_delta=args.min_delta,
+        precision=args.precision,
     )
 
     print("\n" + "=" * 60)
@@ -302,6 +642,67 @@ if __name__ == "__main__":
     print("=" * 60)
     print(f"Best test BCE: {best_bce:.6f}")
 
-    save_f32_weights(model, "nnue_weights.bin")
-    torch.save(model.state_dict(), "nnue_weights_final.pth")
-    print("Final model saved to nnue_weights.bin and nnue_weights_final.pth")
+    if is_main_process():
+        save_f32_weights(unwrap(model), "nnue_weights.bin")
+        # Read it back the way a consumer would (header, checksum, sizes)
+        load_f32_weights("nnue_weights.bin", hidden_size=unwrap(model).hidden.out_features)
+        torch.save(unwrap(model).state_dict(), "nnue_weights_final.pth")
+        print("Final model saved to nnue_weights.bin and nnue_weights_final.pth")
+
+    if world_size > 1:
+        dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the NNUE network")
+    parser.add_argument("path", help="Training data file (record_dtype rows, or packed records, see packed.py)")
+    parser.add_argument("--val", default=None,
+                        help="Validation file written by the preprocessor (--val-fraction). "
+                             "Both files are then read sequentially since they are already shuffled.")
+    parser.add_argument("--sparse", action="store_true",
+                        help="Feed active feature indices to an EmbeddingBag-style first layer "
+                             "instead of dense 768-float planes")
+    parser.add_argument("--feature-cache", action="store_true",
+                        help="Decode the data once into a <file>.features cache and train from it; "
+                             "rebuilt automatically when the data file changes")
+    parser.add_argument("--block-size", type=int, default=None,
+                        help="Shuffle contiguous blocks of this many positions instead of single positions "
+                             "(keeps memmap reads local once the file no longer fits in page cache)")
+    parser.add_argument("--window-blocks", type=int, default=16,
+                        help="Number of blocks shuffled together in memory with --block-size")
+    parser.add_argument("--procs", type=int, default=1,
+                        help="Data-parallel CPU training with this many local processes (gloo). "
+                             "Also picks up WORLD_SIZE/RANK when started by torchrun")
+    parser.add_argument("--master-port", type=int, default=29500,
+                        help="Rendezvous port for --procs")
+    parser.add_argument("--loader-workers", type=int, default=4,
+                        help="DataLoader worker processes (per training process)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Shuffle seed (random by default, 0 with --procs since all ranks must agree)")
+    parser.add_argument("--checkpoint", default="nnue_training_state.pt",
+                        help="Full training state (model, optimizer, scheduler, data position, RNG), "
+                             "written after every epoch")
+    parser.add_argument("--checkpoint-every", type=int, default=1000,
+                        help="Also write the training state every N batches (0 = only per epoch)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue exactly where the run that wrote --checkpoint stopped")
+    parser.add_argument("--eval-every", type=int, default=0,
+                        help="Validate on a fixed subsample of the test split every N batches (0 = off)")
+    parser.add_argument("--eval-samples", type=int, default=65536,
+                        help="Size of the --eval-every validation subsample")
+    parser.add_argument("--patience", type=int, default=0,
+                        help="Stop after this many validations without improvement (0 = run all epochs)")
+    parser.add_argument("--min-delta", type=float, default=0.0,
+                        help="Minimum val BCE decrease that counts as an improvement")
+    parser.add_argument("--compile", action="store_true",
+                        help="Train a torch.compile'd model")
+    parser.add_argument("--precision", choices=["fp32", "bf16"], default="fp32",
+                        help="bf16 runs the forward pass under bfloat16 autocast (fp32 master weights)")
+    args = parser.parse_args()
+
+    if "WORLD_SIZE" in os.environ and int(os.environ["WORLD_SIZE"]) > 1:
+        run(int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"]), args)
+    elif args.procs > 1:
+        mp.spawn(run, args=(args.procs, args), nprocs=args.procs)
+    else:
+        run(0, 1, args)
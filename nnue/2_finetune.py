@@ -1,4 +1,181 @@
+"""
+Quantization-aware fine-tuning.
+
+Loads the float network from 1_train.py and keeps training it with the forward pass the
+engine's integer path computes: weights are fake-quantized to the QA / QB grids (and
+clamped like quantization.py does), the hidden layer is the integer CReLU clamp(acc, 0, QA)
+expressed in float. Rounding uses a straight-through estimator so gradients still reach
+the float master weights. The exported weights are snapped to the grids, so 3_quantize.py
+converts them to integers without any loss.
+
+    python 2_finetune.py preprocessed_positions.bin --weights nnue_weights_final.pth
+"""
+import argparse
+import importlib
+import os
+
+import numpy as np
 import torch
+import torch.nn.functional as F
+
+from data import make_dataloader
+from model_information import load_f32_weights, print_model_summary, save_f32_weights
+from quantization import (
+    HIDDEN_WEIGHT_LIMIT,
+    QA,
+    QB,
+    dequantized_weights,
+    float_eval,
+    quantize_state_dict,
+    quantized_eval,
+    write_quantized,
+)
+
+train = importlib.import_module("1_train")
+
+
+def fake_quantize(x: torch.Tensor, scale: float, low: int, high: int) -> torch.Tensor:
+    """
+    round(clamp(x * scale, low, high)) / scale with a straight-through estimator: the
+    rounding passes gradients unchanged, values clamped at the bounds get none.
+    """
+    x = torch.clamp(x, low / scale, high / scale)
+    return x + (torch.round(x * scale) / scale - x).detach()
+
+
+class QATNNUE(train.NNUE):
+    """
+    NNUE whose forward pass matches the quantized engine network exactly (up to the final
+    integer truncation). Same parameters as NNUE, so state_dicts are interchangeable.
+    """
+    def __init__(self, input_size: int, hidden_size: int = 16, output_dtype: str = "int8"):
+        super().__init__(input_size, hidden_size)
+        info = np.iinfo(output_dtype)
+        self.output_dtype = output_dtype
+        self.output_range = (int(info.min), int(info.max))
+
+    def forward(self, x) -> torch.Tensor:
+        w = fake_quantize(self.hidden.weight, QA, -HIDDEN_WEIGHT_LIMIT, HIDDEN_WEIGHT_LIMIT)
+        b = fake_quantize(self.hidden.bias, QA, -HIDDEN_WEIGHT_LIMIT, HIDDEN_WEIGHT_LIMIT)
+        if isinstance(x, (tuple, list)):
+            indices, offsets = x
+            h = F.embedding_bag(indices, w.t().contiguous(), offsets, mode="sum") + b
+        else:
+            h = F.linear(x, w, b)
+        # Integer CReLU clamp(acc, 0, QA) / QA: the accumulator is already on the 1/QA grid
+        h = torch.clamp(h, 0.0, 1.0)
+        ow = fake_quantize(self.output.weight, QB, *self.output_range)
+        ob = fake_quantize(self.output.bias, QA * QB, np.iinfo(np.int32).min, np.iinfo(np.int32).max)
+        return F.linear(h, ow, ob)
+
+    def snapped_state_dict(self) -> dict:
+        """State dict with every weight on its quantization grid (exactly what the engine gets)."""
+        quantized, _ = quantize_state_dict(self.state_dict(), output_dtype=self.output_dtype)
+        hidden_weight, hidden_bias, output_weight, output_bias = dequantized_weights(quantized)
+        return {
+            "hidden.weight": torch.from_numpy(hidden_weight),
+            "hidden.bias": torch.from_numpy(hidden_bias),
+            "output.weight": torch.from_numpy(output_weight).view(1, -1),
+            "output.bias": torch.tensor([output_bias], dtype=torch.float32),
+        }
+
+
+def load_qat_model(weights_path: str, output_dtype: str = "auto") -> QATNNUE:
+    """QATNNUE initialised from a float NNUE state_dict (hidden size read from the weights)."""
+    state_dict = torch.load(weights_path, map_location="cpu", weights_only=True)
+    input_size = state_dict["hidden.weight"].shape[1]
+    hidden_size = state_dict["hidden.weight"].shape[0]
+    if output_dtype == "auto":
+        output_dtype = quantize_state_dict(state_dict)[0].output_weights.dtype.name
+    model = QATNNUE(input_size, hidden_size, output_dtype=output_dtype)
+    model.load_state_dict(state_dict)
+    return model
+
+
+def quantization_gap(state_dict, loader, max_batches: int = 8) -> float:
+    """Max |float eval - integer eval| in centipawns over a few batches of (dense) planes."""
+    quantized, _ = quantize_state_dict(state_dict)
+    worst = 0.0
+    for i, (x, _, _) in enumerate(loader):
+        if i == max_batches:
+            break
+        planes = x.numpy()
+        worst = max(worst, float(np.abs(quantized_eval(quantized, planes) - float_eval(state_dict, planes)).max()))
+    return worst
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantization-aware fine-tuning of a trained NNUE")
+    parser.add_argument("path", help="Training data file (record_dtype)")
+    parser.add_argument("--val", default=None, help="Validation file (see 1_train.py --val)")
+    parser.add_argument("--weights", default="nnue_weights_final.pth", help="Float weights from 1_train.py")
+    parser.add_argument("--output-dtype", choices=["auto", "int8", "int16"], default="auto",
+                        help="Engine output weight type to train for (auto: whatever 3_quantize would pick)")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--lr", type=float, default=5e-4)
+    parser.add_argument("--batch-size", type=int, default=8192)
+    parser.add_argument("--loader-workers", type=int, default=4)
+    parser.add_argument("--sparse", action="store_true", help="See 1_train.py --sparse")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--patience", type=int, default=0, help="See 1_train.py --patience")
+    parser.add_argument("-o", "--output", default="nnue_weights_qat",
+                        help="Output prefix: <prefix>.pth, <prefix>.bin (float) and <prefix>_quantized.bin")
+    args = parser.parse_args()
+
+    # Same blend as 1_train.py
+    wdl_lambda = 0.6
+    eval_scale = 400.0
+
+    model = load_qat_model(args.weights, args.output_dtype)
+    print(f"Loaded {args.weights}; fine-tuning for {model.output_dtype} output weights")
+    print_model_summary(model)
+
+    train_ds, test_ds, shuffle_train = train.build_datasets(args.path, args.val, sparse=args.sparse)
+    train_loader = make_dataloader(
+        train_ds, batch_size=args.batch_size, num_workers=args.loader_workers,
+        shuffle=shuffle_train, seed=args.seed,
+    )
+    test_loader = make_dataloader(test_ds, batch_size=args.batch_size, num_workers=args.loader_workers)
+    device = torch.device("cpu")
+
+    # Starting point: the naively quantized network
+    bce, _, _, _ = train.evaluate_model(model, test_loader, device, wdl_lambda, eval_scale)
+    print(f"Quantized test BCE before fine-tuning: {bce:.6f}")
+
+    phase_name = "QAT fine-tune"
+    train.train_phase(
+        model,
+        train_loader,
+        test_loader,
+        device,
+        phase_name=phase_name,
+        num_epochs=args.epochs,
+        learning_rate=args.lr,
+        warmup_epochs=0,
+        wdl_lambda=wdl_lambda,
+        eval_scale=eval_scale,
+        seed=args.seed,
+        patience=args.patience,
+    )
+
+    # Continue from the best epoch, like 1_train.py's best-weights checkpoint
+    best_path = f"nnue_weights_{phase_name.lower().replace(' ', '_')}.pth"
+    if os.path.exists(best_path):
+        model.load_state_dict(torch.load(best_path, map_location="cpu", weights_only=True))
 
+    snapped = model.snapped_state_dict()
+    export = train.NNUE(model.input_size, model.hidden.out_features)
+    export.load_state_dict(snapped)
+    torch.save(snapped, f"{args.output}.pth")
+    save_f32_weights(export, f"{args.output}.bin")
+    load_f32_weights(f"{args.output}.bin", hidden_size=export.hidden.out_features)
+    quantized, report = quantize_state_dict(snapped, output_dtype=model.output_dtype)
+    assert report == (0, 0, 0), "snapped weights must quantize without clamping"
+    write_quantized(quantized, f"{args.output}_quantized.bin")
 
-weights = torch.load("nnue_weights_trained.pth")
+    # Plain dense loader for the float-vs-integer check
+    check_ds, _, _ = train.build_datasets(args.path, args.val)
+    check_loader = make_dataloader(check_ds, batch_size=args.batch_size, num_workers=0, pin_memory=False)
+    gap = quantization_gap(snapped, check_loader)
+    print(f"Max float vs integer eval difference: {gap:.3f} cp (integer truncation only, at most 1 cp)")
+    print(f"Saved {args.output}.pth, {args.output}.bin and {args.output}_quantized.bin")
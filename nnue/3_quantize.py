@@ -1,2 +1,92 @@
 # https://github.com/google/gemmlowp/blob/master/doc/quantization.md
-# https://github.com/google/gemmlowp/blob/master/doc/output.md
\ No newline at end of file
+# https://github.com/google/gemmlowp/blob/master/doc/output.md
+"""
+Quantize a trained NNUE for the engine's integer path and report the eval error.
+
+    python 3_quantize.py nnue_weights_final.pth preprocessed_positions.bin -o nnue_weights_q.bin
+
+Writes the versioned int16/int8 file described in quantization.py, reads it back, and
+compares the engine eval (centipawns) of the float and the quantized model on a random
+sample of positions from the data file.
+"""
+import argparse
+import os
+
+import numpy as np
+import torch
+
+from data import _planes_from_records, open_records
+from quantization import (
+    HIDDEN_WEIGHT_LIMIT,
+    QA,
+    QB,
+    float_eval,
+    quantize_state_dict,
+    quantized_eval,
+    read_quantized,
+    write_quantized,
+)
+
+
+def sample_planes(data_path: str, samples: int, seed: int = 0) -> np.ndarray:
+    """(N, 768) planes of a random sample of records (read in file order)."""
+    records = open_records(data_path)  # raw or packed record file
+    n = len(records)
+    if samples < n:
+        indices = np.sort(np.random.default_rng(seed).choice(n, size=samples, replace=False))
+        recs = records[indices]
+    else:
+        recs = np.array(records[:])
+    return _planes_from_records(recs)
+
+
+def print_error_report(float_cp: np.ndarray, quant_cp: np.ndarray):
+    err = quant_cp - float_cp
+    abs_err = np.abs(err)
+    print("=== Quantization error (engine eval, centipawns) ===")
+    print(f"Positions:        {len(err):,}")
+    print(f"Mean abs error:   {abs_err.mean():.3f}")
+    print(f"RMS error:        {np.sqrt(np.mean(err ** 2)):.3f}")
+    print(f"Mean error:       {err.mean():+.3f}")
+    print(f"99th pct error:   {np.percentile(abs_err, 99):.3f}")
+    print(f"Max abs error:    {abs_err.max():.3f}")
+    print(f"Within 1 cp:      {np.mean(abs_err <= 1):.2%}")
+    print(f"Within 10 cp:     {np.mean(abs_err <= 10):.2%}")
+    print(f"Same sign:        {np.mean(np.sign(np.trunc(float_cp)) == np.sign(quant_cp)):.2%}")
+    print("====================================================")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Quantize NNUE weights to the engine's integer format")
+    parser.add_argument("weights", help="Trained float weights (.pth state_dict from 1_train.py)")
+    parser.add_argument("data", nargs="?", default=None,
+                        help="Record file to sample positions from for the error report")
+    parser.add_argument("-o", "--output", default="nnue_weights_quantized.bin")
+    parser.add_argument("--output-dtype", choices=["auto", "int8", "int16"], default="auto",
+                        help="Output weight type (auto: int8 unless a weight would be clamped)")
+    parser.add_argument("--samples", type=int, default=100_000,
+                        help="Positions sampled for the error report")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    state_dict = torch.load(args.weights, map_location="cpu", weights_only=True)
+    quantized, report = quantize_state_dict(state_dict, output_dtype=args.output_dtype)
+
+    print(f"Hidden size:    {quantized.hidden_size}")
+    print(f"QA={QA} QB={QB}, output weights {quantized.output_weights.dtype}")
+    print(f"Clamped to int16 accumulator bound (|w| <= {HIDDEN_WEIGHT_LIMIT}): "
+          f"{report.hidden_weights_clamped:,} weights, {report.hidden_bias_clamped:,} biases")
+    print(f"Clamped output weights: {report.output_weights_clamped:,}")
+
+    write_quantized(quantized, args.output)
+    # Verify the file (header, checksum, layout) by loading it the way a consumer would
+    quantized = read_quantized(args.output)
+    print(f"Wrote {args.output} ({os.path.getsize(args.output):,} bytes)")
+
+    if args.data is not None:
+        planes = sample_planes(args.data, args.samples, args.seed)
+        print_error_report(float_eval(state_dict, planes), quantized_eval(quantized, planes))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,45 @@
 NNUE Inference Script
 Load trained network weights and run inference on FEN positions.
 Uses the same feature encoding as the training script and outputs raw logits * 410.
+
+Batch mode evaluates a whole FEN / EPD file (or stdin) and streams CSV or JSON lines:
+
+    python 4_test_inference.py positions.epd --weights nnue_weights.bin -o evals.csv
+    cat positions.fen | python 4_test_inference.py - --format jsonl > evals.jsonl
+
+Server mode keeps the model loaded and answers HTTP on localhost (or a Unix socket),
+micro-batching requests that arrive within --window-ms into one forward pass:
+
+    python 4_test_inference.py --serve --port 8765
+    curl -d '{"fens": ["8/8/8/8/8/8/8/K6k w - - 0 1"]}' localhost:8765/eval
+    curl localhost:8765/stats
 """
 
+import argparse
+import collections
+import csv
+import itertools
+import json
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import torch
 import torch.nn as nn
 import numpy as np
 import struct
-from typing import Dict, Tuple
+from typing import Dict, Iterable, List, Tuple
+
+from data import record_dtype, _planes_from_records
+from model_information import load_f32_weights
+from numpy_nnue import fens_to_boards
+
+_PIECE_FIELDS = ("bb_pawns", "bb_knights", "bb_bishops", "bb_rooks", "bb_queens", "bb_kings")
 
 class NNUE(nn.Module):
     """NNUE model matching the training architecture"""
@@ -170,6 +202,361 @@ def evaluate_fen(model: NNUE, fen: str) -> float:
     
     return evaluation
 
+def _pack_squares(mask: np.ndarray) -> np.ndarray:
+    """(N, 64) bool in square order -> (N,) uint64 bitboards."""
+    packed = np.packbits(mask, axis=1, bitorder="little")
+    return np.ascontiguousarray(packed).view("<u8").reshape(-1)
+
+
+def fens_to_records(fens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse FEN or EPD lines (only the placement and side-to-move fields are used) into
+    record_dtype bitboards, all positions at once. Returns (records, valid); records of
+    malformed lines are left empty and marked False in valid.
+    """
+    boards, white_to_move, valid = fens_to_boards(fens)
+    occupied = boards >= 0
+    recs = np.zeros(len(fens), dtype=record_dtype)
+    recs["bb_white"] = _pack_squares(occupied & (boards >= 6))
+    recs["bb_black"] = _pack_squares(occupied & (boards < 6))
+    for p, field in enumerate(_PIECE_FIELDS):
+        recs[field] = _pack_squares(occupied & (boards % 6 == p))
+    recs["stm"] = np.where(white_to_move, 7, 0)
+    return recs, valid
+
+
+def load_model(weights_path: str) -> NNUE:
+    """NNUE from a .pth state_dict or a save_f32_weights .bin, hidden size taken from the file."""
+    if weights_path.endswith(".bin"):
+        state_dict = load_f32_weights(weights_path)
+    else:
+        state_dict = torch.load(weights_path, map_location="cpu", weights_only=True)
+    input_size = state_dict["hidden.weight"].shape[1]
+    hidden_size = state_dict["hidden.weight"].shape[0]
+    model = NNUE(input_size=input_size, hidden_size=hidden_size)
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model
+
+
+def evaluate_records(model: NNUE, recs: np.ndarray) -> np.ndarray:
+    """Side-to-move evaluations (logits * 410) of a record array, like evaluate_fen."""
+    with torch.inference_mode():
+        logits = model.forward_inference(torch.from_numpy(_planes_from_records(recs)))
+    evaluation = logits.reshape(-1).numpy() * 410
+    return np.where(recs["stm"] == 0, -evaluation, evaluation)
+
+
+def iter_positions(lines: Iterable[str]) -> Iterable[str]:
+    """Stripped FEN / EPD lines, skipping blanks and # comments."""
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+class ResultWriter:
+    """Streams (position, eval) rows as CSV or JSON lines; malformed positions get an empty eval."""
+    def __init__(self, out, fmt: str):
+        self.out = out
+        self.fmt = fmt
+        if fmt == "csv":
+            self.csv = csv.writer(out, lineterminator="\n")
+            self.csv.writerow(["position", "eval"])
+
+    def write(self, positions: List[str], evaluations: np.ndarray, valid: np.ndarray):
+        for position, evaluation, ok in zip(positions, evaluations.tolist(), valid.tolist()):
+            value = round(evaluation, 2) if ok else None
+            if self.fmt == "csv":
+                self.csv.writerow([position, "" if value is None else value])
+            else:
+                self.out.write(json.dumps({"position": position, "eval": value}) + "\n")
+        self.out.flush()
+
+
+def evaluate_stream(model: NNUE, lines: Iterable[str], writer: ResultWriter, batch_size: int = 16384) -> dict:
+    """Evaluate positions batch by batch, writing each batch before reading the next."""
+    stats = {"positions": 0, "invalid": 0, "parse_s": 0.0, "eval_s": 0.0, "total_s": 0.0}
+    start = time.perf_counter()
+    positions = iter_positions(lines)
+    while True:
+        batch = list(itertools.islice(positions, batch_size))
+        if not batch:
+            break
+        t0 = time.perf_counter()
+        recs, valid = fens_to_records(batch)
+        t1 = time.perf_counter()
+        evaluations = evaluate_records(model, recs)
+        t2 = time.perf_counter()
+        writer.write(batch, evaluations, valid)
+
+        stats["positions"] += len(batch)
+        stats["invalid"] += int(np.count_nonzero(~valid))
+        stats["parse_s"] += t1 - t0
+        stats["eval_s"] += t2 - t1
+    stats["total_s"] = time.perf_counter() - start
+    return stats
+
+
+def print_throughput(stats: dict, file=sys.stderr):
+    n = stats["positions"]
+    rate = lambda seconds: f"{n / seconds:,.0f} pos/s" if seconds > 0 else "n/a"
+    print(f"Evaluated {n:,} positions ({stats['invalid']:,} malformed) in {stats['total_s']:.2f}s", file=file)
+    print(f"  Overall:   {rate(stats['total_s'])}", file=file)
+    print(f"  Parsing:   {rate(stats['parse_s'])}", file=file)
+    print(f"  Inference: {rate(stats['eval_s'])}", file=file)
+
+
+class ServerStats:
+    """Thread-safe request / batch counters and a window of recent request latencies."""
+    def __init__(self, latency_window: int = 10000):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.positions = 0
+        self.batches = 0
+        self.eval_s = 0.0
+        self.latencies = collections.deque(maxlen=latency_window)
+
+    def record_batch(self, requests: int, positions: int, eval_s: float, latencies: List[float]):
+        with self.lock:
+            self.requests += requests
+            self.positions += positions
+            self.batches += 1
+            self.eval_s += eval_s
+            self.latencies.extend(latencies)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            uptime = time.perf_counter() - self.started
+            latencies = np.array(self.latencies) * 1000
+            snapshot = {
+                "uptime_s": round(uptime, 3),
+                "requests": self.requests,
+                "positions": self.positions,
+                "batches": self.batches,
+                "positions_per_batch": round(self.positions / max(self.batches, 1), 2),
+                "requests_per_batch": round(self.requests / max(self.batches, 1), 2),
+                "positions_per_s": round(self.positions / uptime, 1) if uptime > 0 else 0.0,
+                "eval_positions_per_s": round(self.positions / self.eval_s, 1) if self.eval_s > 0 else 0.0,
+            }
+        for name, q in (("p50", 50), ("p90", 90), ("p99", 99)):
+            snapshot[f"latency_{name}_ms"] = round(float(np.percentile(latencies, q)), 3) if len(latencies) else None
+        snapshot["latency_mean_ms"] = round(float(latencies.mean()), 3) if len(latencies) else None
+        return snapshot
+
+
+class MicroBatcher:
+    """
+    Evaluates FEN lists submitted from many threads on one worker thread. The first
+    pending request opens a window of window_ms; everything submitted before it closes
+    (up to max_positions) goes through the model as a single forward pass.
+    """
+    def __init__(self, model: NNUE, window_ms: float = 1.0, max_positions: int = 16384):
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_positions = max_positions
+        self.stats = ServerStats()
+        self.pending = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name="nnue-batcher", daemon=True)
+        self.worker.start()
+
+    def submit(self, fens: List[str]) -> Future:
+        """Future resolving to (evals, valid) for fens, like evaluate_records on their records."""
+        future = Future()
+        self.pending.put((list(fens), future, time.perf_counter()))
+        return future
+
+    def evaluate(self, fens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        return self.submit(fens).result()
+
+    def close(self):
+        self.pending.put(None)
+        self.worker.join()
+
+    def _collect(self, first) -> Tuple[list, bool]:
+        batch, size = [first], len(first[0])
+        deadline = time.perf_counter() + self.window
+        while size < self.max_positions:
+            # Past the deadline, still take whatever is already queued
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self.pending.get(timeout=timeout) if timeout > 0 else self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            size += len(item[0])
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            first = self.pending.get()
+            if first is None:
+                break
+            batch, stop = self._collect(first)
+            fens = [fen for item in batch for fen in item[0]]
+            try:
+                t0 = time.perf_counter()
+                recs, valid = fens_to_records(fens)
+                evaluations = evaluate_records(self.model, recs)
+                eval_s = time.perf_counter() - t0
+            except Exception as e:  # hand the failure to every waiting request
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            offset = 0
+            for request_fens, future, _ in batch:
+                end = offset + len(request_fens)
+                future.set_result((evaluations[offset:end], valid[offset:end]))
+                offset = end
+            self.stats.record_batch(len(batch), len(fens), eval_s, [done - submitted for _, _, submitted in batch])
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /eval with {"fens": [...]} (or {"fen": "..."}, or plain text, one FEN per line)
+    returns {"evals": [...]} (null for malformed positions); GET /stats returns the counters.
+    The MicroBatcher is self.server.batcher (see make_server).
+    """
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.batcher.stats.snapshot())
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/eval":
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+            if body.lstrip().startswith("{"):
+                request = json.loads(body)
+                fens = request["fens"] if "fens" in request else [request["fen"]]
+            else:
+                fens = list(iter_positions(body.splitlines()))
+            # Checked here: a bad item would fail every request merged into its batch
+            if not isinstance(fens, list) or not all(isinstance(fen, str) for fen in fens):
+                raise ValueError('"fens" must be a list of FEN strings ("fen" a single string)')
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {"error": f"bad request: {e}"})
+            return
+        try:
+            evaluations, valid = self.server.batcher.evaluate(fens)
+        except Exception as e:
+            self._send_json(500, {"error": f"evaluation failed: {e}"})
+            return
+        values = [round(v, 2) if ok else None for v, ok in zip(evaluations.tolist(), valid.tolist())]
+        self._send_json(200, {"evals": values})
+
+    def address_string(self):
+        # Unix socket clients have no (host, port)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def make_server(batcher: MicroBatcher, host: str = "127.0.0.1", port: int = 8765, unix_socket: str = None):
+    """HTTP server (TCP, or a Unix socket if unix_socket is given) answering from batcher."""
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, InferenceRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), InferenceRequestHandler)
+    server.batcher = batcher
+    return server
+
+
+def serve(model: NNUE, host: str, port: int, unix_socket: str, window_ms: float, max_positions: int):
+    batcher = MicroBatcher(model, window_ms=window_ms, max_positions=max_positions)
+    server = make_server(batcher, host, port, unix_socket)
+    where = unix_socket if unix_socket is not None else f"http://{host}:{server.server_address[1]}"
+    print(f"Serving NNUE evaluations on {where} (window {window_ms} ms, max batch {max_positions})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        print(json.dumps(batcher.stats.snapshot()), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate FEN / EPD positions with a trained NNUE")
+    parser.add_argument("input", nargs="?", default=None,
+                        help="FEN or EPD file, '-' for stdin (omit for the built-in tests and interactive mode)")
+    parser.add_argument("--weights", default="nnue_weights_final.pth",
+                        help="Weights (.pth state_dict or .bin from save_f32_weights)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("-o", "--output", default="-", help="Output file ('-' for stdout)")
+    parser.add_argument("--batch-size", type=int, default=16384)
+    parser.add_argument("--serve", action="store_true", help="Keep the model loaded and serve HTTP requests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", default=None, help="Serve on this Unix socket instead of TCP")
+    parser.add_argument("--window-ms", type=float, default=1.0,
+                        help="How long the first queued request waits for others to batch with")
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(load_model(args.weights), args.host, args.port, args.unix_socket, args.window_ms, args.batch_size)
+        return
+
+    if args.input is None:
+        print("NNUE Inference Script")
+        print("Loads trained weights and evaluates FEN positions")
+        print("Outputs raw logits * 410 (no sigmoid)")
+
+        # Run tests on standard positions
+        test_positions()
+
+        # Test positions from file
+        print("\n" + "=" * 80)
+        test_file_positions("test_positions.txt")
+
+        # Start interactive mode
+        interactive_mode()
+        return
+
+    model = load_model(args.weights)
+    source = sys.stdin if args.input == "-" else open(args.input, "r")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    try:
+        stats = evaluate_stream(model, source, ResultWriter(out, args.format), args.batch_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    print_throughput(stats)
+
+
 def test_positions():
     """Test the model on some standard chess positions"""
     
@@ -278,16 +665,4 @@ def interactive_mode():
             print(f"Error: {e}\n")
 
 if __name__ == "__main__":
-    print("NNUE Inference Script")
-    print("Loads trained weights and evaluates FEN positions")
-    print("Outputs raw logits * 410 (no sigmoid)")
-    
-    # Run tests on standard positions
-    test_positions()
-    
-    # Test positions from file
-    print("\n" + "=" * 80)
-    test_file_positions("test_positions.txt")
-    
-    # Start interactive mode
-    interactive_mode()
+    main()
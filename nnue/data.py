@@ -1,10 +1,11 @@
 
 from __future__ import annotations
+import itertools
 import os
 from typing import Optional, Sequence
 import numpy as np
 import torch
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler, Sampler, SequentialSampler
 
 RECORD_SIZE = 73  # bytes
 
@@ -74,6 +75,187 @@ def _planes_from_record(rec) -> np.ndarray:
     # Flatten piece features to (768,) and add side-to-move feature
     return planes.reshape(-1).astype(np.float32, copy=False)
 
+# Record fields combined into the 12 feature planes, in feature order:
+# black P, N, B, R, Q, K then white P, N, B, R, Q, K (see _planes_from_record)
+_PIECE_FIELDS = ("bb_pawns", "bb_knights", "bb_bishops", "bb_rooks", "bb_queens", "bb_kings")
+_COLOR_FIELDS = ("bb_black", "bb_white")
+
+def _piece_bitboards(recs: np.ndarray) -> np.ndarray:
+    """(N, 12) uint64 piece bitboards in feature order for a record array."""
+    bbs = np.empty((len(recs), 12), dtype=np.uint64)
+    for c, color in enumerate(_COLOR_FIELDS):
+        color_bb = recs[color]
+        for p, piece in enumerate(_PIECE_FIELDS):
+            bbs[:, c * 6 + p] = recs[piece] & color_bb
+    return bbs
+
+def _feature_bits(recs: np.ndarray) -> np.ndarray:
+    """(N, 768) uint8 0/1 features from a single unpackbits over all 12 bitboards."""
+    bbs = _piece_bitboards(recs).astype("<u8", copy=False)
+    return np.unpackbits(bbs.view(np.uint8), axis=1, bitorder="little")
+
+def _planes_from_records(recs: np.ndarray) -> np.ndarray:
+    """
+    Batched _planes_from_record: decode N records into an (N, 768) float32 array
+    with a single unpackbits over the little-endian bytes of all 12 bitboards.
+    """
+    return _feature_bits(recs).astype(np.float32)
+
+def _features_from_records(recs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sparse counterpart of _planes_from_records in torch EmbeddingBag layout:
+    the active feature indices of all N records as one flat int64 array, plus the
+    (N,) int64 offset of each record's first index. Same feature order as the planes.
+    """
+    rows, cols = np.nonzero(_feature_bits(recs))
+    offsets = np.zeros(len(recs), dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(recs))[:-1], out=offsets[1:])
+    return cols.astype(np.int64), offsets
+
+def open_records(path: str | os.PathLike):
+    """
+    Record array of a record file: a read-only memmap of raw record_dtype rows, or a
+    PackedRecords reader (same indexing) if the file is in the packed format (packed.py).
+    """
+    from packed import PackedRecords, is_packed_file
+    path = os.fspath(path)
+    if is_packed_file(path):
+        return PackedRecords(path)
+    size = os.path.getsize(path)
+    if size % RECORD_SIZE != 0:
+        raise ValueError(f"File size {size} not divisible by record size {RECORD_SIZE}.")
+    if size == 0:
+        return np.empty(0, dtype=record_dtype)
+    return np.memmap(path, dtype=record_dtype, mode="r")
+
+# Pre-decoded feature cache (see build_feature_cache). Each entry holds the active feature
+# indices padded with NO_FEATURE plus the targets, so training never touches the bitboards.
+FEATURE_CACHE_SUFFIX = ".features"
+FEATURE_CACHE_MAGIC = b"NNUEFC01"
+MAX_ACTIVE_FEATURES = 32  # one feature per piece on the board
+NO_FEATURE = 0xFFFF
+
+feature_cache_header_dtype = np.dtype([
+    ("magic", "S8"),
+    ("source_size", "<u8"),
+    ("source_mtime_ns", "<i8"),
+    ("records", "<u8"),
+])
+
+feature_cache_dtype = np.dtype([
+    ("features", "<u2", (MAX_ACTIVE_FEATURES,)),
+    ("eval_i16", "<i2"),
+    ("wdl_f32", "<f4"),
+])
+
+def feature_cache_path(path: str | os.PathLike) -> str:
+    return os.fspath(path) + FEATURE_CACHE_SUFFIX
+
+def _source_stamp(path: str) -> tuple[int, int]:
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+def _cache_entries_from_records(recs: np.ndarray) -> np.ndarray:
+    """Encode records as feature_cache_dtype entries."""
+    indices, offsets = _features_from_records(recs)
+    counts = np.diff(np.append(offsets, len(indices)))
+    if counts.max(initial=0) > MAX_ACTIVE_FEATURES:
+        raise ValueError(f"Position with more than {MAX_ACTIVE_FEATURES} pieces, cannot cache features.")
+    rows = np.repeat(np.arange(len(recs)), counts)
+    features = np.full((len(recs), MAX_ACTIVE_FEATURES), NO_FEATURE, dtype=np.uint16)
+    features[rows, np.arange(len(indices)) - offsets[rows]] = indices
+
+    entries = np.empty(len(recs), dtype=feature_cache_dtype)
+    entries["features"] = features
+    entries["eval_i16"] = recs["eval_i16"]
+    entries["wdl_f32"] = recs["wdl_f32"]
+    return entries
+
+def _features_from_cache(entries: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Same (indices, offsets) as _features_from_records, from cache entries."""
+    features = entries["features"]
+    active = features != NO_FEATURE
+    offsets = np.zeros(len(entries), dtype=np.int64)
+    np.cumsum(active.sum(axis=1)[:-1], out=offsets[1:])
+    return features[active].astype(np.int64), offsets
+
+def _planes_from_cache(entries: np.ndarray) -> np.ndarray:
+    """Same (N, 768) float32 planes as _planes_from_records, from cache entries."""
+    features = entries["features"]
+    rows, cols = np.nonzero(features != NO_FEATURE)
+    planes = np.zeros((len(entries), 768), dtype=np.float32)
+    planes[rows, features[rows, cols]] = 1.0
+    return planes
+
+def build_feature_cache(
+    path: str | os.PathLike,
+    cache_path: str | None = None,
+    chunk_records: int = 1 << 20,
+) -> str:
+    """
+    Decode every record of `path` once and write the feature cache next to it.
+    The header stores the source size and mtime so a rewritten source is detected.
+    """
+    path = os.fspath(path)
+    cache_path = cache_path or feature_cache_path(path)
+    size, mtime_ns = _source_stamp(path)
+    records = open_records(path)
+    n = len(records)
+
+    header = np.zeros(1, dtype=feature_cache_header_dtype)
+    header["magic"] = FEATURE_CACHE_MAGIC
+    header["source_size"] = size
+    header["source_mtime_ns"] = mtime_ns
+    header["records"] = n
+
+    # Per-process temporary name: concurrent builders (e.g. distributed ranks) each write
+    # their own copy and the last atomic rename wins.
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            header.tofile(f)
+            for start in range(0, n, chunk_records):
+                _cache_entries_from_records(records[start:start + chunk_records]).tofile(f)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+def open_feature_cache(path: str | os.PathLike, cache_path: str | None = None) -> Optional[np.ndarray]:
+    """Memory-map the feature cache of `path`, or return None if it is missing or stale."""
+    path = os.fspath(path)
+    cache_path = cache_path or feature_cache_path(path)
+    try:
+        header = np.fromfile(cache_path, dtype=feature_cache_header_dtype, count=1)
+        cache_size = os.path.getsize(cache_path)
+    except FileNotFoundError:
+        return None
+    if len(header) != 1 or header["magic"][0] != FEATURE_CACHE_MAGIC:
+        return None
+    size, mtime_ns = _source_stamp(path)
+    if int(header["source_size"][0]) != size or int(header["source_mtime_ns"][0]) != mtime_ns:
+        return None
+    n = int(header["records"][0])
+    if cache_size != feature_cache_header_dtype.itemsize + n * feature_cache_dtype.itemsize:
+        return None
+    if n == 0:
+        return np.empty(0, dtype=feature_cache_dtype)
+    return np.memmap(
+        cache_path, dtype=feature_cache_dtype, mode="r",
+        offset=feature_cache_header_dtype.itemsize, shape=(n,),
+    )
+
+def ensure_feature_cache(path: str | os.PathLike, cache_path: str | None = None) -> str:
+    """Build the feature cache of `path` unless a fresh one already exists."""
+    cache_path = cache_path or feature_cache_path(path)
+    cache = open_feature_cache(path, cache_path)
+    if cache is None:
+        print(f"Building feature cache {cache_path}...")
+        build_feature_cache(path, cache_path)
+    del cache
+    return cache_path
+
 class ChessBitboardDataset(Dataset):
     """
     Chess dataset that supports multiprocessing on Windows by deferring memmap creation.
@@ -90,12 +272,23 @@ class ChessBitboardDataset(Dataset):
         split_modulus: int | None = None,
         split_remainder_start: int = 0,
         split_remainder_count: int | None = None,
+        sparse: bool = False,
+        feature_cache: bool = False,
+        select: dict | None = None,
     ):
         self.path = os.fspath(path)
-        size = os.path.getsize(self.path)
-        if size % RECORD_SIZE != 0:
-            raise ValueError(f"File size {size} not divisible by record size {RECORD_SIZE}.")
-        self.total_n = size // RECORD_SIZE
+        # get_batch returns (indices, offsets) instead of dense planes, see _features_from_records
+        self.sparse = sparse
+        # get_batch reads pre-decoded features from the cache file instead of the records.
+        # The cache is (re)built here, once, in the main process.
+        self.cache_path = ensure_feature_cache(self.path) if feature_cache else None
+        self.cache = None
+        # Raw record_dtype file or packed file (packed.py); only the length is needed here
+        records = open_records(self.path)
+        self.total_n = len(records)
+        # Packed files decode whole chunks: random reads need block shuffling, see make_dataloader
+        self.packed_chunk_records = getattr(records, "chunk_records", None)
+        del records
         
         # Support slicing for train/test split without Subset
         self.start_idx = start_idx
@@ -144,6 +337,17 @@ class ChessBitboardDataset(Dataset):
             if leftover > self.split_remainder_start:
                 extra = min(k, leftover - self.split_remainder_start)
             self.n = full_blocks * k + extra
+
+        # Optional subset by the sidecar record index: select holds RecordIndex.mask keywords,
+        # e.g. {"min_pieces": 6, "eval_range": (-400, 400)}. The index is (re)built if needed.
+        self.selected = None
+        if select:
+            from record_index import ensure_record_index, open_record_index
+            index = open_record_index(self.path, ensure_record_index(self.path))
+            candidates = self._actual_indices(np.arange(self.n))
+            self.selected = candidates[index.mask(**select)[candidates]]
+            self.n = len(self.selected)
+            del index
         
         # Don't create memmap here - will be created per-worker via worker_init_fn
         # This avoids pickling issues on Windows with large files
@@ -152,12 +356,60 @@ class ChessBitboardDataset(Dataset):
     def open_memmap(self):
         """Open the memmap. Called by worker_init_fn in each worker process."""
         if self.mm is None:
-            self.mm = np.memmap(self.path, dtype=record_dtype, mode="r")
+            self.mm = open_records(self.path)
+        if self.cache_path is not None and self.cache is None:
+            self.cache = open_feature_cache(self.path, self.cache_path)
+            if self.cache is None:
+                raise RuntimeError(f"Feature cache {self.cache_path} is stale, {self.path} changed.")
 
     def __len__(self) -> int:
         return self.n
 
-    def __getitem__(self, idx: int):
+    def _actual_indices(self, idx: np.ndarray) -> np.ndarray:
+        """Vectorized version of the index mapping in __getitem__."""
+        idx = np.asarray(idx, dtype=np.int64)
+        if idx.size and (idx.min() < 0 or idx.max() >= self.n):
+            raise IndexError("Index out of range")
+        if self.selected is not None:
+            return self.selected[idx]
+        if self.split_modulus is None:
+            return self.start_idx + idx
+        m = int(self.split_modulus)
+        k = int(self.split_remainder_count)
+        return self.start_idx + (idx // k) * m + self.split_remainder_start + idx % k
+
+    def get_batch(self, indices):
+        """
+        Decode a whole batch at once. Reads the records for `indices` in file order,
+        then decodes all planes with one vectorized unpackbits (or reads them from the
+        feature cache when enabled).
+        Returns (x [B, 768], wdl [B, 1], eval [B, 1]) float32 tensors; with sparse=True,
+        x is an (indices, offsets) pair of int64 tensors instead.
+        """
+        if self.mm is None:
+            self.open_memmap()
+
+        cached = self.cache_path is not None
+        source = self.cache if cached else self.mm
+        actual = self._actual_indices(indices)
+        order = np.argsort(actual, kind="stable")
+        recs = np.empty(len(actual), dtype=source.dtype)
+        recs[order] = source[actual[order]]
+
+        if self.sparse:
+            indices, offsets = _features_from_cache(recs) if cached else _features_from_records(recs)
+            x = (torch.from_numpy(indices), torch.from_numpy(offsets))
+        else:
+            x = torch.from_numpy(_planes_from_cache(recs) if cached else _planes_from_records(recs))
+        wdl = torch.from_numpy(recs["wdl_f32"].astype(np.float32).reshape(-1, 1))
+        eval_cp = torch.from_numpy(recs["eval_i16"].astype(np.float32).reshape(-1, 1))
+        return x, wdl, eval_cp
+
+    def __getitem__(self, idx):
+        # A list of indices (from a BatchSampler, see make_dataloader) takes the batched path
+        if not isinstance(idx, (int, np.integer)):
+            return self.get_batch(idx)
+
         # Ensure memmap is open (handles single-process case where worker_init_fn isn't called)
         if self.mm is None:
             self.open_memmap()
@@ -167,7 +419,9 @@ class ChessBitboardDataset(Dataset):
             raise RuntimeError("Memmap failed to open")
         
         # Map to actual index in the file
-        if self.split_modulus is None:
+        if self.selected is not None:
+            actual_idx = int(self.selected[idx])
+        elif self.split_modulus is None:
             actual_idx = self.start_idx + idx
         else:
             # Interleaved selection: keep the window of remainders
@@ -193,6 +447,134 @@ class ChessBitboardDataset(Dataset):
         eval_t = torch.tensor([eval_cp], dtype=torch.float32)
         return x_t, wdl_t, eval_t
 
+class BlockShuffleSampler(Sampler[int]):
+    """
+    Locality-friendly replacement for RandomSampler on large memmaps.
+
+    The dataset indices are cut into contiguous blocks of block_size. The block order is
+    permuted, then window_blocks consecutive blocks of that order are loaded as one window
+    and shuffled together. Reads stay within window_blocks * block_size records at a time,
+    so a batch touches a few regions of the file instead of random pages everywhere.
+    Larger blocks / smaller windows trade randomness for throughput.
+
+    Works on dataset (not file) indices, so a split_modulus split is respected: dataset
+    indices map monotonically into the file, and a block only covers its own remainders.
+    Call set_epoch() for a different permutation each epoch; its start argument skips
+    the first start indices of that epoch's order (resuming a checkpointed run).
+    block_size=1 is a plain uniform permutation.
+    """
+    def __init__(
+        self,
+        data_source: Dataset,
+        block_size: int = 1 << 16,
+        window_blocks: int = 16,
+        seed: int | None = None,
+    ):
+        if block_size <= 0:
+            raise ValueError(f"block_size must be positive, got {block_size}.")
+        if window_blocks <= 0:
+            raise ValueError(f"window_blocks must be positive, got {window_blocks}.")
+        self.n = len(data_source)
+        self.block_size = int(block_size)
+        self.window_blocks = int(window_blocks)
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch: int, start: int = 0):
+        self.epoch = epoch
+        self.start = start
+
+    def __len__(self) -> int:
+        return max(self.n - self.start, 0)
+
+    def __iter__(self):
+        return itertools.islice(self._order(), self.start, None)
+
+    def _order(self):
+        if self.seed is None:
+            rng = np.random.default_rng()
+        else:
+            rng = np.random.default_rng([self.seed, self.epoch])
+        if self.block_size == 1:
+            yield from rng.permutation(self.n).tolist()
+            return
+        num_blocks = (self.n + self.block_size - 1) // self.block_size
+        blocks = rng.permutation(num_blocks)
+
+        for w in range(0, num_blocks, self.window_blocks):
+            window = np.concatenate([
+                np.arange(b * self.block_size, min((b + 1) * self.block_size, self.n))
+                for b in blocks[w:w + self.window_blocks]
+            ])
+            rng.shuffle(window)
+            yield from window.tolist()
+
+class ResumableSequentialSampler(SequentialSampler):
+    """SequentialSampler whose set_epoch(epoch, start) skips the first start indices."""
+    start = 0
+
+    def set_epoch(self, epoch: int, start: int = 0):
+        self.start = start
+
+    def __len__(self) -> int:
+        return max(len(self.data_source) - self.start, 0)
+
+    def __iter__(self):
+        return iter(range(self.start, len(self.data_source)))
+
+class FixedSubsetSampler(Sampler[int]):
+    """The same fixed indices in the same order every epoch (e.g. a validation subsample)."""
+    def __init__(self, indices: Sequence[int]):
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __iter__(self):
+        return iter(self.indices.tolist())
+
+class ShardedSampler(Sampler[int]):
+    """
+    Rank `rank`'s disjoint share of another sampler's order for data-parallel training:
+    every world_size-th index starting at rank. All ranks must see the same inner order
+    (same seed). With drop_last every rank gets exactly len(sampler) // world_size
+    indices so they all run the same number of steps.
+    """
+    def __init__(self, sampler: Sampler, rank: int, world_size: int, drop_last: bool = True):
+        if not (0 <= rank < world_size):
+            raise ValueError(f"rank must be in [0,{world_size}), got {rank}.")
+        self.sampler = sampler
+        self.rank = rank
+        self.world_size = world_size
+        self.drop_last = drop_last
+        self.start = 0
+
+    def set_epoch(self, epoch: int, start: int = 0):
+        """start counts this rank's own indices (what it already consumed this epoch)."""
+        self.start = start
+        set_epoch = getattr(self.sampler, "set_epoch", None)
+        if callable(set_epoch):
+            set_epoch(epoch)
+
+    def _count(self) -> int:
+        """This rank's share of the whole epoch, before skipping start."""
+        n = len(self.sampler)
+        if self.drop_last:
+            return n // self.world_size
+        return (n - self.rank + self.world_size - 1) // self.world_size
+
+    def __len__(self) -> int:
+        return max(self._count() - self.start, 0)
+
+    def __iter__(self):
+        count = self._count()
+        for i, idx in enumerate(self.sampler):
+            if i // self.world_size >= count:
+                break
+            if i % self.world_size == self.rank and i // self.world_size >= self.start:
+                yield idx
+
 def _worker_init_fn(worker_id):
     """Initialize each worker by opening its own memmap handle."""
     worker_info = torch.utils.data.get_worker_info()
@@ -217,8 +599,71 @@ def make_dataloader(
     pin_memory: bool = True,
     persistent_workers: bool = True,
     shuffle: bool = False,
+    batched: bool = True,
+    block_size: int | None = None,
+    window_blocks: int = 16,
+    seed: int | None = None,
+    rank: int = 0,
+    world_size: int = 1,
+    subsample: int | None = None,
 ) -> DataLoader:
-    
+    """
+    With batched=True (and a dataset that has get_batch) every DataLoader item is a
+    whole batch: a BatchSampler hands the dataset index lists, which are decoded in
+    one vectorized pass instead of batch_size __getitem__ calls plus collation.
+    Sparse datasets only exist on this path.
+
+    shuffle=True with a block_size uses BlockShuffleSampler instead of a full random
+    permutation; reshuffle it every epoch with set_sampler_epoch.
+    A dataset on a packed file (packed.py) is always block-shuffled, by default in blocks
+    of one chunk: a uniform permutation would decode a whole chunk per sampled record.
+
+    world_size > 1 gives rank its disjoint ShardedSampler share. Shuffled shards need the
+    same seed on every rank (0 if none is given); training shards drop the uneven tail so
+    every rank runs the same number of steps, evaluation (shuffle=False) keeps every index.
+
+    subsample (with shuffle=False) reads a fixed random subset of that many positions,
+    drawn once from seed and kept in file order, for cheap repeated validation.
+    """
+    if getattr(ds, "sparse", False) and not batched:
+        raise ValueError("Sparse datasets require batched=True.")
+
+    if world_size > 1 and seed is None:
+        seed = 0
+
+    packed_chunk_records = getattr(ds, "packed_chunk_records", None)
+    if shuffle and block_size is None and packed_chunk_records is not None:
+        block_size = packed_chunk_records
+        print(f"Packed records: block-shuffling in blocks of {block_size:,} (one chunk)")
+
+    if not shuffle and subsample is not None and subsample < len(ds):
+        rng = np.random.default_rng(seed)
+        base = FixedSubsetSampler(np.sort(rng.choice(len(ds), size=subsample, replace=False)))
+    elif not shuffle:
+        base = ResumableSequentialSampler(ds)
+    elif block_size is not None:
+        base = BlockShuffleSampler(ds, block_size=block_size, window_blocks=window_blocks, seed=seed)
+    elif seed is not None:
+        # Uniform permutation that set_epoch can reproduce (and resume) on every rank
+        base = BlockShuffleSampler(ds, block_size=1, seed=seed)
+    else:
+        base = RandomSampler(ds)
+
+    if world_size > 1:
+        base = ShardedSampler(base, rank, world_size, drop_last=shuffle)
+
+    if batched and hasattr(ds, "get_batch"):
+        return DataLoader(
+            ds,
+            batch_size=None,
+            sampler=BatchSampler(base, batch_size=batch_size, drop_last=False),
+            num_workers=num_workers,
+            pin_memory=pin_memory,
+            prefetch_factor=prefetch_factor if num_workers > 0 else None,
+            persistent_workers=persistent_workers if num_workers > 0 else False,
+            worker_init_fn=_worker_init_fn if num_workers > 0 else None,
+        )
+
     return DataLoader(
         ds,
         batch_size=batch_size,
@@ -226,7 +671,21 @@ def make_dataloader(
         pin_memory=pin_memory,
         prefetch_factor=prefetch_factor if num_workers > 0 else None,
         persistent_workers=persistent_workers if num_workers > 0 else False,
-        shuffle=shuffle,
+        sampler=base,
         drop_last=False,
         worker_init_fn=_worker_init_fn if num_workers > 0 else None,
     )
+
+def set_sampler_epoch(loader: DataLoader, epoch: int, start: int = 0):
+    """
+    Forward the epoch to the loader's sampler (possibly wrapped in a BatchSampler) if it takes one.
+    start skips the first start samples of the epoch; with start a multiple of the batch size
+    the loader yields exactly the batches that follow.
+    """
+    sampler = loader.batch_sampler if loader.batch_sampler is not None else loader.sampler
+    while sampler is not None:
+        set_epoch = getattr(sampler, "set_epoch", None)
+        if callable(set_epoch):
+            set_epoch(epoch, start)
+            return
+        sampler = getattr(sampler, "sampler", None)
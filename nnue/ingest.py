@@ -0,0 +1,183 @@
+"""
+Parallel ingestion of .pgn.evals.bin files.
+
+Each worker validates one input file, drops mate-score positions, counts pieces and
+computes Zobrist keys, then writes a compact shard (records, keys, piece counts) to a
+scratch directory. The merge step in 0_pre_process.py memory-maps the shards.
+"""
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Sequence
+
+import numpy as np
+
+from data import record_dtype, RECORD_SIZE
+from zobrist import zobrist_keys
+
+
+class Shard(NamedTuple):
+    """Result of ingesting one input file."""
+    source: str         # input file path
+    prefix: str         # shard path prefix, files are <prefix>.records/.keys/.pieces
+    loaded: int         # records read from the input file
+    removed: int        # mate-score records dropped
+    records: int        # records written to the shard
+
+    @property
+    def ok(self) -> bool:
+        return self.loaded > 0
+
+
+def truncate_to_full_records(file_path):
+    """Ensure the file length is an integer multiple of RECORD_SIZE."""
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        return False
+
+    remainder = size % RECORD_SIZE
+    if remainder == 0:
+        return True
+
+    new_size = size - remainder
+    if new_size <= 0:
+        print(f"  Skipping {file_path}: file smaller than one record ({size} bytes)")
+        return False
+
+    try:
+        with open(file_path, "rb+") as fh:
+            fh.truncate(new_size)
+        print(f"  Truncated {file_path} from {size} to {new_size} bytes")
+        return True
+    except OSError as exc:
+        print(f"  Failed to truncate {file_path}: {exc}")
+        return False
+
+def read_positions_from_bin(file_path):
+    """Read chess positions from binary file using numpy memmap."""
+    try:
+        # Memory-map the file for efficient reading
+        positions = np.memmap(file_path, dtype=record_dtype, mode='r')
+        return positions
+    except Exception:
+        # Silently ignore files that can't be read
+        return np.array([], dtype=record_dtype)
+
+
+# Set bits per byte value, for numpy versions without np.bitwise_count
+POPCOUNT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def popcount64(values):
+    """Vectorized popcount of a uint64 array, returned as uint8."""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.uint8, copy=False)
+    return POPCOUNT_TABLE[values.view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.uint8)
+
+
+def count_pieces(positions):
+    """Number of occupied squares for every record."""
+    return popcount64(np.bitwise_or(positions["bb_white"], positions["bb_black"]))
+
+
+def filter_mate_scores(positions, piece_counts):
+    """
+    Drop mate-score positions unless they are sparse endgames (<6 pieces).
+    Returns (positions, piece_counts, removed).
+    """
+    evals = positions["eval_i16"].astype(np.int32)
+    mate_indices = np.flatnonzero(np.abs(evals) >= 10000)
+    if mate_indices.size == 0:
+        return positions, piece_counts, 0
+
+    filter_mask = np.ones(len(positions), dtype=bool)
+    filter_mask[mate_indices] = piece_counts[mate_indices] < 6
+    removed = len(positions) - int(filter_mask.sum())
+    if removed > 0:
+        positions = positions[filter_mask]
+        piece_counts = piece_counts[filter_mask]
+    return positions, piece_counts, removed
+
+
+def ingest_file(file_path: str, prefix: str, chunk_records: int = 1 << 20) -> Shard:
+    """
+    Validate, filter and pre-hash one input file into a shard at `prefix`.
+    Works chunk by chunk so a worker never holds more than chunk_records records.
+    """
+    loaded = removed = kept = 0
+    positions = np.array([], dtype=record_dtype)
+    if truncate_to_full_records(file_path):
+        positions = read_positions_from_bin(file_path)
+
+    with open(prefix + ".records", "wb") as rec_fh, \
+         open(prefix + ".keys", "wb") as key_fh, \
+         open(prefix + ".pieces", "wb") as pc_fh:
+        for start in range(0, len(positions), chunk_records):
+            chunk = np.array(positions[start:start + chunk_records])
+            loaded += len(chunk)
+
+            piece_counts = count_pieces(chunk)
+            chunk, piece_counts, dropped = filter_mate_scores(chunk, piece_counts)
+            removed += dropped
+            kept += len(chunk)
+
+            chunk.tofile(rec_fh)
+            zobrist_keys(chunk).tofile(key_fh)
+            piece_counts.tofile(pc_fh)
+
+    del positions
+    return Shard(file_path, prefix, loaded, removed, kept)
+
+
+def _ingest_job(args):
+    return ingest_file(*args)
+
+
+def ingest_files(
+    file_paths: Sequence[str],
+    shard_dir: str,
+    workers: int | None = None,
+    chunk_records: int = 1 << 20,
+):
+    """
+    Ingest files on a process pool, yielding Shards in input order as they finish.
+    workers=1 runs in the calling process.
+    """
+    jobs = [
+        (path, os.path.join(shard_dir, f"shard_{i:05d}"), chunk_records)
+        for i, path in enumerate(file_paths)
+    ]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield _ingest_job(job)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        yield from pool.map(_ingest_job, jobs)
+
+
+def load_shard(shard: Shard):
+    """Memory-map a shard. Returns (records, keys, piece_counts)."""
+    if shard.records == 0:
+        return (
+            np.array([], dtype=record_dtype),
+            np.array([], dtype=np.uint64),
+            np.array([], dtype=np.uint8),
+        )
+    return (
+        np.memmap(shard.prefix + ".records", dtype=record_dtype, mode="r"),
+        np.memmap(shard.prefix + ".keys", dtype=np.uint64, mode="r"),
+        np.memmap(shard.prefix + ".pieces", dtype=np.uint8, mode="r"),
+    )
+
+
+def remove_shard(shard: Shard):
+    for ext in (".records", ".keys", ".pieces"):
+        try:
+            os.remove(shard.prefix + ext)
+        except OSError:
+            pass
@@ -0,0 +1,225 @@
+"""
+State of incremental preprocessing (0_pre_process.py --incremental).
+
+Two files in the input folder describe what the output already holds:
+
+    preprocess_manifest.json   the ingested input files in ingestion order: name, size,
+                               mtime, records read and unique positions added. The
+                               position in the list is the file's source id (record_index.py).
+    preprocess_keys.bin        keyset_header_dtype, then the sorted Zobrist keys of every
+                               original (non-mirrored) position in the output: the
+                               persistent dedup set
+
+The key set header also stores the output length and a checksum of its last records.
+A run appends to the output, then replaces the key set, then the manifest, so after an
+interrupted run the output is cut back to the length the key set vouches for.
+"""
+from __future__ import annotations
+
+import json
+import os
+import zlib
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from data import RECORD_SIZE
+
+MANIFEST_NAME = "preprocess_manifest.json"
+MANIFEST_VERSION = 1
+KEYSET_NAME = "preprocess_keys.bin"
+KEYSET_MAGIC = b"NNUEKS01"
+
+# Records at the end of the output covered by the key set checksum
+FINGERPRINT_RECORDS = 1024
+
+keyset_header_dtype = np.dtype([
+    ("magic", "S8"),
+    ("keys", "<u8"),
+    ("output_records", "<u8"),
+    ("output_crc32", "<u4"),
+    ("reserved", "<u4"),
+])
+
+
+class FileEntry(NamedTuple):
+    """One ingested input file."""
+    name: str
+    size: int
+    mtime_ns: int
+    records: int  # records read from the file
+    added: int    # unique positions it added to the output (before mirroring)
+
+
+def file_stamp(path: str | os.PathLike) -> tuple[int, int]:
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _replace_atomically(path: str, data: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class IngestManifest:
+    """The manifest of one input folder, see the module docstring."""
+    def __init__(self, folder_path: str, output: str, files: Sequence[FileEntry] = ()):
+        self.folder_path = folder_path
+        self.output = output
+        self.files = list(files)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.folder_path, MANIFEST_NAME)
+
+    @property
+    def source_names(self) -> list[str]:
+        return [entry.name for entry in self.files]
+
+    @classmethod
+    def load(cls, folder_path: str) -> Optional["IngestManifest"]:
+        """The folder's manifest, or None if there is none (or of another version)."""
+        try:
+            with open(os.path.join(folder_path, MANIFEST_NAME), encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        if state.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(folder_path, state["output"], [FileEntry(**entry) for entry in state["files"]])
+
+    def save(self):
+        state = {
+            "version": MANIFEST_VERSION,
+            "output": self.output,
+            "files": [entry._asdict() for entry in self.files],
+        }
+        _replace_atomically(self.path, json.dumps(state, indent=1).encode("utf-8"))
+
+    def pending(self, names: Sequence[str]) -> tuple[list[str], list[str]]:
+        """(new, changed): names not ingested yet, and ingested names whose size or mtime differ."""
+        known = {entry.name: entry for entry in self.files}
+        new, changed = [], []
+        for name in names:
+            entry = known.get(name)
+            if entry is None:
+                new.append(name)
+            elif (entry.size, entry.mtime_ns) != file_stamp(os.path.join(self.folder_path, name)):
+                changed.append(name)
+        return new, changed
+
+    def source_id(self, name: str) -> int:
+        """Source id of an input file, adding a placeholder entry for a new one."""
+        for i, entry in enumerate(self.files):
+            if entry.name == name:
+                return i
+        self.files.append(FileEntry(name, 0, 0, 0, 0))
+        return len(self.files) - 1
+
+    def record(self, name: str, records: int, added: int):
+        """Stamp an ingested file with its current size and mtime."""
+        i = self.source_id(name)
+        size, mtime_ns = file_stamp(os.path.join(self.folder_path, name))
+        previous = self.files[i]
+        self.files[i] = FileEntry(name, size, mtime_ns, records, previous.added + added)
+
+
+def output_fingerprint(path: str | os.PathLike, records: int) -> int:
+    """crc32 of the last FINGERPRINT_RECORDS of the first `records` records of `path`."""
+    start = max(records - FINGERPRINT_RECORDS, 0)
+    with open(path, "rb") as f:
+        f.seek(start * RECORD_SIZE)
+        return zlib.crc32(f.read((records - start) * RECORD_SIZE))
+
+
+class KeySet(NamedTuple):
+    """Sorted keys of the positions already in the output, and the output they describe."""
+    keys: np.ndarray  # uint64, sorted, unique
+    output_records: int
+    output_crc32: int
+
+    @classmethod
+    def empty(cls) -> "KeySet":
+        return cls(np.empty(0, dtype=np.uint64), 0, zlib.crc32(b""))
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        """Boolean mask of the keys already in the set."""
+        if len(self.keys) == 0:
+            return np.zeros(len(keys), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return self.keys[pos] == keys
+
+    def merged(self, keys: np.ndarray) -> np.ndarray:
+        """Sorted union with keys that are not in the set yet (one linear merge, no re-sort)."""
+        keys = np.sort(np.asarray(keys, dtype=np.uint64))
+        return np.insert(self.keys, np.searchsorted(self.keys, keys), keys)
+
+
+def keyset_path(folder_path: str) -> str:
+    return os.path.join(folder_path, KEYSET_NAME)
+
+
+def load_keyset(folder_path: str) -> Optional[KeySet]:
+    """Memory-map the folder's key set, or return None if it is missing or malformed."""
+    path = keyset_path(folder_path)
+    try:
+        header = np.fromfile(path, dtype=keyset_header_dtype, count=1)
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return None
+    if len(header) != 1 or header["magic"][0] != KEYSET_MAGIC:
+        return None
+    n = int(header["keys"][0])
+    if size != keyset_header_dtype.itemsize + 8 * n:
+        return None
+    keys = (
+        np.memmap(path, dtype="<u8", mode="r", offset=keyset_header_dtype.itemsize, shape=(n,))
+        if n else np.empty(0, dtype=np.uint64)
+    )
+    return KeySet(keys, int(header["output_records"][0]), int(header["output_crc32"][0]))
+
+
+def write_keyset(folder_path: str, keys: np.ndarray, output_path: str | os.PathLike):
+    """Replace the folder's key set with `keys` (sorted), stamped with the current output."""
+    path = keyset_path(folder_path)
+    output_records = os.path.getsize(output_path) // RECORD_SIZE
+    header = np.zeros(1, dtype=keyset_header_dtype)
+    header["magic"] = KEYSET_MAGIC
+    header["keys"] = len(keys)
+    header["output_records"] = output_records
+    header["output_crc32"] = output_fingerprint(output_path, output_records)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            header.tofile(f)
+            np.asarray(keys, dtype="<u8").tofile(f)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def restore_output(output_path: str | os.PathLike, keyset: KeySet) -> int:
+    """
+    Check that the output still is the one the key set describes, cutting off records an
+    interrupted run appended after it. Returns the record count. Raises ValueError if
+    the output was rewritten (e.g. by a full preprocessing run) or lost records.
+    """
+    n = keyset.output_records
+    if not os.path.exists(output_path):
+        records = 0
+        if n == 0:
+            return 0
+    else:
+        records = os.path.getsize(output_path) // RECORD_SIZE
+    if records < n or output_fingerprint(output_path, n) != keyset.output_crc32:
+        raise ValueError(
+            f"{output_path} changed since the last incremental run; remove {MANIFEST_NAME} "
+            f"and {KEYSET_NAME} to rebuild it from scratch"
+        )
+    if os.path.getsize(output_path) != n * RECORD_SIZE:
+        print(f"Truncating {output_path} to {n:,} records (interrupted incremental run)")
+        os.truncate(output_path, n * RECORD_SIZE)
+    return n
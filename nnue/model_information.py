@@ -1,38 +1,75 @@
+"""
+Float weight export for the engine, plus model summaries.
+
+Float weight file layout (little-endian), see save_f32_weights / load_f32_weights:
+    header   weights_header_dtype (magic, version, input/hidden size, dtype, CRC32)
+    float32  hidden weights [hidden_size][input_size]  (row-major, as nn.Linear stores them)
+    float32  hidden bias    [hidden_size]
+    float32  output weights [hidden_size]
+    float32  output bias
+The CRC32 covers everything after the header. Files without the header (header=False, and
+every export before the header existed) hold only the floats; the loader still reads them
+and infers the hidden size from the length.
+"""
+import zlib
+
+import numpy as np
 import torch
 import torch.nn as nn
 
-def save_f32_weights(model, filename="nnue_weights.bin"):
+# The float weight format lives in the torch-free numpy_nnue.py
+from numpy_nnue import WEIGHTS_MAGIC, WEIGHTS_VERSION, read_f32_weights, weights_header_dtype
+
+WEIGHT_NAMES = ("hidden.weight", "hidden.bias", "output.weight", "output.bias")
+
+
+def _f32_payload(model) -> bytes:
+    state_dict = model.state_dict()
+    return np.concatenate([
+        state_dict[name].detach().cpu().numpy().astype("<f4", copy=False).ravel()
+        for name in WEIGHT_NAMES
+    ]).tobytes()
+
+
+def save_f32_weights(model, filename="nnue_weights.bin", header=True):
     """
-    Saves the trained model weights in a binary format for faster loading in C#.
-    The binary format: all weights as 32-bit floats in the order expected by C#.
+    Saves the trained model weights in a binary format for faster loading in C#:
+    the header followed by all weights as 32-bit floats in the order expected by C#.
+    header=False writes the bare floats (the layout older engine builds expect).
     """
-    import struct
-    
     print(f"Saving weights in binary format to {filename}...")
-    
+
+    payload = _f32_payload(model)
     with open(filename, 'wb') as f:
-        # Save hidden weights
-        hidden_weights = model.hidden.weight.data.flatten()
-        for weight in hidden_weights:
-            f.write(struct.pack('f', weight.item()))
-        
-        # Save hidden bias
-        hidden_bias = model.hidden.bias.data
-        for bias in hidden_bias:
-            f.write(struct.pack('f', bias.item()))
-        
-        # Save output weights
-        output_weights = model.output.weight.data.flatten()
-        for weight in output_weights:
-            f.write(struct.pack('f', weight.item()))
-        
-        # Save output bias
-        output_bias = model.output.bias.data
-        f.write(struct.pack('f', output_bias.item()))
-    
+        if header:
+            h = np.zeros(1, dtype=weights_header_dtype)
+            h["magic"] = WEIGHTS_MAGIC
+            h["version"] = WEIGHTS_VERSION
+            h["input_size"] = model.hidden.in_features
+            h["hidden_size"] = model.hidden.out_features
+            h["dtype"] = 1
+            h["crc32"] = zlib.crc32(payload)
+            f.write(h.tobytes())
+        f.write(payload)
+
     print(f"Binary weights saved to {filename}")
     print("Binary format: 32-bit floats in order: hidden_weights, hidden_bias, output_weights, output_bias")
 
+
+def load_f32_weights(filename, input_size=768, hidden_size=None) -> dict:
+    """
+    Reads a file written by save_f32_weights back into an NNUE state_dict.
+    Raises ValueError if the file is damaged or does not match input_size / hidden_size
+    (hidden_size=None accepts any).
+    """
+    weights = read_f32_weights(filename, input_size=input_size, hidden_size=hidden_size)
+    return {
+        "hidden.weight": torch.from_numpy(weights.hidden_weights.copy()),
+        "hidden.bias": torch.from_numpy(weights.hidden_bias.copy()),
+        "output.weight": torch.from_numpy(weights.output_weights.copy()).view(1, -1),
+        "output.bias": torch.tensor([weights.output_bias], dtype=torch.float32),
+    }
+
 def print_model_summary(model):
 
     total_params = sum(p.numel() for p in model.parameters())
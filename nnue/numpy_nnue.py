@@ -0,0 +1,336 @@
+"""
+NumPy-only float NNUE evaluator mirroring NNUE.cs, for scripted checks without torch.
+
+Loads the .bin weights written by model_information.save_f32_weights (the float weight
+format is defined here so this module needs nothing but numpy) and evaluates positions
+the way the engine does:
+
+    Accumulator.refresh  = NNUE.Accumulator.Reevaluate (bias, then one feature row per piece,
+                           pawns..kings, black before white, squares ascending)
+    Accumulator.move     = NNUE.Accumulator.Move  (-from, +to, -capture, +castle rook)
+    Accumulator.undo     = NNUE.Accumulator.Undo  (+from, -to, +capture, -castle rook)
+    Accumulator.read     = NNUE.Accumulator.Read  (short, side to move's perspective)
+
+Every accumulator update is a float32 row add/subtract in the engine's order, so the
+accumulator is bit-exact with the C# one and can be diffed against it (--trace prints a
+CRC32 of it per ply). Only the final dot product may sum in a different order than
+TensorPrimitives.Dot.
+
+    python numpy_nnue.py nnue_weights.bin --moves e2e4 e7e5 g1f3 --trace
+    python numpy_nnue.py nnue_weights.bin --positions regression.epd
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import zlib
+from typing import NamedTuple, Sequence
+
+import numpy as np
+
+# Must match NNUE.cs
+SCALE = 410
+INPUT_SIZE = 768
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+WEIGHTS_MAGIC = b"LNUF"
+WEIGHTS_VERSION = 1
+
+WEIGHT_DTYPES = {1: np.dtype("<f4")}
+
+weights_header_dtype = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u2"),
+    ("input_size", "<u2"),
+    ("hidden_size", "<u2"),
+    ("dtype", "u1"),  # key of WEIGHT_DTYPES
+    ("reserved", "u1"),
+    ("crc32", "<u4"),
+])
+
+
+class FloatWeights(NamedTuple):
+    hidden_weights: np.ndarray  # (hidden_size, input_size) float32, as nn.Linear stores them
+    hidden_bias: np.ndarray     # (hidden_size,) float32
+    output_weights: np.ndarray  # (hidden_size,) float32
+    output_bias: np.float32
+
+    @property
+    def hidden_size(self) -> int:
+        return self.hidden_weights.shape[0]
+
+
+def read_f32_weights(path: str, input_size: int = INPUT_SIZE, hidden_size: int | None = None) -> FloatWeights:
+    """
+    Reads a save_f32_weights file, with or without header. Raises ValueError if the file
+    is damaged or does not match input_size / hidden_size (hidden_size=None accepts any).
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if data[:len(WEIGHTS_MAGIC)] == WEIGHTS_MAGIC:
+        if len(data) < weights_header_dtype.itemsize:
+            raise ValueError(f"{path}: truncated header")
+        header = np.frombuffer(data, dtype=weights_header_dtype, count=1)[0]
+        if header["version"] != WEIGHTS_VERSION:
+            raise ValueError(f"{path}: unsupported weights version {header['version']}")
+        if int(header["dtype"]) not in WEIGHT_DTYPES:
+            raise ValueError(f"{path}: unknown weight type {header['dtype']}")
+        payload = data[weights_header_dtype.itemsize:]
+        if zlib.crc32(payload) != header["crc32"]:
+            raise ValueError(f"{path}: checksum mismatch")
+        n_in, n_hidden = int(header["input_size"]), int(header["hidden_size"])
+        dtype = WEIGHT_DTYPES[int(header["dtype"])]
+        if len(payload) != (n_in * n_hidden + 2 * n_hidden + 1) * dtype.itemsize:
+            raise ValueError(f"{path}: unexpected payload size {len(payload)} for {n_in}x{n_hidden}")
+    else:
+        # Headerless export: floats only, hidden size from the length
+        payload, n_in, dtype = data, input_size, WEIGHT_DTYPES[1]
+        count, rest = divmod(len(payload), dtype.itemsize)
+        n_hidden, extra = divmod(count - 1, n_in + 2)
+        if rest or extra or n_hidden <= 0:
+            raise ValueError(f"{path}: {len(payload)} bytes is not a {n_in}-input float weight file")
+
+    if n_in != input_size:
+        raise ValueError(f"{path}: input size {n_in}, expected {input_size}")
+    if hidden_size is not None and n_hidden != hidden_size:
+        raise ValueError(f"{path}: hidden size {n_hidden}, expected {hidden_size}")
+
+    values = np.frombuffer(payload, dtype=dtype).astype(np.float32)
+    w_end = n_in * n_hidden
+    return FloatWeights(
+        values[:w_end].reshape(n_hidden, n_in),
+        values[w_end:w_end + n_hidden],
+        values[w_end + n_hidden:w_end + 2 * n_hidden],
+        np.float32(values[-1]),
+    )
+
+
+# Boards are (64,) / (N, 64) int8 arrays in square order (a1 = 0, h8 = 63) holding the
+# feature plane color * 6 + piece of the piece on each square (black = 0, white = 1;
+# pawn, knight, bishop, rook, queen, king = 0..5), or -1 for empty squares.
+EMPTY = -1
+PIECES = "pnbrqk"
+
+# Placement digits expand to that many empty squares, rank separators go away
+_EXPAND_PLACEMENT = str.maketrans({**{str(d): "." * d for d in range(1, 9)}, "/": None})
+
+# Byte -> plane, -1 for an empty square, -2 for anything else
+_PLANE_LUT = np.full(256, -2, dtype=np.int8)
+_PLANE_LUT[ord(".")] = EMPTY
+for _p, _c in enumerate(PIECES):
+    _PLANE_LUT[ord(_c)] = _p
+    _PLANE_LUT[ord(_c.upper())] = 6 + _p
+
+# Placement strings list a8..h8, a7..h7, ..., a1..h1: character p is square p ^ 56
+_SQUARE_ORDER = np.arange(64) ^ 56
+
+
+def fens_to_boards(fens: Sequence[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parse FEN or EPD lines (placement and side to move only) all at once.
+    Returns (boards (N, 64) int8, white_to_move (N,) bool, valid (N,) bool); boards of
+    malformed lines are left empty.
+    """
+    n = len(fens)
+    chars = bytearray(b"." * (64 * n))
+    white_to_move = np.zeros(n, dtype=bool)
+    valid = np.zeros(n, dtype=bool)
+    for i, fen in enumerate(fens):
+        fields = fen.split(maxsplit=2)
+        if len(fields) < 2 or fields[1] not in ("w", "b") or fields[0].count("/") != 7:
+            continue
+        squares = fields[0].translate(_EXPAND_PLACEMENT)
+        if len(squares) != 64 or not squares.isascii():
+            continue
+        chars[64 * i:64 * (i + 1)] = squares.encode("ascii")
+        white_to_move[i] = fields[1] == "w"
+        valid[i] = True
+
+    boards = _PLANE_LUT[np.frombuffer(bytes(chars), dtype=np.uint8).reshape(n, 64)[:, _SQUARE_ORDER]]
+    valid &= ~np.any(boards == -2, axis=1)
+    boards[~valid] = EMPTY
+    return boards, white_to_move, valid
+
+
+def engine_feature_order(boards: np.ndarray) -> np.ndarray:
+    """
+    (N, K) feature indices of the pieces on each board in the order Reevaluate adds them,
+    padded with INPUT_SIZE (a zero row) up to the largest piece count K.
+    """
+    boards = np.atleast_2d(boards).astype(np.int64)
+    squares = np.arange(64)
+    occupied = boards >= 0
+    color, piece = boards // 6, boards % 6
+    order_key = np.where(occupied, piece * 128 + color * 64 + squares, 1 << 16)
+    k = max(int(occupied.sum(axis=1).max(initial=0)), 1)
+    order = np.argsort(order_key, axis=1, kind="stable")[:, :k]
+    planes = np.take_along_axis(boards, order, axis=1)
+    return np.where(planes >= 0, planes * 64 + order, INPUT_SIZE)
+
+
+class MoveDelta(NamedTuple):
+    """Feature indices a move touches, as NNUE.Accumulator.Move uses them (-1: unused)."""
+    removed: int   # moving piece on its from square
+    added: int     # moved (or promoted) piece on its to square
+    captured: int  # captured piece, or for castling the rook on its start square
+    castled: int   # castling rook on its destination square
+
+
+class NumpyNNUE:
+    """The float network in the engine's layout: one contiguous accumulator row per feature."""
+    def __init__(self, weights: FloatWeights):
+        self.weights = weights
+        # hiddenWeightsTensor, plus a zero row for padding
+        self.feature_weights = np.zeros((INPUT_SIZE + 1, weights.hidden_size), dtype=np.float32)
+        self.feature_weights[:INPUT_SIZE] = weights.hidden_weights.T
+
+    @classmethod
+    def from_file(cls, path: str, hidden_size: int | None = None) -> "NumpyNNUE":
+        return cls(read_f32_weights(path, hidden_size=hidden_size))
+
+    def accumulators(self, boards: np.ndarray) -> np.ndarray:
+        """(N, H) accumulators, each added up in Reevaluate's order (bit-exact with it)."""
+        features = engine_feature_order(boards)
+        acc = np.repeat(self.weights.hidden_bias[None, :], len(features), axis=0)
+        for column in features.T:
+            acc += self.feature_weights[column]
+        return acc
+
+    def read(self, acc: np.ndarray, white_to_move) -> np.ndarray:
+        """NNUE.Accumulator.Read for (H,) or (N, H) accumulators: truncated side-to-move evals."""
+        hidden = np.clip(acc, np.float32(0), np.float32(1))
+        evaluation = np.float32(SCALE) * (self.weights.output_bias + hidden @ self.weights.output_weights)
+        evaluation = np.where(white_to_move, evaluation, -evaluation)
+        return np.trunc(evaluation).astype(np.int16)
+
+    def evaluate_boards(self, boards: np.ndarray, white_to_move: np.ndarray) -> np.ndarray:
+        return self.read(self.accumulators(boards), white_to_move)
+
+    def evaluate_fens(self, fens: Sequence[str]) -> tuple[np.ndarray, np.ndarray]:
+        """(evals, valid) for FEN / EPD lines; evals of malformed lines are meaningless."""
+        boards, white_to_move, valid = fens_to_boards(fens)
+        return self.evaluate_boards(boards, white_to_move), valid
+
+
+class Accumulator:
+    """Incrementally updated accumulator of one position, NNUE.Accumulator in NumPy."""
+    def __init__(self, network: NumpyNNUE, board: np.ndarray):
+        self.network = network
+        self.values = network.accumulators(board)[0]
+
+    def refresh(self, board: np.ndarray):
+        self.values = self.network.accumulators(board)[0]
+
+    def _row(self, feature: int) -> np.ndarray:
+        return self.network.feature_weights[feature]
+
+    def move(self, delta: MoveDelta):
+        np.subtract(self.values, self._row(delta.removed), out=self.values)
+        np.add(self.values, self._row(delta.added), out=self.values)
+        if delta.captured >= 0:
+            np.subtract(self.values, self._row(delta.captured), out=self.values)
+        if delta.castled >= 0:
+            np.add(self.values, self._row(delta.castled), out=self.values)
+
+    def undo(self, delta: MoveDelta):
+        np.add(self.values, self._row(delta.removed), out=self.values)
+        np.subtract(self.values, self._row(delta.added), out=self.values)
+        if delta.captured >= 0:
+            np.add(self.values, self._row(delta.captured), out=self.values)
+        if delta.castled >= 0:
+            np.subtract(self.values, self._row(delta.castled), out=self.values)
+
+    def read(self, white_to_move: bool) -> int:
+        return int(self.network.read(self.values, white_to_move))
+
+    def crc32(self) -> int:
+        """Fingerprint of the exact float32 bits, to diff against the engine's accumulator."""
+        return zlib.crc32(self.values.astype("<f4").tobytes())
+
+
+def _square(name: str) -> int:
+    if len(name) != 2 or name[0] not in "abcdefgh" or name[1] not in "12345678":
+        raise ValueError(f"bad square {name!r}")
+    return (ord(name[1]) - ord("1")) * 8 + ord(name[0]) - ord("a")
+
+
+class Board:
+    """Piece placement and side to move; just enough chess to turn UCI moves into MoveDeltas."""
+    def __init__(self, fen: str = START_FEN):
+        boards, white_to_move, valid = fens_to_boards([fen])
+        if not valid[0]:
+            raise ValueError(f"bad FEN {fen!r}")
+        self.squares = boards[0].copy()
+        self.white_to_move = bool(white_to_move[0])
+
+    def push_uci(self, uci: str) -> MoveDelta:
+        """Play a (legal) UCI move and return the accumulator update it needs."""
+        if len(uci) not in (4, 5):
+            raise ValueError(f"bad UCI move {uci!r}")
+        start, target = _square(uci[:2]), _square(uci[2:4])
+        plane = int(self.squares[start])
+        color = int(self.white_to_move)
+        if plane < 0 or plane // 6 != color:
+            raise ValueError(f"{uci}: no piece of the side to move on {uci[:2]}")
+        piece = plane % 6
+        to_plane = plane
+        if len(uci) == 5:
+            if piece != 0 or uci[4] not in "nbrq":
+                raise ValueError(f"bad promotion {uci!r}")
+            to_plane = color * 6 + PIECES.index(uci[4])
+
+        captured = castled = -1
+        capture_square = target
+        if piece == 0 and start % 8 != target % 8 and self.squares[target] == EMPTY:
+            capture_square = target - 8 if color else target + 8  # en passant
+        if self.squares[capture_square] >= 0:
+            captured = int(self.squares[capture_square]) * 64 + capture_square
+            self.squares[capture_square] = EMPTY
+        elif piece == 5 and abs(start - target) == 2:
+            rook_from, rook_to = (start + 3, start + 1) if target > start else (start - 4, start - 1)
+            rook = color * 6 + 3
+            captured, castled = rook * 64 + rook_from, rook * 64 + rook_to
+            self.squares[rook_from] = EMPTY
+            self.squares[rook_to] = rook
+
+        self.squares[start] = EMPTY
+        self.squares[target] = to_plane
+        self.white_to_move = not self.white_to_move
+        return MoveDelta(plane * 64 + start, to_plane * 64 + target, captured, castled)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate positions with the NumPy NNUE reference")
+    parser.add_argument("weights", help="Float weights (.bin from save_f32_weights)")
+    parser.add_argument("--fen", default=START_FEN, help="Start position for --moves")
+    parser.add_argument("--moves", nargs="*", default=[], help="UCI moves played with incremental updates")
+    parser.add_argument("--trace", action="store_true", help="Print the accumulator CRC32 per ply")
+    parser.add_argument("--positions", default=None, help="FEN / EPD file ('-' for stdin) to batch evaluate")
+    args = parser.parse_args(argv)
+
+    network = NumpyNNUE.from_file(args.weights)
+
+    if args.positions is not None:
+        source = sys.stdin if args.positions == "-" else open(args.positions, "r")
+        with source:
+            fens = [line.strip() for line in source if line.strip() and not line.startswith("#")]
+        evals, valid = network.evaluate_fens(fens)
+        for fen, evaluation, ok in zip(fens, evals.tolist(), valid.tolist()):
+            print(f"{fen},{evaluation if ok else ''}")
+        return
+
+    board = Board(args.fen)
+    acc = Accumulator(network, board.squares)
+    for ply, uci in enumerate(["startpos"] + args.moves):
+        if ply > 0:
+            acc.move(board.push_uci(uci))
+        line = f"{ply:3d} {uci:8s} {acc.read(board.white_to_move):+6d}"
+        if args.trace:
+            line += f"  crc32={acc.crc32():08x}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+Compact on-disk record format with random access.
+
+A record_dtype row spends 64 bytes on eight bitboards. A legal position only needs
+its occupancy plus a 4-bit code (color << 3 | piece) per occupied square, so a packed
+record is 17 fixed bytes + one nibble per piece: ~30 bytes for a middlegame position
+and at most 33 bytes with 32 pieces, vs 73 bytes.
+
+Records are stored in chunks of chunk_records. Each chunk is columnar so it decodes
+with a handful of vectorized operations:
+
+    occupancy u64[n], stm u8[n], castling u8[n], ep_file u8[n], eval_i16 i16[n],
+    wdl_f32 f32[n], then the piece nibbles of all records (square order, low nibble first)
+
+Chunks holding a record whose bitboards do not describe a board (overlapping pieces,
+a square in both colors, ...) are stored as raw record_dtype rows instead, so any
+record file round-trips exactly. Chunks can additionally be zlib-compressed.
+
+File layout (little-endian):
+    header        packed_header_dtype (magic, version, record / chunk counts, table offset)
+    chunks        chunk payloads, back to back
+    chunk table   packed_chunk_dtype[chunks] (offset, size, records, flags)
+
+    python packed.py preprocessed_positions.bin -o preprocessed_positions.pk --compress
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from data import RECORD_SIZE, record_dtype
+from ingest import popcount64
+
+PACKED_MAGIC = b"LNPK"
+PACKED_VERSION = 1
+PACKED_SUFFIX = ".pk"
+
+DEFAULT_CHUNK_RECORDS = 4096
+
+CHUNK_RAW = 1   # chunk holds record_dtype rows
+CHUNK_ZLIB = 2  # chunk payload is zlib-compressed
+
+packed_header_dtype = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u2"),
+    ("reserved", "<u2"),
+    ("records", "<u8"),
+    ("chunk_records", "<u4"),
+    ("chunks", "<u4"),
+    ("table_offset", "<u8"),
+])
+
+packed_chunk_dtype = np.dtype([
+    ("offset", "<u8"),
+    ("size", "<u4"),
+    ("records", "<u4"),
+    ("flags", "u1"),
+    ("reserved", "u1", (3,)),
+])
+
+_PIECE_FIELDS = ("bb_pawns", "bb_knights", "bb_bishops", "bb_rooks", "bb_queens", "bb_kings")
+
+# Fixed per-record columns of a packed chunk, in order
+_COLUMNS = [
+    ("occupancy", np.dtype("<u8")),
+    ("stm", np.dtype("u1")),
+    ("castling", np.dtype("u1")),
+    ("ep_file", np.dtype("u1")),
+    ("eval_i16", np.dtype("<i2")),
+    ("wdl_f32", np.dtype("<f4")),
+]
+
+
+def _bits(bitboards: np.ndarray) -> np.ndarray:
+    """(N,) uint64 -> (N, 64) uint8 0/1 in square order."""
+    bbs = np.ascontiguousarray(bitboards, dtype="<u8")
+    return np.unpackbits(bbs.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+
+
+def _bitboards(mask: np.ndarray) -> np.ndarray:
+    """(N, 64) bool in square order -> (N,) uint64."""
+    packed = np.packbits(mask, axis=1, bitorder="little")
+    return np.ascontiguousarray(packed).view("<u8").reshape(-1)
+
+
+def packable(recs: np.ndarray) -> bool:
+    """True if every record is a board: disjoint pieces, disjoint colors, both covering the occupancy."""
+    occupancy = recs["bb_white"] | recs["bb_black"]
+    pieces = np.zeros(len(recs), dtype=np.uint64)
+    piece_total = np.zeros(len(recs), dtype=np.int64)
+    for field in _PIECE_FIELDS:
+        pieces |= recs[field]
+        piece_total += popcount64(recs[field])
+    return bool(
+        np.all((recs["bb_white"] & recs["bb_black"]) == 0)
+        and np.all(pieces == occupancy)
+        and np.all(piece_total == popcount64(occupancy))
+    )
+
+
+def encode_chunk(recs: np.ndarray) -> tuple[bytes, int]:
+    """Chunk payload and flags for a record array (raw rows if it is not packable)."""
+    recs = np.ascontiguousarray(recs, dtype=record_dtype)
+    if not packable(recs):
+        return recs.tobytes(), CHUNK_RAW
+
+    occupancy = recs["bb_white"] | recs["bb_black"]
+    codes = np.zeros((len(recs), 64), dtype=np.uint8)
+    codes += _bits(recs["bb_white"]) << 3
+    for p, field in enumerate(_PIECE_FIELDS):
+        codes += _bits(recs[field]) * np.uint8(p)
+    nibbles = codes[_bits(occupancy).astype(bool)]  # row-major: record by record, squares ascending
+    if len(nibbles) % 2:
+        nibbles = np.append(nibbles, np.uint8(0))
+
+    parts = [occupancy.astype("<u8").tobytes()]
+    parts += [recs[name].astype(dtype).tobytes() for name, dtype in _COLUMNS[1:]]
+    parts.append((nibbles[0::2] | (nibbles[1::2] << 4)).astype(np.uint8).tobytes())
+    return b"".join(parts), 0
+
+
+def decode_chunk(payload: bytes, records: int, flags: int) -> np.ndarray:
+    """Inverse of encode_chunk: record_dtype array of the chunk's records."""
+    if flags & CHUNK_ZLIB:
+        payload = zlib.decompress(payload)
+    if flags & CHUNK_RAW:
+        return np.frombuffer(payload, dtype=record_dtype, count=records).copy()
+
+    recs = np.zeros(records, dtype=record_dtype)
+    columns = {}
+    offset = 0
+    for name, dtype in _COLUMNS:
+        columns[name] = np.frombuffer(payload, dtype=dtype, count=records, offset=offset)
+        offset += records * dtype.itemsize
+    packed = np.frombuffer(payload, dtype=np.uint8, offset=offset)
+    nibbles = np.empty(2 * len(packed), dtype=np.uint8)
+    nibbles[0::2] = packed & 0x0F
+    nibbles[1::2] = packed >> 4
+
+    occupied = _bits(columns["occupancy"]).astype(bool)
+    codes = np.full((records, 64), 0xFF, dtype=np.uint8)
+    codes[occupied] = nibbles[:int(occupied.sum())]
+    white = occupied & (codes >> 3 == 1)
+    recs["bb_white"] = _bitboards(white)
+    recs["bb_black"] = _bitboards(occupied & ~white)
+    piece = codes & 0x07
+    for p, field in enumerate(_PIECE_FIELDS):
+        recs[field] = _bitboards(occupied & (piece == p))
+    for name, _ in _COLUMNS[1:]:
+        recs[name] = columns[name]
+    return recs
+
+
+class PackedWriter:
+    """Streams record arrays into a packed file; chunks are cut every chunk_records records."""
+    def __init__(self, path: str | os.PathLike, chunk_records: int = DEFAULT_CHUNK_RECORDS, compress: bool = False):
+        self.path = os.fspath(path)
+        self.chunk_records = int(chunk_records)
+        self.compress = compress
+        self.pending = []
+        self.pending_records = 0
+        self.table = []
+        self.records = 0
+        self.fh = open(self.path, "wb")
+        self.fh.write(bytes(packed_header_dtype.itemsize))  # rewritten by close()
+
+    def write(self, recs: np.ndarray):
+        self.pending.append(np.asarray(recs, dtype=record_dtype))
+        self.pending_records += len(recs)
+        while self.pending_records >= self.chunk_records:
+            self._flush(self.chunk_records)
+
+    def _flush(self, count: int):
+        buffered = np.concatenate(self.pending) if len(self.pending) > 1 else self.pending[0]
+        chunk, rest = buffered[:count], buffered[count:]
+        self.pending = [rest] if len(rest) else []
+        self.pending_records = len(rest)
+
+        payload, flags = encode_chunk(chunk)
+        if self.compress:
+            payload, flags = zlib.compress(payload, 1), flags | CHUNK_ZLIB
+        self.table.append((self.fh.tell(), len(payload), len(chunk), flags))
+        self.fh.write(payload)
+        self.records += len(chunk)
+
+    def close(self):
+        if self.fh.closed:
+            return
+        if self.pending_records:
+            self._flush(self.pending_records)
+        table = np.zeros(len(self.table), dtype=packed_chunk_dtype)
+        for i, (offset, size, records, flags) in enumerate(self.table):
+            table[i] = (offset, size, records, flags, (0, 0, 0))
+        header = np.zeros(1, dtype=packed_header_dtype)
+        header["magic"] = PACKED_MAGIC
+        header["version"] = PACKED_VERSION
+        header["records"] = self.records
+        header["chunk_records"] = self.chunk_records
+        header["chunks"] = len(table)
+        header["table_offset"] = self.fh.tell()
+        self.fh.write(table.tobytes())
+        self.fh.seek(0)
+        self.fh.write(header.tobytes())
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_packed(recs: np.ndarray, path: str | os.PathLike, chunk_records: int = DEFAULT_CHUNK_RECORDS, compress: bool = False):
+    with PackedWriter(path, chunk_records, compress) as writer:
+        writer.write(recs)
+
+
+def pack_file(
+    src: str | os.PathLike,
+    dst: str | os.PathLike | None = None,
+    chunk_records: int = DEFAULT_CHUNK_RECORDS,
+    compress: bool = False,
+    read_records: int = 1 << 20,
+) -> str:
+    """Convert a record_dtype file to the packed format, streaming. Returns the output path."""
+    src = os.fspath(src)
+    dst = os.fspath(dst) if dst is not None else src + PACKED_SUFFIX
+    n = os.path.getsize(src) // RECORD_SIZE
+    tmp_path = f"{dst}.{os.getpid()}.tmp"
+    try:
+        with PackedWriter(tmp_path, chunk_records, compress) as writer:
+            if n:
+                mm = np.memmap(src, dtype=record_dtype, mode="r", shape=(n,))
+                for start in range(0, n, read_records):
+                    writer.write(np.array(mm[start:start + read_records]))
+                del mm
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, dst)
+    return dst
+
+
+def is_packed_file(path: str | os.PathLike) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(PACKED_MAGIC)) == PACKED_MAGIC
+
+
+class PackedRecords:
+    """
+    Random-access reader of a packed file that indexes like a record_dtype array
+    (int, slice or index array). Decoded chunks are kept in a small LRU cache, so
+    reading neighbouring records (sequential or block-shuffled) decodes every chunk once.
+    Uniformly random reads decode about one chunk per record, which is why make_dataloader
+    block-shuffles datasets on packed files.
+    """
+    def __init__(self, path: str | os.PathLike, cache_chunks: int = 64):
+        self.path = os.fspath(path)
+        with open(self.path, "rb") as f:
+            header = np.frombuffer(f.read(packed_header_dtype.itemsize), dtype=packed_header_dtype)
+            if len(header) != 1 or header["magic"][0] != PACKED_MAGIC:
+                raise ValueError(f"{self.path} is not a packed record file")
+            header = header[0]
+            if header["version"] != PACKED_VERSION:
+                raise ValueError(f"{self.path}: unsupported packed version {header['version']}")
+            f.seek(int(header["table_offset"]))
+            self.table = np.frombuffer(f.read(int(header["chunks"]) * packed_chunk_dtype.itemsize), dtype=packed_chunk_dtype)
+        self.records = int(header["records"])
+        self.chunk_records = int(header["chunk_records"])
+        if len(self.table) != int(header["chunks"]) or int(self.table["records"].sum()) != self.records:
+            raise ValueError(f"{self.path}: corrupt chunk table")
+        self.dtype = record_dtype
+        self.cache_chunks = cache_chunks
+        self.cache = OrderedDict()
+        self.fh = None
+
+    def __len__(self) -> int:
+        return self.records
+
+    def __getstate__(self):
+        # Worker processes reopen the file
+        state = self.__dict__.copy()
+        state["fh"] = None
+        state["cache"] = OrderedDict()
+        return state
+
+    def chunk(self, c: int) -> np.ndarray:
+        """Decoded records of chunk c."""
+        recs = self.cache.get(c)
+        if recs is not None:
+            self.cache.move_to_end(c)
+            return recs
+        if self.fh is None:
+            self.fh = open(self.path, "rb")
+        entry = self.table[c]
+        self.fh.seek(int(entry["offset"]))
+        recs = decode_chunk(self.fh.read(int(entry["size"])), int(entry["records"]), int(entry["flags"]))
+        self.cache[c] = recs
+        if len(self.cache) > self.cache_chunks:
+            self.cache.popitem(last=False)
+        return recs
+
+    def take(self, indices) -> np.ndarray:
+        """record_dtype rows at indices (any order), decoding each needed chunk once."""
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.size and (indices.min() < 0 or indices.max() >= self.records):
+            raise IndexError("Index out of range")
+        out = np.empty(len(indices), dtype=record_dtype)
+        # Every chunk but the last holds exactly chunk_records records
+        chunks = indices // self.chunk_records
+        order = np.argsort(chunks, kind="stable")
+        bounds = np.flatnonzero(np.diff(chunks[order])) + 1
+        for group in np.split(order, bounds):
+            if len(group):
+                c = int(chunks[group[0]])
+                out[group] = self.chunk(c)[indices[group] - c * self.chunk_records]
+        return out
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            index = int(key) + (self.records if key < 0 else 0)
+            return self.take([index])[0]
+        if isinstance(key, slice):
+            return self.take(np.arange(*key.indices(self.records)))
+        return self.take(key)
+
+    def __iter__(self):
+        for c in range(len(self.table)):
+            yield from self.chunk(c)
+
+    def iter_chunks(self):
+        """Decoded chunks in file order, without touching the cache."""
+        with open(self.path, "rb") as f:
+            for entry in self.table:
+                f.seek(int(entry["offset"]))
+                yield decode_chunk(f.read(int(entry["size"])), int(entry["records"]), int(entry["flags"]))
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a record file to the packed format")
+    parser.add_argument("input", help="record_dtype file (e.g. preprocessed_positions.bin)")
+    parser.add_argument("-o", "--output", default=None, help=f"Output path (default: <input>{PACKED_SUFFIX})")
+    parser.add_argument("--chunk-records", type=int, default=DEFAULT_CHUNK_RECORDS)
+    parser.add_argument("--compress", action="store_true", help="zlib-compress every chunk")
+    args = parser.parse_args(argv)
+
+    output = pack_file(args.input, args.output, args.chunk_records, args.compress)
+    src, dst = os.path.getsize(args.input), os.path.getsize(output)
+    records = src // RECORD_SIZE
+    print(f"Wrote {output}: {records:,} records, {dst:,} bytes "
+          f"({dst / max(records, 1):.1f} bytes/record, {dst / max(src, 1):.1%} of the input)")
+
+
+if __name__ == "__main__":
+    main()
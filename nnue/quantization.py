@@ -0,0 +1,206 @@
+"""
+Integer quantization of the NNUE for the engine.
+
+Feature weights and biases become int16 at QA scale, so the accumulator is a sum of
+int16 rows and the engine's clamp to [0, 1] becomes a clamp to [0, QA]. Output weights
+become int8 (or int16 when they do not fit) at QB scale and the output bias int32 at
+QA * QB scale, so
+
+    eval = SCALE * (output_bias + sum(crelu(acc) * output_weights)) / (QA * QB)
+
+matches the commented-out integer path in NNUE.cs. The constants mirror NNUE.cs.
+
+Quantized file layout (little-endian), see write_quantized / read_quantized:
+    header   quantized_header_dtype (magic, version, sizes, QA/QB, output dtype, CRC32)
+    int16    hidden weights [input_size][hidden_size]  (feature-major: one accumulator row per feature)
+    int16    hidden bias    [hidden_size]
+    int8/16  output weights [hidden_size]
+    int32    output bias
+The CRC32 covers everything after the header.
+"""
+from __future__ import annotations
+
+import zlib
+from typing import NamedTuple
+
+import numpy as np
+
+# Must match NNUE.cs
+QA = 255
+QB = 64
+SCALE = 410
+INPUT_SIZE = 768
+
+QUANTIZED_MAGIC = b"LNUQ"
+QUANTIZED_VERSION = 1
+
+OUTPUT_DTYPES = {1: np.dtype("<i1"), 2: np.dtype("<i2")}
+
+# Per-weight bound that keeps any accumulator (bias + at most 32 active features) in int16
+MAX_ACTIVE_FEATURES = 32
+HIDDEN_WEIGHT_LIMIT = np.iinfo(np.int16).max // (MAX_ACTIVE_FEATURES + 1)
+
+quantized_header_dtype = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u2"),
+    ("input_size", "<u2"),
+    ("hidden_size", "<u2"),
+    ("qa", "<u2"),
+    ("qb", "<u2"),
+    ("output_dtype", "u1"),  # key of OUTPUT_DTYPES
+    ("reserved", "u1"),
+    ("crc32", "<u4"),
+])
+
+
+class QuantizedNNUE(NamedTuple):
+    hidden_weights: np.ndarray  # (input_size, hidden_size) int16, feature-major
+    hidden_bias: np.ndarray     # (hidden_size,) int16
+    output_weights: np.ndarray  # (hidden_size,) int8 or int16
+    output_bias: np.int32
+
+    @property
+    def hidden_size(self) -> int:
+        return self.hidden_weights.shape[1]
+
+
+class QuantizationReport(NamedTuple):
+    """How many values had to be clamped to fit their integer type."""
+    hidden_weights_clamped: int
+    hidden_bias_clamped: int
+    output_weights_clamped: int
+
+
+def float_weights(state_dict) -> tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+    """(hidden_weight [H, 768], hidden_bias [H], output_weight [H], output_bias) as float32 numpy."""
+    def get(name):
+        value = state_dict[name]
+        return value.detach().cpu().numpy().astype(np.float32) if hasattr(value, "detach") else np.asarray(value, np.float32)
+    return (
+        get("hidden.weight"),
+        get("hidden.bias"),
+        get("output.weight").reshape(-1),
+        float(get("output.bias").reshape(-1)[0]),
+    )
+
+
+def _quantize(values: np.ndarray, scale: float, low: int, high: int, dtype) -> tuple[np.ndarray, int]:
+    q = np.rint(values.astype(np.float64) * scale)
+    clamped = int(np.count_nonzero((q < low) | (q > high)))
+    return np.clip(q, low, high).astype(dtype), clamped
+
+
+def quantize_state_dict(state_dict, output_dtype: str = "auto") -> tuple[QuantizedNNUE, QuantizationReport]:
+    """
+    Round the float NNUE (a 1_train.NNUE state_dict) to the engine's integer format.
+    output_dtype is "int8", "int16" or "auto" (int8 if no output weight needs clamping).
+    """
+    hidden_weight, hidden_bias, output_weight, output_bias = float_weights(state_dict)
+
+    w, w_clamped = _quantize(hidden_weight.T, QA, -HIDDEN_WEIGHT_LIMIT, HIDDEN_WEIGHT_LIMIT, np.int16)
+    b, b_clamped = _quantize(hidden_bias, QA, -HIDDEN_WEIGHT_LIMIT, HIDDEN_WEIGHT_LIMIT, np.int16)
+
+    if output_dtype == "auto":
+        fits = np.all(np.abs(np.rint(output_weight.astype(np.float64) * QB)) <= np.iinfo(np.int8).max)
+        output_dtype = "int8" if fits else "int16"
+    if output_dtype not in ("int8", "int16"):
+        raise ValueError(f"output_dtype must be 'auto', 'int8' or 'int16', got {output_dtype!r}")
+    info = np.iinfo(output_dtype)
+    ow, ow_clamped = _quantize(output_weight, QB, info.min, info.max, output_dtype)
+    ob = np.int32(np.rint(output_bias * QA * QB))
+
+    return (
+        QuantizedNNUE(np.ascontiguousarray(w), b, ow, ob),
+        QuantizationReport(w_clamped, b_clamped, ow_clamped),
+    )
+
+
+def dequantized_weights(q: QuantizedNNUE) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.float32]:
+    """
+    The float weights the integers stand for, in float_weights order. Quantizing them
+    again gives back exactly q (they are on the QA / QB grids).
+    """
+    return (
+        (q.hidden_weights.T / np.float32(QA)).astype(np.float32),
+        (q.hidden_bias / np.float32(QA)).astype(np.float32),
+        (q.output_weights / np.float32(QB)).astype(np.float32),
+        np.float32(q.output_bias / (QA * QB)),
+    )
+
+
+def _payload(q: QuantizedNNUE) -> bytes:
+    return b"".join([
+        q.hidden_weights.astype("<i2").tobytes(),
+        q.hidden_bias.astype("<i2").tobytes(),
+        q.output_weights.astype(q.output_weights.dtype.newbyteorder("<")).tobytes(),
+        np.array([q.output_bias], dtype="<i4").tobytes(),
+    ])
+
+
+def write_quantized(q: QuantizedNNUE, path: str):
+    payload = _payload(q)
+    dtype_code = {v.itemsize: k for k, v in OUTPUT_DTYPES.items()}[q.output_weights.dtype.itemsize]
+    header = np.zeros(1, dtype=quantized_header_dtype)
+    header["magic"] = QUANTIZED_MAGIC
+    header["version"] = QUANTIZED_VERSION
+    header["input_size"] = q.hidden_weights.shape[0]
+    header["hidden_size"] = q.hidden_size
+    header["qa"] = QA
+    header["qb"] = QB
+    header["output_dtype"] = dtype_code
+    header["crc32"] = zlib.crc32(payload)
+    with open(path, "wb") as f:
+        f.write(header.tobytes())
+        f.write(payload)
+
+
+def read_quantized(path: str) -> QuantizedNNUE:
+    with open(path, "rb") as f:
+        data = f.read()
+    header = np.frombuffer(data, dtype=quantized_header_dtype, count=1)[0]
+    if header["magic"] != QUANTIZED_MAGIC:
+        raise ValueError(f"{path} is not a quantized NNUE file")
+    if header["version"] != QUANTIZED_VERSION:
+        raise ValueError(f"{path}: unsupported quantized NNUE version {header['version']}")
+    if (header["qa"], header["qb"]) != (QA, QB):
+        raise ValueError(f"{path}: quantized with QA={header['qa']}, QB={header['qb']}, expected {QA}, {QB}")
+    payload = data[quantized_header_dtype.itemsize:]
+    if zlib.crc32(payload) != header["crc32"]:
+        raise ValueError(f"{path}: checksum mismatch")
+
+    n_in, n_hidden = int(header["input_size"]), int(header["hidden_size"])
+    output_dtype = OUTPUT_DTYPES[int(header["output_dtype"])]
+    offset = 0
+
+    def take(dtype, count):
+        nonlocal offset
+        array = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        return array
+
+    w = take("<i2", n_in * n_hidden).reshape(n_in, n_hidden)
+    b = take("<i2", n_hidden)
+    ow = take(output_dtype, n_hidden)
+    ob = take("<i4", 1)[0]
+    if offset != len(payload):
+        raise ValueError(f"{path}: unexpected payload size {len(payload)}")
+    return QuantizedNNUE(w, b, ow, ob)
+
+
+def float_eval(state_dict, planes: np.ndarray) -> np.ndarray:
+    """Engine eval (SCALE * logit, white's perspective) of the float model for (N, 768) planes."""
+    hidden_weight, hidden_bias, output_weight, output_bias = float_weights(state_dict)
+    hidden = np.clip(planes @ hidden_weight.T + hidden_bias, 0.0, 1.0)
+    return SCALE * (hidden @ output_weight + output_bias)
+
+
+def quantized_eval(q: QuantizedNNUE, planes: np.ndarray) -> np.ndarray:
+    """
+    Engine eval of the quantized model, in integer arithmetic like the engine would do it.
+    Returns int64 centipawns (truncated like the C# short cast).
+    """
+    active = planes.astype(bool)
+    acc = active.astype(np.int32) @ q.hidden_weights.astype(np.int32) + q.hidden_bias.astype(np.int32)
+    crelu = np.clip(acc, 0, QA).astype(np.int64)
+    output = crelu @ q.output_weights.astype(np.int64) + np.int64(q.output_bias)
+    return np.trunc(SCALE * output / (QA * QB)).astype(np.int64)
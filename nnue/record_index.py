@@ -0,0 +1,264 @@
+"""
+Sidecar columnar index of a record file (<records>.index).
+
+Facts every consumer used to re-derive from the raw record_dtype rows are computed once
+and stored column by column, aligned to record index, so a subset can be selected from
+a few memory-mapped bytes per record without touching the record file:
+
+    key          uint64  Zobrist position key (zobrist.py)
+    source       uint16  index into the source file names, UNKNOWN_SOURCE if unknown
+    eval_i16     int16   eval in centipawns (for eval bands)
+    piece_count  uint8   occupied squares (game phase)
+    category     uint8   index into CATEGORY_ORDER
+    stm          uint8   side to move as stored in the record (7 white, 0 black)
+
+Layout: record_index_header_dtype, the source names as UTF-8 JSON padded to 8 bytes,
+then the columns in the order above. Like the feature cache, the header stores the
+record file's size and mtime so a rewritten file is detected.
+
+Records are shuffled and mirrored after ingestion, so sources are not carried through
+the pipeline: the preprocessor builds a SourceTable (Zobrist key -> source id) and the
+index looks every record's key up in it.
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from data import open_records
+from ingest import count_pieces
+from zobrist import zobrist_keys
+
+RECORD_INDEX_SUFFIX = ".index"
+RECORD_INDEX_MAGIC = b"NNUEIX01"
+
+UNKNOWN_SOURCE = 0xFFFF
+
+# Category order used when writing output blocks: (almost_equal, wdl_low)
+CATEGORY_ORDER = [(True, True), (True, False), (False, True), (False, False)]
+
+record_index_header_dtype = np.dtype([
+    ("magic", "S8"),
+    ("source_size", "<u8"),
+    ("source_mtime_ns", "<i8"),
+    ("records", "<u8"),
+    ("names_size", "<u8"),  # bytes of the padded JSON list of source names
+])
+
+INDEX_COLUMNS = [
+    ("key", np.dtype("<u8")),
+    ("source", np.dtype("<u2")),
+    ("eval_i16", np.dtype("<i2")),
+    ("piece_count", np.dtype("u1")),
+    ("category", np.dtype("u1")),
+    ("stm", np.dtype("u1")),
+]
+
+
+def category_codes(positions):
+    """
+    Index into CATEGORY_ORDER for every record, where a category is
+    (almost_equal: |eval| <= 100 cp, wdl_low: wdl < 0.5).
+    """
+    almost_equal = np.abs(positions["eval_i16"].astype(np.int32)) <= 100
+    wdl_low = positions["wdl_f32"] < 0.5
+    return ((~almost_equal).astype(np.uint8) << 1) | (~wdl_low).astype(np.uint8)
+
+
+class SourceTable(NamedTuple):
+    """Zobrist key -> source id lookup: sorted unique keys and their sources."""
+    keys: np.ndarray     # uint64, sorted
+    sources: np.ndarray  # uint16
+
+    @classmethod
+    def from_keys(cls, keys: np.ndarray, sources: np.ndarray) -> "SourceTable":
+        """Table where every key maps to the source of its first occurrence."""
+        unique_keys, first = np.unique(np.asarray(keys, dtype=np.uint64), return_index=True)
+        return cls(unique_keys, np.asarray(sources, dtype=np.uint16)[first])
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        if len(self.keys) == 0:
+            return np.full(len(keys), UNKNOWN_SOURCE, dtype=np.uint16)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[pos] == keys, self.sources[pos], UNKNOWN_SOURCE).astype(np.uint16)
+
+
+def record_index_path(path: str | os.PathLike) -> str:
+    return os.fspath(path) + RECORD_INDEX_SUFFIX
+
+
+def _source_stamp(path: str) -> tuple[int, int]:
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _names_block(source_names: Sequence[str]) -> bytes:
+    names = json.dumps(list(source_names)).encode("utf-8")
+    return names + b" " * (-len(names) % 8)
+
+
+def build_record_index(
+    path: str | os.PathLike,
+    source_table: SourceTable | None = None,
+    source_names: Sequence[str] = (),
+    index_path: str | None = None,
+    chunk_records: int = 1 << 20,
+    previous: RecordIndex | None = None,
+) -> str:
+    """
+    Compute the index columns of every record of `path` and write them next to it.
+    Without a source_table every source is UNKNOWN_SOURCE.
+    `previous` is the index of a prefix of the file (opened before records were appended):
+    its columns are copied and only the records after it are read.
+    """
+    path = os.fspath(path)
+    index_path = index_path or record_index_path(path)
+    size, mtime_ns = _source_stamp(path)
+    records = open_records(path)
+    n = len(records)
+    names = _names_block(source_names)
+
+    header = np.zeros(1, dtype=record_index_header_dtype)
+    header["magic"] = RECORD_INDEX_MAGIC
+    header["source_size"] = size
+    header["source_mtime_ns"] = mtime_ns
+    header["records"] = n
+    header["names_size"] = len(names)
+
+    # Per-process temporary name, see build_feature_cache
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            header.tofile(f)
+            f.write(names)
+            base = f.tell()
+            if n:
+                f.truncate(base + n * sum(dtype.itemsize for _, dtype in INDEX_COLUMNS))
+                columns = _column_memmaps(tmp_path, base, n, mode="r+")
+                reused = len(previous) if previous is not None else 0
+                for start in range(0, reused, chunk_records):
+                    end = min(start + chunk_records, reused)
+                    for name, _ in INDEX_COLUMNS:
+                        columns[name][start:end] = previous[name][start:end]
+                for start in range(reused, n, chunk_records):
+                    chunk = np.array(records[start:start + chunk_records])
+                    end = start + len(chunk)
+                    keys = zobrist_keys(chunk)
+                    columns["key"][start:end] = keys
+                    columns["source"][start:end] = (
+                        source_table.lookup(keys) if source_table is not None else UNKNOWN_SOURCE
+                    )
+                    columns["eval_i16"][start:end] = chunk["eval_i16"]
+                    columns["piece_count"][start:end] = count_pieces(chunk)
+                    columns["category"][start:end] = category_codes(chunk)
+                    columns["stm"][start:end] = chunk["stm"]
+                for column in columns.values():
+                    column.flush()
+                del columns
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def _column_memmaps(index_path: str, base: int, n: int, mode: str = "r") -> dict:
+    columns = {}
+    offset = base
+    for name, dtype in INDEX_COLUMNS:
+        columns[name] = np.memmap(index_path, dtype=dtype, mode=mode, offset=offset, shape=(n,))
+        offset += n * dtype.itemsize
+    return columns
+
+
+class RecordIndex:
+    """Memory-mapped index columns of one record file, see the module docstring."""
+    def __init__(self, columns: dict, source_names: list[str], records: int):
+        self.columns = columns
+        self.source_names = source_names
+        self.records = records
+
+    def __len__(self) -> int:
+        return self.records
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if self.records == 0:
+            return np.empty(0, dtype=dict(INDEX_COLUMNS)[name])
+        return self.columns[name]
+
+    def source_id(self, name: str) -> int:
+        """Source id of a file name (as passed to build_record_index, or its basename)."""
+        for i, source in enumerate(self.source_names):
+            if name in (source, os.path.basename(source)):
+                return i
+        raise KeyError(f"unknown source {name!r}")
+
+    def mask(
+        self,
+        min_pieces: int | None = None,
+        max_pieces: int | None = None,
+        eval_range: tuple[int, int] | None = None,
+        categories: Sequence[int] | None = None,
+        sources: Sequence[int | str] | None = None,
+        stm: int | None = None,
+    ) -> np.ndarray:
+        """
+        Boolean mask over all records that meet every given condition: piece count in
+        [min_pieces, max_pieces], eval in [low, high], category / source in the lists,
+        side to move equal to stm. Only the columns a condition needs are read.
+        """
+        keep = np.ones(self.records, dtype=bool)
+        if min_pieces is not None:
+            keep &= self["piece_count"] >= min_pieces
+        if max_pieces is not None:
+            keep &= self["piece_count"] <= max_pieces
+        if eval_range is not None:
+            low, high = eval_range
+            evals = self["eval_i16"]
+            keep &= (evals >= low) & (evals <= high)
+        if categories is not None:
+            keep &= np.isin(self["category"], np.asarray(categories, dtype=np.uint8))
+        if sources is not None:
+            ids = [s if isinstance(s, (int, np.integer)) else self.source_id(s) for s in sources]
+            keep &= np.isin(self["source"], np.asarray(ids, dtype=np.uint16))
+        if stm is not None:
+            keep &= self["stm"] == stm
+        return keep
+
+
+def open_record_index(path: str | os.PathLike, index_path: str | None = None) -> Optional[RecordIndex]:
+    """Memory-map the index of `path`, or return None if it is missing or stale."""
+    path = os.fspath(path)
+    index_path = index_path or record_index_path(path)
+    try:
+        header = np.fromfile(index_path, dtype=record_index_header_dtype, count=1)
+        index_size = os.path.getsize(index_path)
+    except FileNotFoundError:
+        return None
+    if len(header) != 1 or header["magic"][0] != RECORD_INDEX_MAGIC:
+        return None
+    size, mtime_ns = _source_stamp(path)
+    if int(header["source_size"][0]) != size or int(header["source_mtime_ns"][0]) != mtime_ns:
+        return None
+    n = int(header["records"][0])
+    names_size = int(header["names_size"][0])
+    base = record_index_header_dtype.itemsize + names_size
+    if index_size != base + n * sum(dtype.itemsize for _, dtype in INDEX_COLUMNS):
+        return None
+    with open(index_path, "rb") as f:
+        f.seek(record_index_header_dtype.itemsize)
+        source_names = json.loads(f.read(names_size).decode("utf-8"))
+    columns = _column_memmaps(index_path, base, n) if n else {}
+    return RecordIndex(columns, source_names, n)
+
+
+def ensure_record_index(path: str | os.PathLike, index_path: str | None = None) -> str:
+    """Build the index of `path` (without sources) unless a fresh one already exists."""
+    index_path = index_path or record_index_path(path)
+    if open_record_index(path, index_path) is None:
+        print(f"Building record index {index_path}...")
+        build_record_index(path, index_path=index_path)
+    return index_path
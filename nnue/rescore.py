@@ -0,0 +1,311 @@
+"""
+Syzygy rescoring stage.
+
+Eligible endgames (3-5 pieces) are probed on a process pool where every worker owns
+its own tablebase handle. Results are stored in a persistent on-disk cache keyed by
+Zobrist key, so re-runs over overlapping corpora only probe new positions. Any object
+with a `probe(records, keys)` method can stand in for the tablebase (see StubProber).
+
+Can also be run on its own to rescore an existing record file in place:
+    python rescore.py preprocessed_positions.bin --syzygy-path /data/syzygy
+"""
+from __future__ import annotations
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from data import record_dtype
+from ingest import count_pieces
+from zobrist import zobrist_keys
+
+SYZYGY_DEFAULT_PATH = "C:\\dev\\chess-data\\syzygy"
+
+# Marks "no tablebase result" in int8 WDL arrays (real results are -2..2)
+NO_RESULT = np.int8(-128)
+
+# (wdl_f32, eval_i16) written for a white win, draw and white loss
+WIN = (np.float32(1.0), np.int16(200))
+DRAW = (np.float32(0.5), np.int16(0))
+LOSS = (np.float32(0.0), np.int16(-200))
+
+
+def record_to_board(rec, chess_module):
+    """Reconstruct a python-chess Board from a record."""
+    board = chess_module.Board(None)
+
+    white_mask = int(rec["bb_white"])
+    black_mask = int(rec["bb_black"])
+
+    piece_masks = (
+        (chess_module.PAWN, int(rec["bb_pawns"])),
+        (chess_module.KNIGHT, int(rec["bb_knights"])),
+        (chess_module.BISHOP, int(rec["bb_bishops"])),
+        (chess_module.ROOK, int(rec["bb_rooks"])),
+        (chess_module.QUEEN, int(rec["bb_queens"])),
+        (chess_module.KING, int(rec["bb_kings"])),
+    )
+
+    for color, color_mask in ((chess_module.WHITE, white_mask), (chess_module.BLACK, black_mask)):
+        for piece_type, mask in piece_masks:
+            color_piece_mask = mask & color_mask
+            while color_piece_mask:
+                lsb = color_piece_mask & -color_piece_mask
+                square_index = lsb.bit_length() - 1
+                board.set_piece_at(square_index, chess_module.Piece(piece_type, color))
+                color_piece_mask ^= lsb
+
+    board.turn = bool(int(rec["stm"]))
+    board.castling_rights = chess_module.BB_EMPTY
+    board.ep_square = None
+    board.halfmove_clock = 0
+    board.fullmove_number = 1
+
+    return board
+
+
+class SyzygyProber:
+    """
+    Probes the 3-4-5 WDL tables with python-chess. Only the path is pickled, so each
+    worker process opens its own tablebase handle on first use.
+    """
+    def __init__(self, syzygy_path: str):
+        self.syzygy_path = syzygy_path
+        self.wdl_dir = os.path.join(syzygy_path, "3-4-5-wdl")
+        self._tablebase = None
+
+    def __getstate__(self):
+        return {"syzygy_path": self.syzygy_path, "wdl_dir": self.wdl_dir, "_tablebase": None}
+
+    def close(self):
+        if self._tablebase is not None:
+            self._tablebase.close()
+            self._tablebase = None
+
+    def probe(self, records, keys):
+        """WDL from the side to move's perspective for every record, NO_RESULT if unknown."""
+        import chess
+        import chess.syzygy
+
+        if self._tablebase is None:
+            self._tablebase = chess.syzygy.Tablebase()
+            self._tablebase.add_directory(self.wdl_dir, load_wdl=True, load_dtz=False)
+
+        results = np.full(len(records), NO_RESULT, dtype=np.int8)
+        for i, rec in enumerate(records):
+            try:
+                board = record_to_board(rec, chess)
+                results[i] = self._tablebase.probe_wdl(board)
+            except (ValueError, chess.syzygy.MissingTableError):
+                continue
+        return results
+
+
+class StubProber:
+    """
+    Stand-in prober for tests and machines without the tablebase files mounted.
+    Looks results up by Zobrist key, falling back to `default`.
+    """
+    def __init__(self, results: dict[int, int] | None = None, default: int | None = None):
+        self.results = dict(results or {})
+        self.default = NO_RESULT if default is None else np.int8(default)
+        self.probed = 0
+
+    def probe(self, records, keys):
+        self.probed += len(keys)
+        return np.array([self.results.get(int(k), self.default) for k in keys], dtype=np.int8)
+
+
+def open_syzygy_prober(syzygy_path):
+    """Return a SyzygyProber if python-chess and the WDL tables are available, else None."""
+    try:
+        import chess.syzygy  # noqa: F401
+    except ImportError:
+        print("Syzygy rescoring skipped: python-chess is not installed")
+        return None
+
+    prober = SyzygyProber(syzygy_path)
+    if not os.path.isdir(prober.wdl_dir):
+        print(f"Syzygy rescoring skipped: directory not found ({prober.wdl_dir})")
+        return None
+    return prober
+
+
+class ProbeCache:
+    """Persistent WDL results keyed by Zobrist key, stored as an append-only file."""
+    entry_dtype = np.dtype([("key", "<u8"), ("wdl", "i1")])
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.keys = np.array([], dtype=np.uint64)
+        self.wdl = np.array([], dtype=np.int8)
+        if path and os.path.exists(path):
+            size = os.path.getsize(path)
+            entries = np.fromfile(path, dtype=self.entry_dtype, count=size // self.entry_dtype.itemsize)
+            self._merge(entries["key"], entries["wdl"])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _merge(self, keys, wdl):
+        # Only the new entries are sorted; they are merged in with one linear insert.
+        # The first result seen for a key wins, as in the append-only file.
+        keys, index = np.unique(np.asarray(keys, dtype=np.uint64), return_index=True)
+        wdl = np.asarray(wdl, dtype=np.int8)[index]
+        pos = np.searchsorted(self.keys, keys)
+        new = pos >= len(self.keys)
+        new[~new] = self.keys[pos[~new]] != keys[~new]
+        self.keys = np.insert(self.keys, pos[new], keys[new])
+        self.wdl = np.insert(self.wdl, pos[new], wdl[new])
+
+    def lookup(self, keys):
+        """Cached WDL for every key, NO_RESULT where the key was never probed."""
+        results = np.full(len(keys), NO_RESULT, dtype=np.int8)
+        if len(self.keys) == 0 or len(keys) == 0:
+            return results
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        hit = self.keys[pos] == keys
+        results[hit] = self.wdl[pos[hit]]
+        return results
+
+    def add(self, keys, wdl):
+        found = wdl != NO_RESULT
+        if not found.any():
+            return
+        entries = np.empty(int(found.sum()), dtype=self.entry_dtype)
+        entries["key"] = keys[found]
+        entries["wdl"] = wdl[found]
+        if self.path:
+            with open(self.path, "ab") as fh:
+                entries.tofile(fh)
+        self._merge(entries["key"], entries["wdl"])
+
+
+_worker_prober = None
+
+
+def _init_worker(prober):
+    global _worker_prober
+    _worker_prober = prober
+
+
+def _probe_batch(args):
+    records, keys = args
+    return _worker_prober.probe(records, keys)
+
+
+class SyzygyRescorer:
+    """
+    Rescoring stage. Use as a context manager so the worker pool (and every worker's
+    tablebase handle) is reused across calls to rescore().
+    """
+    def __init__(self, prober, cache_path: str | None = None, workers: int | None = None, batch_size: int = 4096):
+        self.prober = prober
+        self.cache = ProbeCache(cache_path)
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.cache_hits = 0
+        self.probed = 0
+        self._pool = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker, initargs=(self.prober,)
+            )
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        close = getattr(self.prober, "close", None)
+        if callable(close):
+            close()
+
+    def _probe(self, records, keys):
+        if self._pool is None or len(records) <= self.batch_size:
+            return self.prober.probe(records, keys)
+        batches = [
+            (records[i:i + self.batch_size], keys[i:i + self.batch_size])
+            for i in range(0, len(records), self.batch_size)
+        ]
+        return np.concatenate(list(self._pool.map(_probe_batch, batches)))
+
+    def rescore(self, positions, piece_counts, keys=None):
+        """
+        Rescore eligible endgames (3-5 pieces) in place.
+        Tablebase results are converted to white's perspective, matching the eval and
+        wdl written by SelfPlayDataGenerator. Returns (rescored, distribution).
+        """
+        eligible = np.flatnonzero((piece_counts >= 3) & (piece_counts <= 5))
+        if eligible.size == 0:
+            return 0, {}
+
+        eligible_keys = zobrist_keys(positions[eligible]) if keys is None else np.asarray(keys)[eligible]
+        results = self.cache.lookup(eligible_keys)
+        missing = np.flatnonzero(results == NO_RESULT)
+        self.cache_hits += eligible.size - missing.size
+
+        if missing.size:
+            probed = self._probe(positions[eligible[missing]], eligible_keys[missing])
+            self.probed += missing.size
+            self.cache.add(eligible_keys[missing], probed)
+            results[missing] = probed
+
+        found = results != NO_RESULT
+        indices = eligible[found]
+        white_to_move = positions["stm"][indices] != 0
+        outcome = np.sign(results[found]) * np.where(white_to_move, 1, -1)
+
+        distribution = {}
+        for name, sign, (wdl, cp) in (("win", 1, WIN), ("draw", 0, DRAW), ("loss", -1, LOSS)):
+            selected = indices[outcome == sign]
+            positions["wdl_f32"][selected] = wdl
+            positions["eval_i16"][selected] = cp
+            distribution[name] = int(selected.size)
+
+        return int(indices.size), distribution
+
+
+def rescore_file(path, prober, cache_path=None, workers=None, chunk_records=1 << 20):
+    """Rescore a record file in place, chunk by chunk."""
+    positions = np.memmap(path, dtype=record_dtype, mode="r+")
+    totals = {"win": 0, "draw": 0, "loss": 0}
+    rescored = 0
+    with SyzygyRescorer(prober, cache_path=cache_path, workers=workers) as rescorer:
+        for start in range(0, len(positions), chunk_records):
+            chunk = np.array(positions[start:start + chunk_records])
+            count, distribution = rescorer.rescore(chunk, count_pieces(chunk))
+            if count:
+                positions[start:start + len(chunk)] = chunk
+                rescored += count
+                for name, value in distribution.items():
+                    totals[name] += value
+        print(f"  Cache hits: {rescorer.cache_hits:,}, probed: {rescorer.probed:,}")
+    positions.flush()
+    del positions
+    return rescored, totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rescore endgame records in place with Syzygy WDL tables")
+    parser.add_argument("path", help="Record file (record_dtype) to rescore")
+    parser.add_argument("--syzygy-path", default=SYZYGY_DEFAULT_PATH, help="Folder containing 3-4-5-wdl")
+    parser.add_argument("--cache", default=None, help="Probe cache file (default: <path>.syzygy_cache)")
+    parser.add_argument("--workers", type=int, default=None, help="Probe worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    prober = open_syzygy_prober(args.syzygy_path)
+    if prober is None:
+        return
+    rescored, distribution = rescore_file(
+        args.path, prober, cache_path=args.cache or args.path + ".syzygy_cache", workers=args.workers
+    )
+    print(f"  Rescored {rescored:,} positions (wins: {distribution['win']:,}, draws: {distribution['draw']:,}, losses: {distribution['loss']:,})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+External-memory shuffle of record files.
+
+Records are scattered to random bucket files on disk, then every bucket is loaded,
+permuted and appended to the output. The result is a globally shuffled file that the
+trainer can read sequentially. Optionally a validation split is written to a second
+file; original/mirror pairs always land on the same side of the split.
+
+    python shuffle.py preprocessed_positions.bin --val-fraction 0.1
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from data import record_dtype, RECORD_SIZE
+
+TRAIN_NAME = "preprocessed_train.bin"
+VAL_NAME = "preprocessed_val.bin"
+
+# In-memory bytes per record while a bucket is permuted (bucket + permuted copy + indices)
+SHUFFLE_BYTES_PER_RECORD = 2 * RECORD_SIZE + 8
+
+
+def _splitmix64(x):
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def validation_mask(indices, val_fraction, seed=0, pair_stride=None):
+    """
+    Deterministic per-record validation membership. With pair_stride=n, records i and
+    i + n (an original and its mirror) share the same decision.
+    """
+    indices = np.asarray(indices, dtype=np.uint64)
+    if pair_stride:
+        indices = indices % np.uint64(pair_stride)
+    u = _splitmix64(indices ^ np.uint64(seed & 0xFFFFFFFFFFFFFFFF)) >> np.uint64(11)
+    return u < np.uint64(int(val_fraction * (1 << 53)))
+
+
+def shuffle_records(
+    input_path,
+    output_path,
+    val_path=None,
+    val_fraction=0.0,
+    pair_stride=None,
+    memory_budget=4 << 30,
+    seed=None,
+):
+    """
+    Shuffle input_path into output_path (and val_path when val_fraction > 0) with
+    peak memory bounded by memory_budget. Returns (train_records, val_records).
+    """
+    if os.path.getsize(input_path) == 0:
+        for path in [output_path] + ([val_path] if val_fraction > 0 else []):
+            open(path, "wb").close()
+        return 0, 0
+
+    positions = np.memmap(input_path, dtype=record_dtype, mode="r")
+    total = len(positions)
+    chunk_records = max(1, memory_budget // SHUFFLE_BYTES_PER_RECORD)
+    num_buckets = max(1, -(-2 * total // chunk_records))
+    rng = np.random.default_rng(seed)
+    split_seed = int(rng.integers(0, 2**63))
+    outputs = [output_path] + ([val_path] if val_fraction > 0 else [])
+
+    work_dir = tempfile.mkdtemp(prefix="shuffle_", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        bucket_paths = [
+            [os.path.join(work_dir, f"{split}_{b:05d}.bin") for b in range(num_buckets)]
+            for split in range(len(outputs))
+        ]
+        for paths in bucket_paths:
+            for path in paths:
+                open(path, "wb").close()
+
+        # Pass 1: scatter every record to a random bucket of its split
+        for start in range(0, total, chunk_records):
+            chunk = np.array(positions[start:start + chunk_records])
+            split = np.zeros(len(chunk), dtype=np.uint8)
+            if val_fraction > 0:
+                indices = np.arange(start, start + len(chunk), dtype=np.uint64)
+                split[validation_mask(indices, val_fraction, split_seed, pair_stride)] = 1
+            buckets = rng.integers(0, num_buckets, size=len(chunk)) + split.astype(np.int64) * num_buckets
+            order = np.argsort(buckets, kind="stable")
+            chunk = chunk[order]
+            bounds = np.searchsorted(buckets[order], np.arange(len(outputs) * num_buckets + 1))
+            for b in np.flatnonzero(np.diff(bounds)):
+                with open(bucket_paths[b // num_buckets][b % num_buckets], "ab") as fh:
+                    chunk[bounds[b]:bounds[b + 1]].tofile(fh)
+        del positions
+
+        # Pass 2: permute each bucket in memory and append it to its output
+        written = []
+        for paths, out_path in zip(bucket_paths, outputs):
+            count = 0
+            with open(out_path, "wb") as out:
+                for path in paths:
+                    bucket = np.fromfile(path, dtype=record_dtype)
+                    os.remove(path)
+                    bucket[rng.permutation(len(bucket))].tofile(out)
+                    count += len(bucket)
+            written.append(count)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    train = written[0]
+    val = written[1] if len(written) > 1 else 0
+    return train, val
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Globally shuffle a record file with bounded memory")
+    parser.add_argument("path", help="Record file to shuffle")
+    parser.add_argument("--output", default=None, help=f"Training output (default: {TRAIN_NAME} next to the input)")
+    parser.add_argument("--val-output", default=None, help=f"Validation output (default: {VAL_NAME} next to the input)")
+    parser.add_argument("--val-fraction", type=float, default=0.1, help="Fraction of records for validation (default: 0.1)")
+    parser.add_argument("--pair-stride", type=int, default=None,
+                        help="Keep records i and i+N in the same split (N = originals before mirroring)")
+    parser.add_argument("--memory-budget", type=int, default=4 << 30, help="Approximate peak memory in bytes")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    folder = os.path.dirname(os.path.abspath(args.path))
+    output = args.output or os.path.join(folder, TRAIN_NAME)
+    val_output = args.val_output or os.path.join(folder, VAL_NAME)
+    train, val = shuffle_records(
+        args.path, output, val_output, args.val_fraction,
+        pair_stride=args.pair_stride, memory_budget=args.memory_budget, seed=args.seed,
+    )
+    print(f"Wrote {train:,} training records to {output}")
+    if val:
+        print(f"Wrote {val:,} validation records to {val_output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import importlib.util
+import os
+import sys
+
+import numpy as np
+import pytest
+
+NNUE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if NNUE_DIR not in sys.path:
+    sys.path.insert(0, NNUE_DIR)
+
+from data import record_dtype
+
+
+def load_script(filename):
+    """Import one of the numbered pipeline scripts (e.g. 0_pre_process.py) as a module."""
+    name = os.path.splitext(filename)[0]
+    spec = importlib.util.spec_from_file_location(f"nnue_{name}", os.path.join(NNUE_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def random_records(n, seed=0):
+    """Build n records with random bitboards and plausible metadata fields."""
+    rng = np.random.default_rng(seed)
+    recs = np.zeros(n, dtype=record_dtype)
+    for name in record_dtype.names[:8]:
+        recs[name] = rng.integers(0, 2**64, size=n, dtype=np.uint64)
+    recs["stm"] = rng.choice(np.array([0, 7], dtype=np.uint8), size=n)
+    recs["castling"] = rng.integers(0, 16, size=n, dtype=np.uint8)
+    ep = rng.integers(16, 48, size=n, dtype=np.uint8)
+    recs["ep_file"] = np.where(rng.random(n) < 0.3, ep, 0)
+    recs["eval_i16"] = rng.integers(-3000, 3000, size=n, dtype=np.int16)
+    recs["wdl_f32"] = rng.choice(np.array([0.0, 0.5, 1.0], dtype=np.float32), size=n)
+    return recs
+
+
+def board_records(n, seed=0):
+    """Like random_records, but with at most 32 pieces per position so features can be cached."""
+    recs = random_records(n, seed=seed)
+    rng = np.random.default_rng(seed)
+    for name in record_dtype.names[:8]:
+        recs[name] = 0
+    for i in range(n):
+        squares = rng.choice(64, size=rng.integers(2, 33), replace=False)
+        for sq in squares:
+            bit = np.uint64(1) << np.uint64(sq)
+            recs[i][record_dtype.names[rng.integers(1, 7)]] |= bit
+            recs[i]["bb_white" if rng.random() < 0.5 else "bb_black"] |= bit
+    return recs
+
+
+def sorted_records(path):
+    """Records of a file as sorted opaque rows, for comparing outputs regardless of order."""
+    recs = np.fromfile(path, dtype=record_dtype)
+    return np.sort(recs.view(f"V{record_dtype.itemsize}"))
+
+
+@pytest.fixture(scope="session")
+def pre_process():
+    return load_script("0_pre_process.py")
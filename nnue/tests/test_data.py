@@ -0,0 +1,211 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from conftest import board_records, load_script, random_records
+from data import (
+    BlockShuffleSampler,
+    ChessBitboardDataset,
+    ShardedSampler,
+    _features_from_records,
+    build_feature_cache,
+    feature_cache_path,
+    open_feature_cache,
+    _planes_from_record,
+    _planes_from_records,
+    make_dataloader,
+    set_sampler_epoch,
+)
+
+
+def test_batched_planes_match_per_record_decoding():
+    recs = random_records(300, seed=10)
+
+    batched = _planes_from_records(recs)
+
+    assert batched.shape == (300, 768)
+    for i in range(len(recs)):
+        assert np.array_equal(batched[i], _planes_from_record(recs[i]))
+
+
+def test_get_batch_matches_getitem_with_modulo_split(tmp_path):
+    path = tmp_path / "data.bin"
+    random_records(257, seed=11).tofile(path)
+    ds = ChessBitboardDataset(
+        path, split_modulus=10, split_remainder_start=3, split_remainder_count=2,
+    )
+    indices = [5, 0, len(ds) - 1, 17, 5]
+
+    x, wdl, eval_cp = ds.get_batch(indices)
+
+    for row, i in enumerate(indices):
+        xi, wi, ei = ds[i]
+        assert torch.equal(x[row], xi)
+        assert torch.equal(wdl[row], wi)
+        assert torch.equal(eval_cp[row], ei)
+
+
+def test_batched_dataloader_yields_whole_batches(tmp_path):
+    path = tmp_path / "data.bin"
+    random_records(100, seed=12).tofile(path)
+    ds = ChessBitboardDataset(path)
+
+    loader = make_dataloader(ds, batch_size=32, num_workers=0, pin_memory=False)
+    shapes = [tuple(x.shape) for x, _, _ in loader]
+
+    assert shapes == [(32, 768), (32, 768), (32, 768), (4, 768)]
+    reference = make_dataloader(ds, batch_size=32, num_workers=0, pin_memory=False, batched=False)
+    for (xb, wb, eb), (xr, wr, er) in zip(loader, reference):
+        assert torch.equal(xb, xr) and torch.equal(wb, wr) and torch.equal(eb, er)
+
+
+def test_sparse_features_match_dense_planes():
+    recs = random_records(50, seed=13)
+
+    indices, offsets = _features_from_records(recs)
+
+    dense = _planes_from_records(recs)
+    ends = np.append(offsets[1:], len(indices))
+    for i in range(len(recs)):
+        assert np.array_equal(indices[offsets[i]:ends[i]], np.flatnonzero(dense[i]))
+
+
+def test_sparse_model_matches_dense_model(tmp_path):
+    train = load_script("1_train.py")
+    path = tmp_path / "data.bin"
+    random_records(64, seed=14).tofile(path)
+    dense_ds = ChessBitboardDataset(path)
+    sparse_ds = ChessBitboardDataset(path, sparse=True)
+    indices = list(range(64))
+    torch.manual_seed(0)
+    model = train.NNUE(input_size=768, hidden_size=8)
+
+    dense_out = model(dense_ds.get_batch(indices)[0])
+    dense_out.sum().backward()
+    dense_grad = model.hidden.weight.grad.clone()
+    model.zero_grad()
+    sparse_out = model(sparse_ds.get_batch(indices)[0])
+    sparse_out.sum().backward()
+
+    assert torch.allclose(dense_out, sparse_out, atol=1e-5)
+    assert torch.allclose(dense_grad, model.hidden.weight.grad, atol=1e-5)
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_feature_cache_matches_decoding(tmp_path, sparse):
+    path = tmp_path / "data.bin"
+    board_records(200, seed=15).tofile(path)
+    split = dict(split_modulus=10, split_remainder_start=0, split_remainder_count=9, sparse=sparse)
+    ds = ChessBitboardDataset(path, **split)
+    cached = ChessBitboardDataset(path, feature_cache=True, **split)
+    indices = [7, 0, len(ds) - 1, 100, 7]
+
+    expected, got = ds.get_batch(indices), cached.get_batch(indices)
+
+    assert os.path.exists(feature_cache_path(path))
+    for a, b in zip(expected, got):
+        if isinstance(a, tuple):
+            assert all(torch.equal(u, v) for u, v in zip(a, b))
+        else:
+            assert torch.equal(a, b)
+
+
+def test_feature_cache_is_rebuilt_when_source_changes(tmp_path):
+    path = tmp_path / "data.bin"
+    board_records(50, seed=16).tofile(path)
+    build_feature_cache(path)
+    assert open_feature_cache(path) is not None
+
+    board_records(60, seed=17).tofile(path)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert open_feature_cache(path) is None
+
+    ds = ChessBitboardDataset(path, feature_cache=True)
+    assert len(open_feature_cache(path)) == 60
+    x, _, _ = ds.get_batch(list(range(60)))
+    assert torch.equal(x, ChessBitboardDataset(path).get_batch(list(range(60)))[0])
+
+
+def test_feature_cache_rejects_more_than_32_pieces(tmp_path):
+    path = tmp_path / "data.bin"
+    random_records(10, seed=18).tofile(path)
+
+    with pytest.raises(ValueError):
+        build_feature_cache(path)
+
+
+def test_block_shuffle_sampler_is_a_windowed_permutation(tmp_path):
+    path = tmp_path / "data.bin"
+    random_records(1000, seed=19).tofile(path)
+    ds = ChessBitboardDataset(path, split_modulus=10, split_remainder_start=0, split_remainder_count=9)
+    sampler = BlockShuffleSampler(ds, block_size=50, window_blocks=3, seed=5)
+
+    order = np.array(list(sampler))
+
+    assert np.array_equal(np.sort(order), np.arange(len(ds)))
+    # Each window of 3 * 50 samples only touches 3 blocks
+    for start in range(0, len(ds), 150):
+        assert len(np.unique(order[start:start + 150] // 50)) == 3
+    assert not np.array_equal(order, np.arange(len(ds)))
+    assert np.array_equal(order, np.array(list(sampler)))
+    sampler.set_epoch(1)
+    assert not np.array_equal(order, np.array(list(sampler)))
+
+
+def test_block_shuffled_loader_covers_split_once_per_epoch(tmp_path):
+    path = tmp_path / "data.bin"
+    recs = random_records(300, seed=20)
+    recs["eval_i16"] = np.arange(300)
+    recs.tofile(path)
+    ds = ChessBitboardDataset(path, split_modulus=10, split_remainder_start=9, split_remainder_count=1)
+    loader = make_dataloader(
+        ds, batch_size=8, num_workers=0, pin_memory=False, shuffle=True, block_size=4, window_blocks=2, seed=1,
+    )
+
+    epochs = []
+    for epoch in range(2):
+        set_sampler_epoch(loader, epoch)
+        epochs.append(np.concatenate([e.numpy().ravel() for _, _, e in loader]))
+
+    for evals in epochs:
+        assert np.array_equal(np.sort(evals), np.arange(9, 300, 10))
+    assert not np.array_equal(epochs[0], epochs[1])
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_rank_shards_are_disjoint(tmp_path, shuffle):
+    path = tmp_path / "data.bin"
+    recs = random_records(103, seed=21)
+    recs["eval_i16"] = np.arange(103)
+    recs.tofile(path)
+    ds = ChessBitboardDataset(path)
+
+    shards = []
+    for rank in range(4):
+        loader = make_dataloader(
+            ds, batch_size=5, num_workers=0, pin_memory=False, shuffle=shuffle, rank=rank, world_size=4,
+        )
+        shards.append(np.concatenate([e.numpy().ravel() for _, _, e in loader]))
+
+    seen = np.concatenate(shards)
+    assert len(np.unique(seen)) == len(seen)
+    if shuffle:
+        # Training shards run the same number of steps, dropping the uneven tail
+        assert {len(shard) for shard in shards} == {25}
+    else:
+        # Evaluation shards cover everything
+        assert np.array_equal(np.sort(seen), np.arange(103))
+
+
+def test_sharded_sampler_lengths():
+    assert [len(ShardedSampler(range(10), r, 4, drop_last=False)) for r in range(4)] == [3, 3, 2, 2]
+    assert [len(list(ShardedSampler(range(10), r, 4, drop_last=False))) for r in range(4)] == [3, 3, 2, 2]
+    assert [list(ShardedSampler(range(10), r, 4)) for r in range(4)] == [[0, 4], [1, 5], [2, 6], [3, 7]]
+
+    resumed = [ShardedSampler(range(10), r, 4, drop_last=False) for r in range(4)]
+    for sampler in resumed:
+        sampler.set_epoch(0, start=1)
+    assert [len(sampler) for sampler in resumed] == [len(list(sampler)) for sampler in resumed] == [2, 2, 1, 1]
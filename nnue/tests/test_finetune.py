@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import torch
+
+from conftest import board_records, load_script
+from data import _planes_from_records
+from quantization import SCALE, quantize_state_dict, quantized_eval
+
+
+@pytest.fixture(scope="module")
+def finetune():
+    return load_script("2_finetune.py")
+
+
+def make_model(finetune, output_dtype="int8"):
+    torch.manual_seed(3)
+    model = finetune.QATNNUE(768, hidden_size=16, output_dtype=output_dtype)
+    with torch.no_grad():
+        model.hidden.weight.mul_(2.0)
+        model.output.weight.mul_(4.0)
+    return model
+
+
+def test_qat_forward_matches_the_integer_network(finetune):
+    model = make_model(finetune)
+    planes = _planes_from_records(board_records(100, seed=40))
+
+    with torch.no_grad():
+        qat_cp = SCALE * model(torch.from_numpy(planes)).numpy().ravel()
+    quantized, _ = quantize_state_dict(model.state_dict(), output_dtype="int8")
+
+    # The integer path only truncates the final division
+    assert np.abs(qat_cp - quantized_eval(quantized, planes)).max() < 1.0 + 1e-3
+
+
+def test_straight_through_gradients_reach_the_master_weights(finetune):
+    model = make_model(finetune)
+    x = torch.from_numpy(_planes_from_records(board_records(32, seed=41)))
+
+    model(x).sum().backward()
+
+    for p in model.parameters():
+        assert p.grad is not None and torch.isfinite(p.grad).all()
+    assert model.hidden.weight.grad.abs().sum() > 0
+    assert model.output.weight.grad.abs().sum() > 0
+
+
+def test_snapped_weights_quantize_losslessly(finetune):
+    model = make_model(finetune)
+    planes = torch.from_numpy(_planes_from_records(board_records(64, seed=42)))
+
+    snapped = model.snapped_state_dict()
+    quantized, report = quantize_state_dict(snapped, output_dtype="int8")
+    requantized, _ = quantize_state_dict(model.state_dict(), output_dtype="int8")
+
+    assert report == (0, 0, 0)
+    for a, b in zip(quantized, requantized):
+        assert np.array_equal(a, b)
+    # The plain float network on snapped weights computes what QAT trained
+    plain = finetune.train.NNUE(768, hidden_size=16)
+    plain.load_state_dict(snapped)
+    with torch.no_grad():
+        assert torch.allclose(plain(planes), model(planes), atol=1e-5)
@@ -0,0 +1,223 @@
+import io
+import json
+
+import numpy as np
+import pytest
+import torch
+
+from conftest import board_records, load_script
+from data import _piece_bitboards
+
+inference = load_script("4_test_inference.py")
+
+FENS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1",
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/8/PPPP1PPP/RNBQK1NR w KQkq - 4 4",
+    "8/8/8/8/8/8/8/K7 w - - 0 1",
+    "k7/8/8/8/8/8/8/8 b - - 0 1",
+]
+
+
+def records_to_fens(recs):
+    """FEN placements (plus side to move) for records, square by square."""
+    bbs = _piece_bitboards(recs)
+    fens = []
+    for rec, row in zip(recs, bbs):
+        board = ["."] * 64
+        for plane, bb in enumerate(row.tolist()):
+            char = "pnbrqk"[plane % 6]
+            for sq in range(64):
+                if bb >> sq & 1:
+                    board[sq] = char.upper() if plane >= 6 else char
+        ranks = []
+        for rank in range(7, -1, -1):
+            text = "".join(board[rank * 8:rank * 8 + 8])
+            for run in range(8, 0, -1):
+                text = text.replace("." * run, str(run))
+            ranks.append(text)
+        fens.append(f"{'/'.join(ranks)} {'w' if rec['stm'] == 7 else 'b'} - - 0 1")
+    return fens
+
+
+def make_model(hidden=16, seed=0):
+    torch.manual_seed(seed)
+    model = inference.NNUE(768, hidden)
+    model.eval()
+    return model
+
+
+def test_batched_parser_matches_scalar_features():
+    fens = FENS + records_to_fens(board_records(200, seed=3))
+
+    recs, valid = inference.fens_to_records(fens)
+
+    assert valid.all()
+    planes = inference._planes_from_records(recs)
+    for fen, row in zip(fens, planes):
+        bitboards, _ = inference.fen_to_bitboards(fen)
+        assert np.array_equal(row, inference.bitboards_to_features(bitboards))
+
+
+def test_batched_evaluation_matches_evaluate_fen():
+    model = make_model()
+    fens = FENS + [fen + " ; id \"epd\"" for fen in FENS]
+
+    recs, valid = inference.fens_to_records(fens)
+    batched = inference.evaluate_records(model, recs)
+
+    expected = [inference.evaluate_fen(model, fen) for fen in fens]
+    assert valid.all()
+    np.testing.assert_allclose(batched, expected, rtol=1e-5, atol=1e-4)
+
+
+def test_malformed_positions_are_flagged():
+    bad = [
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1",        # 7 ranks
+        "rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1",  # 9 files
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNX w - - 0 1",  # unknown piece
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x - - 0 1",  # side to move
+        "8/8/8/8/8/8/8/K7",
+    ]
+
+    recs, valid = inference.fens_to_records(bad + FENS[:1])
+
+    assert valid.tolist() == [False] * len(bad) + [True]
+    assert np.all(_piece_bitboards(recs[:-1]) == 0)
+
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl"])
+def test_stream_writes_one_row_per_position(fmt):
+    model = make_model()
+    lines = ["# regression suite", ""] + FENS + ["not a fen"]
+    out = io.StringIO()
+
+    stats = inference.evaluate_stream(model, lines, inference.ResultWriter(out, fmt), batch_size=2)
+
+    assert (stats["positions"], stats["invalid"]) == (len(FENS) + 1, 1)
+    rows = out.getvalue().splitlines()
+    if fmt == "csv":
+        assert rows[0] == "position,eval"
+        rows = [row.rsplit(",", 1) for row in rows[1:]]
+        values = [float(v) if v else None for _, v in rows]
+    else:
+        values = [json.loads(row)["eval"] for row in rows]
+    assert len(values) == len(FENS) + 1
+    assert values[-1] is None
+    expected = [inference.evaluate_fen(model, fen) for fen in FENS]
+    np.testing.assert_allclose(values[:-1], expected, atol=0.01)
+
+
+def test_cli_reads_float_weight_file(tmp_path):
+    from model_information import save_f32_weights
+
+    model = make_model(hidden=8)
+    weights = str(tmp_path / "w.bin")
+    save_f32_weights(model, weights)
+    positions = tmp_path / "positions.epd"
+    positions.write_text("\n".join(FENS) + "\n")
+    output = tmp_path / "evals.jsonl"
+
+    inference.main([str(positions), "--weights", weights, "--format", "jsonl", "-o", str(output)])
+
+    values = [json.loads(row)["eval"] for row in output.read_text().splitlines()]
+    np.testing.assert_allclose(values, [inference.evaluate_fen(model, fen) for fen in FENS], atol=0.01)
+
+
+def test_micro_batcher_merges_concurrent_requests():
+    from concurrent.futures import ThreadPoolExecutor
+
+    model = make_model()
+    batcher = inference.MicroBatcher(model, window_ms=50)
+    try:
+        requests = [FENS[i % len(FENS):] + ["bad"] for i in range(16)]
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(batcher.evaluate, requests))
+    finally:
+        batcher.close()
+
+    for fens, (evaluations, valid) in zip(requests, results):
+        assert valid.tolist() == [True] * (len(fens) - 1) + [False]
+        expected = [inference.evaluate_fen(model, fen) for fen in fens[:-1]]
+        np.testing.assert_allclose(evaluations[:-1], expected, rtol=1e-5, atol=1e-4)
+    stats = batcher.stats.snapshot()
+    assert stats["requests"] == 16
+    assert stats["positions"] == sum(len(fens) for fens in requests)
+    assert stats["batches"] < 16
+    assert stats["latency_p99_ms"] is not None
+
+
+@pytest.mark.parametrize("transport", ["tcp", "unix"])
+def test_server_answers_eval_and_stats(tmp_path, transport):
+    import http.client
+    import socket
+    import threading
+
+    model = make_model()
+    batcher = inference.MicroBatcher(model, window_ms=1)
+    unix_socket = str(tmp_path / "nnue.sock") if transport == "unix" else None
+    server = inference.make_server(batcher, port=0, unix_socket=unix_socket)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def connect():
+        if unix_socket is None:
+            return http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+        conn = http.client.HTTPConnection("localhost", timeout=10)
+        conn.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.sock.connect(unix_socket)
+        return conn
+
+    def request(method, path, body=None):
+        conn = connect()
+        conn.request(method, path, body=body)
+        response = conn.getresponse()
+        payload = json.loads(response.read())
+        conn.close()
+        return response.status, payload
+
+    try:
+        status, payload = request("POST", "/eval", json.dumps({"fens": FENS + ["bad"]}))
+        assert status == 200
+        assert payload["evals"][-1] is None
+        expected = [inference.evaluate_fen(model, fen) for fen in FENS]
+        np.testing.assert_allclose(payload["evals"][:-1], expected, atol=0.01)
+
+        status, payload = request("POST", "/eval", "\n".join(FENS[:2]))
+        assert status == 200 and len(payload["evals"]) == 2
+
+        assert request("POST", "/eval", "{not json")[0] == 400
+        for bad in ({"fens": [123]}, {"fen": None}, {"fens": FENS[0]}):
+            assert request("POST", "/eval", json.dumps(bad))[0] == 400
+        assert request("POST", "/eval", b"\xff\xfe" + FENS[0].encode())[0] == 400
+        assert request("GET", "/nope")[0] == 404
+        status, stats = request("GET", "/stats")
+        assert status == 200
+        assert (stats["requests"], stats["positions"]) == (2, len(FENS) + 3)
+    finally:
+        server.shutdown()
+        server.server_close()
+        batcher.close()
+
+
+def test_server_answers_500_when_evaluation_fails():
+    import http.client
+    import threading
+
+    class FailingBatcher:
+        def evaluate(self, fens):
+            raise RuntimeError("model crashed")
+
+    server = inference.make_server(FailingBatcher(), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+        conn.request("POST", "/eval", json.dumps({"fens": FENS}))
+        response = conn.getresponse()
+        payload = json.loads(response.read())
+        conn.close()
+        assert response.status == 500 and "model crashed" in payload["error"]
+    finally:
+        server.shutdown()
+        server.server_close()
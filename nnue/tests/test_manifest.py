@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from conftest import board_records, sorted_records
+from data import record_dtype
+from manifest import KEYSET_NAME, MANIFEST_NAME, IngestManifest, load_keyset
+from record_index import open_record_index
+from zobrist import zobrist_keys
+
+
+def _corpus(seed=3):
+    recs = board_records(1500, seed=seed)
+    recs[100:150] = recs[0:50]  # duplicates within a file
+    return recs[:700], recs[700:1200], np.concatenate([recs[1200:], recs[600:650]])  # c repeats part of a
+
+
+def test_incremental_runs_match_full_rebuild(pre_process, tmp_path, capsys):
+    a, b, c = _corpus()
+    full_dir, inc_dir = tmp_path / "full", tmp_path / "inc"
+    full_dir.mkdir()
+    inc_dir.mkdir()
+    for name, recs in (("a.pgn.evals.bin", a), ("b.pgn.evals.bin", b), ("c.pgn.evals.bin", c)):
+        recs.tofile(full_dir / name)
+    pre_process.process_folder(str(full_dir))
+
+    a.tofile(inc_dir / "a.pgn.evals.bin")
+    b.tofile(inc_dir / "b.pgn.evals.bin")
+    output = pre_process.process_folder_incremental(str(inc_dir))
+    first = np.fromfile(output, dtype=record_dtype)
+    c.tofile(inc_dir / "c.pgn.evals.bin")
+    capsys.readouterr()
+    pre_process.process_folder_incremental(str(inc_dir))
+
+    assert "1 new, 0 changed, 2 already ingested" in capsys.readouterr().out
+    combined = np.fromfile(output, dtype=record_dtype)
+    assert combined[:len(first)].tobytes() == first.tobytes()
+    assert sorted_records(output).tobytes() == sorted_records(full_dir / pre_process.OUTPUT_NAME).tobytes()
+
+    manifest = IngestManifest.load(str(inc_dir))
+    assert [(e.name, e.records) for e in manifest.files] == [
+        ("a.pgn.evals.bin", len(a)), ("b.pgn.evals.bin", len(b)), ("c.pgn.evals.bin", len(c)),
+    ]
+    assert sum(e.added for e in manifest.files) == len(combined) // 2
+    assert manifest.files[2].added == len(c) - 50
+    keyset = load_keyset(str(inc_dir))
+    assert keyset.output_records == len(combined)
+    assert np.array_equal(keyset.keys, np.unique(np.concatenate([zobrist_keys(a), zobrist_keys(b), zobrist_keys(c)])))
+
+    # Index columns were carried over and extended with the sources of the new records
+    index = open_record_index(output)
+    assert np.array_equal(index["key"], zobrist_keys(combined))
+    names = [index.source_names[s] for s in index["source"].tolist()]
+    assert names[:len(first)].count("c.pgn.evals.bin") == 0
+    assert set(names[len(first):]) == {"c.pgn.evals.bin"}
+
+
+def test_unchanged_folder_is_a_no_op(pre_process, tmp_path, capsys):
+    board_records(300, seed=4).tofile(tmp_path / "a.pgn.evals.bin")
+    output = pre_process.process_folder_incremental(str(tmp_path))
+    before = (tmp_path / pre_process.OUTPUT_NAME).read_bytes()
+    capsys.readouterr()
+
+    pre_process.process_folder_incremental(str(tmp_path))
+
+    assert "Nothing new to process." in capsys.readouterr().out
+    assert open(output, "rb").read() == before
+
+
+def test_changed_file_appends_only_new_positions(pre_process, tmp_path):
+    recs = board_records(600, seed=5)
+    recs[:400].tofile(tmp_path / "a.pgn.evals.bin")
+    output = pre_process.process_folder_incremental(str(tmp_path))
+
+    recs.tofile(tmp_path / "a.pgn.evals.bin")
+    pre_process.process_folder_incremental(str(tmp_path))
+
+    assert len(np.fromfile(output, dtype=record_dtype)) == 2 * len(recs)
+    (entry,) = IngestManifest.load(str(tmp_path)).files
+    assert (entry.records, entry.added) == (600, 600)
+
+
+def test_interrupted_append_is_rolled_back(pre_process, tmp_path):
+    board_records(300, seed=6).tofile(tmp_path / "a.pgn.evals.bin")
+    output = pre_process.process_folder_incremental(str(tmp_path))
+    expected = np.fromfile(output, dtype=record_dtype)
+    board_records(50, seed=7).tofile(open(output, "ab"))  # crashed before the key set was written
+
+    board_records(200, seed=8).tofile(tmp_path / "b.pgn.evals.bin")
+    pre_process.process_folder_incremental(str(tmp_path))
+
+    combined = np.fromfile(output, dtype=record_dtype)
+    assert combined[:len(expected)].tobytes() == expected.tobytes()
+    assert len(combined) == len(expected) + 400
+
+
+def test_rewritten_output_is_rejected(pre_process, tmp_path):
+    board_records(300, seed=9).tofile(tmp_path / "a.pgn.evals.bin")
+    pre_process.process_folder_incremental(str(tmp_path))
+    pre_process.process_folder(str(tmp_path), shuffle=True, seed=1)
+    board_records(100, seed=10).tofile(tmp_path / "b.pgn.evals.bin")
+
+    with pytest.raises(ValueError, match=MANIFEST_NAME):
+        pre_process.process_folder_incremental(str(tmp_path))
+
+    (tmp_path / MANIFEST_NAME).unlink()
+    (tmp_path / KEYSET_NAME).unlink()
+    pre_process.process_folder_incremental(str(tmp_path))
+    assert len(np.fromfile(tmp_path / pre_process.OUTPUT_NAME, dtype=record_dtype)) == 800
+
+
+def test_failed_files_are_recorded(pre_process, tmp_path, capsys):
+    (tmp_path / "empty.pgn.evals.bin").write_bytes(b"")
+    pre_process.process_folder_incremental(str(tmp_path))
+    board_records(200, seed=11).tofile(tmp_path / "a.pgn.evals.bin")
+    (tmp_path / "short.pgn.evals.bin").write_bytes(b"\0" * 10)
+    pre_process.process_folder_incremental(str(tmp_path))
+    capsys.readouterr()
+
+    pre_process.process_folder_incremental(str(tmp_path))
+
+    assert "Nothing new to process." in capsys.readouterr().out
+    entries = {e.name: (e.records, e.added) for e in IngestManifest.load(str(tmp_path)).files}
+    assert entries == {"empty.pgn.evals.bin": (0, 0), "short.pgn.evals.bin": (0, 0), "a.pgn.evals.bin": (200, 200)}
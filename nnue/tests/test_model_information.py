@@ -0,0 +1,88 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+import torch
+
+from conftest import NNUE_DIR, load_script
+from model_information import load_f32_weights, save_f32_weights, weights_header_dtype
+
+train = load_script("1_train.py")
+
+ENGINE_WEIGHTS = os.path.join(os.path.dirname(NNUE_DIR), "Lolbot.Engine", "nnue_weights_64.bin")
+
+
+def make_model(hidden=16, seed=0):
+    torch.manual_seed(seed)
+    return train.NNUE(768, hidden)
+
+
+def struct_floats(model) -> bytes:
+    """The per-float layout the exporter used to write, value by value."""
+    values = [*model.hidden.weight.data.flatten(), *model.hidden.bias.data,
+              *model.output.weight.data.flatten(), model.output.bias.data]
+    return b"".join(struct.pack("<f", v.item()) for v in values)
+
+
+def test_export_is_header_plus_legacy_floats(tmp_path):
+    model = make_model()
+    path = str(tmp_path / "w.bin")
+
+    save_f32_weights(model, path)
+
+    with open(path, "rb") as f:
+        data = f.read()
+    header = np.frombuffer(data, dtype=weights_header_dtype, count=1)[0]
+    assert header["magic"] == b"LNUF"
+    assert (header["input_size"], header["hidden_size"]) == (768, 16)
+    assert data[weights_header_dtype.itemsize:] == struct_floats(model)
+
+
+def test_weights_round_trip_with_and_without_header(tmp_path):
+    model = make_model(hidden=8)
+    for header in (True, False):
+        path = str(tmp_path / f"w_{header}.bin")
+        save_f32_weights(model, path, header=header)
+
+        loaded = load_f32_weights(path)
+
+        assert loaded.keys() == model.state_dict().keys()
+        for name, value in model.state_dict().items():
+            assert torch.equal(loaded[name], value)
+        train.NNUE(768, 8).load_state_dict(loaded)
+
+
+def test_hidden_size_mismatch_is_rejected(tmp_path):
+    path = str(tmp_path / "w.bin")
+    save_f32_weights(make_model(hidden=32), path)
+
+    assert load_f32_weights(path, hidden_size=32)["hidden.bias"].shape == (32,)
+    with pytest.raises(ValueError, match="hidden size 32, expected 64"):
+        load_f32_weights(path, hidden_size=64)
+
+
+def test_corrupt_or_truncated_files_are_rejected(tmp_path):
+    path = str(tmp_path / "w.bin")
+    save_f32_weights(make_model(), path)
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+
+    data[100] ^= 0xFF
+    with open(path, "wb") as f:
+        f.write(data)
+    with pytest.raises(ValueError, match="checksum"):
+        load_f32_weights(path)
+
+    raw = str(tmp_path / "raw.bin")
+    save_f32_weights(make_model(), raw, header=False)
+    with open(raw, "r+b") as f:
+        f.truncate(os.path.getsize(raw) - 4)
+    with pytest.raises(ValueError, match="not a 768-input"):
+        load_f32_weights(raw)
+
+
+@pytest.mark.skipif(not os.path.exists(ENGINE_WEIGHTS), reason="engine weights not present")
+def test_engine_weights_load_as_legacy_file():
+    state_dict = load_f32_weights(ENGINE_WEIGHTS, hidden_size=64)
+    assert state_dict["hidden.weight"].shape == (64, 768)
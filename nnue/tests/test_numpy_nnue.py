@@ -0,0 +1,129 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import torch
+
+from conftest import NNUE_DIR, load_script
+from model_information import save_f32_weights
+from numpy_nnue import Accumulator, Board, NumpyNNUE, fens_to_boards
+
+inference = load_script("4_test_inference.py")
+
+FENS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1",
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/8/PPPP1PPP/RNBQK1NR w KQkq - 4 4",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "8/8/8/8/8/8/8/K7 w - - 0 1",
+    "k7/8/8/8/8/8/8/8 b - - 0 1",
+]
+
+
+@pytest.fixture(scope="module")
+def weights(tmp_path_factory):
+    torch.manual_seed(0)
+    model = inference.NNUE(768, 32)
+    # Larger weights than the default init, so evals and clipping are non-trivial
+    with torch.no_grad():
+        model.hidden.weight.mul_(20)
+        model.output.weight.mul_(4)
+    path = str(tmp_path_factory.mktemp("weights") / "w.bin")
+    save_f32_weights(model, path)
+    model.eval()
+    return path, model
+
+
+def reevaluate(network, board):
+    """NNUE.Accumulator.Reevaluate written out like the C#: pop bits per piece, black then white."""
+    v = network.weights.hidden_bias.copy()
+    for piece in range(6):
+        for color in (0, 1):
+            bb = sum(1 << sq for sq in range(64) if board[sq] == color * 6 + piece)
+            while bb:
+                sq = (bb & -bb).bit_length() - 1
+                bb &= bb - 1
+                v = v + network.feature_weights[(color * 6 + piece) * 64 + sq]
+    return v
+
+
+def test_accumulators_are_bit_exact_with_reevaluate(weights):
+    network = NumpyNNUE.from_file(weights[0])
+    boards, _, valid = fens_to_boards(FENS)
+
+    acc = network.accumulators(boards)
+
+    assert valid.all()
+    for board, row in zip(boards, acc):
+        assert np.array_equal(row.view(np.uint32), reevaluate(network, board).view(np.uint32))
+
+
+def test_batch_evals_match_torch_model(weights):
+    path, model = weights
+    network = NumpyNNUE.from_file(path)
+
+    evals, valid = network.evaluate_fens(FENS)
+
+    expected = np.array([inference.evaluate_fen(model, fen) for fen in FENS])
+    assert valid.all()
+    assert np.abs(evals - expected).max() <= 1
+    assert np.abs(expected).max() > 10
+
+
+def test_board_follows_special_moves():
+    board = Board("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+
+    castle = board.push_uci("e1g1")
+    double_push = board.push_uci("c7c5")
+    en_passant = board.push_uci("d5c6")
+
+    white_rook, black_pawn, white_pawn = 6 + 3, 0, 6
+    assert castle.captured == white_rook * 64 + 7 and castle.castled == white_rook * 64 + 5
+    assert double_push.captured == -1
+    assert en_passant.captured == black_pawn * 64 + 34  # the c5 pawn, not c6
+    assert board.squares[42] == white_pawn and board.squares[34] == -1
+    with pytest.raises(ValueError):
+        board.push_uci("e1e2")  # white moved last
+
+
+def test_incremental_updates_track_refresh_along_random_games(weights):
+    chess = pytest.importorskip("chess")
+    network = NumpyNNUE.from_file(weights[0])
+    rng = np.random.default_rng(1)
+
+    for _ in range(5):
+        reference = chess.Board()
+        board = Board()
+        acc = Accumulator(network, board.squares)
+        start = acc.values.copy()
+        deltas = []
+        while not reference.is_game_over() and len(deltas) < 120:
+            move = rng.choice(list(reference.legal_moves))
+            reference.push(move)
+            deltas.append(board.push_uci(move.uci()))
+            acc.move(deltas[-1])
+
+            expected = np.full(64, -1, dtype=np.int8)
+            for sq, piece in reference.piece_map().items():
+                expected[sq] = int(piece.color) * 6 + piece.piece_type - 1
+            assert np.array_equal(board.squares, expected)
+            np.testing.assert_allclose(acc.values, network.accumulators(board.squares)[0], atol=1e-4)
+
+        for delta in reversed(deltas):
+            acc.undo(delta)
+        np.testing.assert_allclose(acc.values, start, atol=1e-4)
+
+
+def test_module_and_cli_run_without_torch(weights):
+    code = (
+        "import sys; import numpy_nnue; numpy_nnue.main(sys.argv[1:]); "
+        "assert 'torch' not in sys.modules"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code, weights[0], "--moves", "e2e4", "e7e5", "e1e2", "--trace"],
+        cwd=NNUE_DIR, capture_output=True, text=True, check=True,
+    )
+    lines = result.stdout.splitlines()
+    assert len(lines) == 4
+    assert all("crc32=" in line for line in lines)
@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import board_records, load_script, random_records
+from data import RECORD_SIZE, ChessBitboardDataset, open_records, record_dtype
+from packed import CHUNK_RAW, PackedRecords, is_packed_file, pack_file, write_packed
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("make", [board_records, random_records])
+def test_round_trip_is_lossless(tmp_path, make, compress):
+    recs = make(1000, seed=2)
+    path = tmp_path / "data.pk"
+
+    write_packed(recs, path, chunk_records=300, compress=compress)
+    packed = PackedRecords(path)
+
+    assert len(packed) == len(recs)
+    assert [len(chunk) for chunk in packed.iter_chunks()] == [300, 300, 300, 100]
+    assert np.array_equal(packed[:].view(np.uint8), recs.view(np.uint8))
+    raw = packed.table["flags"] & CHUNK_RAW
+    assert np.all(raw == 0) if make is board_records else np.all(raw)
+
+
+def test_board_records_pack_smaller_than_raw(tmp_path):
+    recs = board_records(2000, seed=3)
+    path = tmp_path / "data.pk"
+
+    write_packed(recs, path)
+
+    assert os.path.getsize(path) < 0.6 * len(recs) * RECORD_SIZE
+
+
+def test_random_access(tmp_path):
+    recs = board_records(1000, seed=4)
+    path = tmp_path / "data.pk"
+    write_packed(recs, path, chunk_records=128)
+    packed = PackedRecords(path, cache_chunks=2)
+    rng = np.random.default_rng(0)
+
+    indices = rng.integers(0, len(recs), 500)
+
+    assert np.array_equal(packed[indices].view(np.uint8), recs[indices].view(np.uint8))
+    assert packed[-1].tobytes() == recs[-1].tobytes()
+    assert packed[137].tobytes() == recs[137].tobytes()
+    assert packed[10:900:7].tobytes() == recs[10:900:7].tobytes()
+    with pytest.raises(IndexError):
+        packed[len(recs)]
+
+
+def test_dataset_reads_packed_file(tmp_path):
+    recs = board_records(700, seed=5)
+    raw_path = tmp_path / "data.bin"
+    recs.tofile(raw_path)
+    packed_path = pack_file(raw_path, chunk_records=200)
+
+    assert is_packed_file(packed_path) and not is_packed_file(raw_path)
+    assert isinstance(open_records(packed_path), PackedRecords)
+    raw = ChessBitboardDataset(raw_path, 50, 650, feature_cache=True)
+    packed = ChessBitboardDataset(packed_path, 50, 650, feature_cache=True, select={"max_pieces": 24})
+    assert packed.total_n == len(recs)
+    expected = ChessBitboardDataset(raw_path, 50, 650, select={"max_pieces": 24})
+    assert len(packed) == len(expected)
+
+    indices = np.random.default_rng(1).permutation(len(expected))[:64]
+    for a, b in zip(packed.get_batch(indices), expected.get_batch(indices)):
+        assert np.array_equal(a.numpy(), b.numpy())
+    plain = ChessBitboardDataset(packed_path, 50, 650)
+    for a, b in zip(plain[123], raw[123]):
+        assert np.array_equal(a.numpy(), b.numpy())
+
+
+def test_preprocessor_writes_packed_outputs(tmp_path):
+    pre_process = load_script("0_pre_process.py")
+    board_records(800, seed=6).tofile(tmp_path / "a.pgn.evals.bin")
+
+    pre_process.process_folder(str(tmp_path), val_fraction=0.25, seed=1, packed=True, packed_compress=True)
+
+    for name in (pre_process.TRAIN_NAME, pre_process.VAL_NAME):
+        path = tmp_path / name
+        packed = PackedRecords(str(path) + ".pk")
+        assert np.array_equal(packed[:].view(np.uint8), np.fromfile(path, dtype=record_dtype).view(np.uint8))
+
+
+def test_training_splits_and_loader_on_packed_file(tmp_path):
+    from data import BlockShuffleSampler, make_dataloader
+
+    train = load_script("1_train.py")
+    path = tmp_path / "data.bin"
+    board_records(1000, seed=7).tofile(path)
+    packed_path = pack_file(path, chunk_records=100)
+
+    train_ds, test_ds, shuffle_train = train.build_datasets(packed_path)
+    loader = make_dataloader(train_ds, batch_size=64, num_workers=0, pin_memory=False,
+                             shuffle=shuffle_train, seed=1)
+
+    assert (len(train_ds), len(test_ds)) == (900, 100)
+    sampler = loader.sampler.sampler
+    assert isinstance(sampler, BlockShuffleSampler) and sampler.block_size == 100
+    assert sum(len(batch[1]) for batch in loader) == 900
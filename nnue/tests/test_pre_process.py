@@ -0,0 +1,165 @@
+import numpy as np
+
+from conftest import random_records, sorted_records
+from data import record_dtype
+
+
+def test_mirror_positions_matches_per_record_path(pre_process):
+    recs = random_records(2000)
+
+    expected = np.empty(len(recs), dtype=record_dtype)
+    for i in range(len(recs)):
+        expected[i] = pre_process.mirror_position(recs[i])
+
+    mirrored = pre_process.mirror_positions(recs, chunk_size=300)
+
+    assert mirrored.tobytes() == expected.tobytes()
+
+
+def test_mirror_positions_is_an_involution(pre_process):
+    recs = random_records(500, seed=1)
+
+    twice = pre_process.mirror_positions(pre_process.mirror_positions(recs))
+
+    assert twice.tobytes() == recs.tobytes()
+
+
+def _write_corpus(folder, seed=2):
+    recs = random_records(3000, seed=seed)
+    # Duplicates within and across files, plus a few mate scores
+    recs[100:200] = recs[0:100]
+    recs["eval_i16"][300:320] = 15000
+    recs[:1800].tofile(folder / "a.pgn.evals.bin")
+    np.concatenate([recs[1800:], recs[50:150]]).tofile(folder / "b.pgn.evals.bin")
+
+
+def test_streaming_matches_in_memory(pre_process, tmp_path):
+    mem_dir = tmp_path / "mem"
+    stream_dir = tmp_path / "stream"
+    mem_dir.mkdir()
+    stream_dir.mkdir()
+    _write_corpus(mem_dir)
+    _write_corpus(stream_dir)
+
+    pre_process.process_folder(str(mem_dir))
+    budget = 200 * pre_process.WORKING_BYTES_PER_RECORD
+    pre_process.process_folder_streaming(str(stream_dir), memory_budget=budget)
+
+    expected = sorted_records(mem_dir / "preprocessed_positions.bin")
+    actual = sorted_records(stream_dir / "preprocessed_positions.bin")
+    assert len(actual) == len(expected)
+    assert actual.tobytes() == expected.tobytes()
+    assert sorted(p.name for p in stream_dir.iterdir()) == [
+        "a.pgn.evals.bin", "b.pgn.evals.bin", "preprocessed_positions.bin", "preprocessed_positions.bin.index",
+    ]
+
+
+def test_parse_size(pre_process):
+    assert pre_process.parse_size("512M") == 512 << 20
+    assert pre_process.parse_size("8GiB") == 8 << 30
+    assert pre_process.parse_size("1234") == 1234
+
+
+def test_dedupe_keeps_first_occurrence(pre_process):
+    recs = random_records(100, seed=4)
+    conflicting = recs[:10].copy()
+    conflicting["eval_i16"] += 50
+    both = np.concatenate([recs, conflicting])
+
+    unique, keys = pre_process.dedupe_positions(both, policy="first")
+
+    assert unique.tobytes() == recs.tobytes()
+    assert len(np.unique(keys)) == len(keys)
+
+
+def test_dedupe_average_policy(pre_process):
+    recs = random_records(3, seed=5)
+    recs["eval_i16"] = [10, 20, 30]
+    recs["wdl_f32"] = [0.0, 0.5, 1.0]
+    dup = recs[:1].copy()
+    dup["eval_i16"] = 40
+    dup["wdl_f32"] = 1.0
+
+    unique, _ = pre_process.dedupe_positions(np.concatenate([recs, dup]), policy="average")
+
+    assert list(unique["eval_i16"]) == [25, 20, 30]
+    assert list(unique["wdl_f32"]) == [0.5, 0.5, 1.0]
+
+
+def test_parallel_ingestion_matches_serial(pre_process, tmp_path):
+    serial_dir = tmp_path / "serial"
+    parallel_dir = tmp_path / "parallel"
+    serial_dir.mkdir()
+    parallel_dir.mkdir()
+    _write_corpus(serial_dir)
+    _write_corpus(parallel_dir)
+
+    pre_process.process_folder(str(serial_dir), workers=1)
+    pre_process.process_folder(str(parallel_dir), workers=2)
+
+    serial = (serial_dir / "preprocessed_positions.bin").read_bytes()
+    parallel = (parallel_dir / "preprocessed_positions.bin").read_bytes()
+    assert serial == parallel
+
+
+def test_popcount_matches_python_bit_count(monkeypatch):
+    import ingest
+
+    values = random_records(1000, seed=6)["bb_white"]
+    expected = [int(v).bit_count() for v in values]
+
+    assert ingest.popcount64(values).tolist() == expected
+    monkeypatch.delattr(np, "bitwise_count", raising=False)
+    assert ingest.popcount64(values).tolist() == expected
+
+
+def test_category_codes_follow_category_order(pre_process):
+    recs = np.zeros(4, dtype=record_dtype)
+    recs["eval_i16"] = [0, 50, 500, -500]
+    recs["wdl_f32"] = [0.0, 1.0, 0.0, 0.5]
+
+    codes = pre_process.category_codes(recs)
+
+    assert [pre_process.CATEGORY_ORDER[c] for c in codes] == [
+        (True, True), (True, False), (False, True), (False, False)
+    ]
+
+
+def test_sample_mask_picks_exact_count_across_chunks(pre_process):
+    rng = np.random.default_rng(7)
+    remaining, need, picked_total = 10_000, 1_234, 0
+    for _ in range(10):
+        mask, picked = pre_process.sample_mask(rng, 1_000, remaining, need)
+        assert mask.sum() == picked
+        remaining -= 1_000
+        need -= picked
+        picked_total += picked
+
+    assert picked_total == 1_234
+
+
+def test_category_ratios_rebalance_output(pre_process, tmp_path):
+    ratios = pre_process.parse_ratios("1,1,2,0")
+    for stream in (False, True):
+        folder = tmp_path / f"stream_{stream}"
+        folder.mkdir()
+        _write_corpus(folder)
+        recs = random_records(3000, seed=2)
+        counts = np.bincount(pre_process.category_codes(recs), minlength=4)
+
+        if stream:
+            pre_process.process_folder_streaming(
+                str(folder), memory_budget=200 * pre_process.WORKING_BYTES_PER_RECORD,
+                category_ratios=ratios, seed=1,
+            )
+        else:
+            pre_process.process_folder(str(folder), category_ratios=ratios, seed=1)
+
+        out = np.fromfile(folder / "preprocessed_positions.bin", dtype=record_dtype)
+        originals = out[: len(out) // 2]
+        sampled = np.bincount(pre_process.category_codes(originals), minlength=4)
+        smallest = min(counts[0], counts[1])
+        assert sampled[3] == 0
+        assert sampled[0] == sampled[1] <= smallest
+        assert abs(int(sampled[2]) - 2 * int(sampled[0])) <= 1
+        assert out[len(out) // 2:].tobytes() == pre_process.mirror_positions(originals).tobytes()
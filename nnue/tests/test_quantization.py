@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+import torch
+
+from conftest import board_records
+from data import _planes_from_records
+from quantization import (
+    HIDDEN_WEIGHT_LIMIT,
+    QA,
+    QB,
+    float_eval,
+    quantize_state_dict,
+    quantized_eval,
+    read_quantized,
+    write_quantized,
+)
+
+
+def make_state_dict(hidden=16, seed=0, output_scale=1.0):
+    torch.manual_seed(seed)
+    return {
+        "hidden.weight": torch.randn(hidden, 768) * 0.05,
+        "hidden.bias": torch.randn(hidden) * 0.1,
+        "output.weight": torch.randn(1, hidden) * output_scale,
+        "output.bias": torch.randn(1),
+    }
+
+
+def test_quantized_file_round_trips(tmp_path):
+    q, _ = quantize_state_dict(make_state_dict())
+    path = str(tmp_path / "q.bin")
+
+    write_quantized(q, path)
+    loaded = read_quantized(path)
+
+    assert loaded.hidden_weights.shape == (768, 16)
+    for a, b in zip(q, loaded):
+        assert np.array_equal(a, b)
+
+
+def test_corrupted_file_fails_the_checksum(tmp_path):
+    q, _ = quantize_state_dict(make_state_dict())
+    path = tmp_path / "q.bin"
+    write_quantized(q, str(path))
+    data = bytearray(path.read_bytes())
+    data[100] ^= 1
+    path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match="checksum"):
+        read_quantized(str(path))
+
+
+def test_quantized_eval_tracks_float_eval():
+    state_dict = make_state_dict()
+    planes = _planes_from_records(board_records(200, seed=30))
+    q, report = quantize_state_dict(state_dict)
+
+    err = quantized_eval(q, planes) - float_eval(state_dict, planes)
+
+    assert report == (0, 0, 0)
+    assert np.abs(err).max() < 40
+    assert np.abs(err).mean() < 5
+
+
+def test_scales_and_output_dtype_selection():
+    large_state = make_state_dict(output_scale=5.0)
+    small, _ = quantize_state_dict(make_state_dict(output_scale=0.5))
+    large, report = quantize_state_dict(large_state)
+
+    assert small.output_weights.dtype == np.int8
+    assert large.output_weights.dtype == np.int16
+    assert report.output_weights_clamped == 0
+    expected = np.rint(large_state["output.weight"].numpy().ravel().astype(np.float64) * QB)
+    assert np.array_equal(large.output_weights, expected)
+    assert large.output_bias == np.int32(round(large_state["output.bias"].item() * QA * QB))
+
+
+def test_hidden_weights_are_clamped_to_the_accumulator_bound():
+    state_dict = make_state_dict()
+    state_dict["hidden.weight"][3, 7] = 100.0
+
+    q, report = quantize_state_dict(state_dict)
+
+    assert q.hidden_weights[7, 3] == HIDDEN_WEIGHT_LIMIT
+    assert report.hidden_weights_clamped == 1
@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import board_records
+from data import ChessBitboardDataset, record_dtype
+from ingest import count_pieces
+from record_index import (
+    UNKNOWN_SOURCE,
+    SourceTable,
+    build_record_index,
+    category_codes,
+    open_record_index,
+    record_index_path,
+)
+from zobrist import zobrist_keys
+
+
+def test_index_columns_match_records(tmp_path):
+    recs = board_records(1000, seed=4)
+    path = tmp_path / "data.bin"
+    recs.tofile(path)
+
+    build_record_index(path, chunk_records=300)
+    index = open_record_index(path)
+
+    assert len(index) == len(recs)
+    assert np.array_equal(index["key"], zobrist_keys(recs))
+    assert np.array_equal(index["piece_count"], count_pieces(recs))
+    assert np.array_equal(index["category"], category_codes(recs))
+    assert np.array_equal(index["eval_i16"], recs["eval_i16"])
+    assert np.array_equal(index["stm"], recs["stm"])
+    assert np.all(index["source"] == UNKNOWN_SOURCE)
+
+
+def test_stale_index_is_ignored(tmp_path):
+    path = tmp_path / "data.bin"
+    board_records(100).tofile(path)
+    build_record_index(path)
+    assert open_record_index(path) is not None
+
+    board_records(120, seed=1).tofile(path)
+
+    assert open_record_index(path) is None
+
+
+def test_mask_combines_conditions(tmp_path):
+    recs = board_records(2000, seed=5)
+    path = tmp_path / "data.bin"
+    recs.tofile(path)
+    keys = zobrist_keys(recs)
+    sources = (np.arange(len(recs)) % 3).astype(np.uint16)
+    build_record_index(path, SourceTable.from_keys(keys, sources), ["x.bin", "y.bin", "z.bin"])
+    index = open_record_index(path)
+
+    mask = index.mask(min_pieces=10, max_pieces=24, eval_range=(-500, 500), sources=["y.bin", 2], stm=7)
+
+    pieces = count_pieces(recs)
+    expected = (
+        (pieces >= 10) & (pieces <= 24)
+        & (np.abs(recs["eval_i16"].astype(int)) <= 500)
+        & (index["source"] != 0)
+        & (recs["stm"] == 7)
+    )
+    assert mask.any()
+    assert np.array_equal(mask, expected)
+
+
+def test_dataset_selects_through_index(tmp_path):
+    recs = board_records(1000, seed=6)
+    path = tmp_path / "data.bin"
+    recs.tofile(path)
+
+    ds = ChessBitboardDataset(path, 0, 800, select={"max_pieces": 20, "stm": 0})
+
+    expected = np.flatnonzero((count_pieces(recs[:800]) <= 20) & (recs["stm"][:800] == 0))
+    assert os.path.exists(record_index_path(path))
+    assert len(ds) == len(expected)
+    _, wdl, eval_cp = ds.get_batch(np.arange(len(ds)))
+    assert np.array_equal(eval_cp.numpy().ravel(), recs["eval_i16"][expected].astype(np.float32))
+    _, _, single = ds[len(ds) - 1]
+    assert single.item() == recs["eval_i16"][expected[-1]]
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_preprocessor_records_sources(pre_process, tmp_path, streaming):
+    a = board_records(600, seed=7)
+    b = board_records(500, seed=8)
+    a.tofile(tmp_path / "a.pgn.evals.bin")
+    b.tofile(tmp_path / "b.pgn.evals.bin")
+
+    if streaming:
+        pre_process.process_folder_streaming(str(tmp_path), memory_budget=100 * pre_process.WORKING_BYTES_PER_RECORD,
+                                             val_fraction=0.2, seed=3)
+        paths = [tmp_path / pre_process.TRAIN_NAME, tmp_path / pre_process.VAL_NAME]
+    else:
+        pre_process.process_folder(str(tmp_path), shuffle=True, seed=3)
+        paths = [tmp_path / "preprocessed_positions.bin"]
+
+    expected_source = {}
+    for name, recs in (("a.pgn.evals.bin", a), ("b.pgn.evals.bin", b)):
+        for key in np.concatenate([zobrist_keys(recs), zobrist_keys(pre_process.mirror_positions(recs))]).tolist():
+            expected_source.setdefault(key, set()).add(name)
+
+    for path in paths:
+        index = open_record_index(path)
+        assert index is not None and len(index) == len(np.fromfile(path, dtype=record_dtype))
+        names = [index.source_names[s] for s in index["source"].tolist()]
+        for key, name in zip(index["key"].tolist(), names):
+            assert name in expected_source[key]
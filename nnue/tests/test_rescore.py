@@ -0,0 +1,101 @@
+import numpy as np
+
+from data import record_dtype
+from ingest import count_pieces
+from rescore import NO_RESULT, ProbeCache, StubProber, SyzygyRescorer
+from zobrist import zobrist_keys
+
+
+def endgame_records(n):
+    recs = np.zeros(n, dtype=record_dtype)
+    for i in range(n):
+        recs[i]["bb_white"] = (1 << 4) | (1 << (8 + i % 48))
+        recs[i]["bb_black"] = 1 << 60
+        recs[i]["bb_kings"] = (1 << 4) | (1 << 60)
+        recs[i]["bb_pawns"] = 1 << (8 + i % 48)
+    recs["stm"] = np.where(np.arange(n) % 2 == 0, 7, 0)
+    recs["eval_i16"] = 123
+    recs["wdl_f32"] = 0.25
+    return recs
+
+
+def test_results_are_converted_to_white_perspective():
+    recs = endgame_records(4)
+    keys = zobrist_keys(recs)
+    # Side to move wins in 0 (white) and 1 (black), draws in 2, loses in 3 (black)
+    prober = StubProber({int(keys[0]): 2, int(keys[1]): 1, int(keys[2]): 0, int(keys[3]): -2})
+
+    with SyzygyRescorer(prober, workers=1) as rescorer:
+        rescored, distribution = rescorer.rescore(recs, count_pieces(recs), keys)
+
+    assert rescored == 4
+    assert distribution == {"win": 2, "draw": 1, "loss": 1}
+    assert recs["wdl_f32"].tolist() == [1.0, 0.0, 0.5, 1.0]
+    assert recs["eval_i16"].tolist() == [200, -200, 0, 200]
+
+
+def test_ineligible_and_unknown_positions_are_untouched():
+    recs = endgame_records(3)
+    recs[0]["bb_white"] = 0xFF  # too many pieces
+    prober = StubProber()
+
+    with SyzygyRescorer(prober, workers=1) as rescorer:
+        rescored, _ = rescorer.rescore(recs, count_pieces(recs))
+
+    assert rescored == 0
+    assert prober.probed == 2
+    assert recs["eval_i16"].tolist() == [123, 123, 123]
+
+
+def test_cache_skips_already_probed_positions(tmp_path):
+    cache_path = str(tmp_path / "cache.bin")
+    recs = endgame_records(10)
+
+    first = StubProber(default=1)
+    with SyzygyRescorer(first, cache_path=cache_path, workers=1) as rescorer:
+        rescorer.rescore(recs.copy(), count_pieces(recs))
+    second = StubProber(default=-1)
+    with SyzygyRescorer(second, cache_path=cache_path, workers=1) as rescorer:
+        rescored, _ = rescorer.rescore(recs, count_pieces(recs))
+
+    assert first.probed == 10
+    assert second.probed == 0
+    assert rescored == 10
+    assert len(ProbeCache(cache_path)) == 10
+
+
+def test_pooled_probing_matches_inline():
+    recs = endgame_records(40)
+    keys = zobrist_keys(recs)
+    prober = StubProber({int(k): (i % 3) - 1 for i, k in enumerate(keys)})
+    inline = recs.copy()
+
+    with SyzygyRescorer(prober, workers=1) as rescorer:
+        rescorer.rescore(inline, count_pieces(inline), keys)
+    with SyzygyRescorer(prober, workers=2, batch_size=7) as rescorer:
+        rescorer.rescore(recs, count_pieces(recs), keys)
+
+    assert recs.tobytes() == inline.tobytes()
+
+
+def test_cache_lookup_reports_missing_keys():
+    cache = ProbeCache(None)
+    cache.add(np.array([5, 9], dtype=np.uint64), np.array([1, NO_RESULT], dtype=np.int8))
+
+    assert cache.lookup(np.array([5, 9, 1], dtype=np.uint64)).tolist() == [1, NO_RESULT, NO_RESULT]
+
+
+def test_cache_merge_keeps_first_result_and_sorted_keys(tmp_path):
+    cache_path = str(tmp_path / "cache.bin")
+    cache = ProbeCache(cache_path)
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 2**64, size=300, dtype=np.uint64)
+
+    cache.add(keys[:200], np.full(200, 1, dtype=np.int8))
+    cache.add(np.concatenate([keys[100:300], keys[250:]]), np.full(250, -1, dtype=np.int8))
+
+    assert np.all(cache.keys[1:] > cache.keys[:-1])
+    expected = np.where(np.arange(300) < 200, 1, -1)
+    assert np.array_equal(cache.lookup(keys), expected)
+    reloaded = ProbeCache(cache_path)
+    assert np.array_equal(reloaded.keys, cache.keys) and np.array_equal(reloaded.lookup(keys), expected)
@@ -0,0 +1,49 @@
+import numpy as np
+
+from conftest import random_records
+from data import record_dtype
+from shuffle import shuffle_records, validation_mask
+
+
+def _as_bytes_set(recs):
+    return sorted(recs.view(f"V{record_dtype.itemsize}").tolist())
+
+
+def test_shuffle_is_a_permutation(tmp_path):
+    recs = random_records(5000, seed=8)
+    src = tmp_path / "in.bin"
+    recs.tofile(src)
+
+    train, val = shuffle_records(str(src), str(tmp_path / "out.bin"), memory_budget=40_000, seed=1)
+    out = np.fromfile(tmp_path / "out.bin", dtype=record_dtype)
+
+    assert (train, val) == (5000, 0)
+    assert _as_bytes_set(out) == _as_bytes_set(recs)
+    assert out.tobytes() != recs.tobytes()
+
+
+def test_validation_split_keeps_mirror_pairs_together(tmp_path):
+    originals = random_records(2000, seed=9)
+    mirrors = originals.copy()
+    mirrors["eval_i16"] = np.arange(2000)  # tag each mirror with its original's index
+    originals["eval_i16"] = np.arange(2000)
+    src = tmp_path / "in.bin"
+    np.concatenate([originals, mirrors]).tofile(src)
+
+    train, val = shuffle_records(
+        str(src), str(tmp_path / "train.bin"), str(tmp_path / "val.bin"), 0.1,
+        pair_stride=2000, memory_budget=40_000, seed=2,
+    )
+    train_tags = np.fromfile(tmp_path / "train.bin", dtype=record_dtype)["eval_i16"]
+    val_tags = np.fromfile(tmp_path / "val.bin", dtype=record_dtype)["eval_i16"]
+
+    assert train + val == 4000
+    assert 200 < val < 600
+    assert not set(train_tags.tolist()) & set(val_tags.tolist())
+    assert np.all(np.bincount(val_tags, minlength=2000)[np.unique(val_tags)] == 2)
+
+
+def test_validation_mask_is_deterministic():
+    idx = np.arange(1000)
+    assert np.array_equal(validation_mask(idx, 0.2, seed=5), validation_mask(idx, 0.2, seed=5))
+    assert not validation_mask(idx, 0.0).any()
@@ -0,0 +1,181 @@
+import pytest
+import torch
+
+from conftest import load_script, random_records
+from data import ChessBitboardDataset, make_dataloader, set_sampler_epoch
+
+
+class Preempted(Exception):
+    pass
+
+
+@pytest.fixture(scope="module")
+def train():
+    return load_script("1_train.py")
+
+
+def run_phase(train, model, path, **kwargs):
+    ds = ChessBitboardDataset(path)
+    loader = make_dataloader(ds, batch_size=16, num_workers=0, pin_memory=False, shuffle=True, seed=3)
+    test_loader = make_dataloader(ds, batch_size=64, num_workers=0, pin_memory=False)
+    return train.train_phase(
+        model, loader, test_loader, torch.device("cpu"), phase_name="Test", num_epochs=3, seed=3, **kwargs,
+    )
+
+
+def test_resume_continues_exactly_where_the_run_stopped(train, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "data.bin"
+    random_records(200, seed=22).tofile(path)
+    state_path = str(tmp_path / "state.pt")
+
+    torch.manual_seed(0)
+    reference = train.NNUE(768, hidden_size=8)
+    initial = {k: v.clone() for k, v in reference.state_dict().items()}
+    run_phase(train, reference, path)
+
+    # Same run, preempted in the middle of epoch 2 (13 batches per epoch)
+    class PreemptedNNUE(train.NNUE):
+        calls = 0
+
+        def forward(self, x):
+            if self.training:
+                PreemptedNNUE.calls += 1
+                if PreemptedNNUE.calls == 13 + 5:
+                    raise Preempted()
+            return super().forward(x)
+
+    interrupted = PreemptedNNUE(768, hidden_size=8)
+    interrupted.load_state_dict(initial)
+    with pytest.raises(Preempted):
+        run_phase(train, interrupted, path, checkpoint_path=state_path, checkpoint_every=3)
+
+    state = train.load_training_state(state_path)
+    assert (state["epoch"], state["seen"]) == (2, 3 * 16)
+    # The resumed epoch reports only the batches it still runs
+    loader = make_dataloader(ChessBitboardDataset(path), batch_size=16, num_workers=0, pin_memory=False,
+                             shuffle=True, seed=3)
+    set_sampler_epoch(loader, 2, start=state["seen"])
+    assert len(loader) == len(list(loader)) == -(-(200 - 3 * 16) // 16)
+
+    resumed = train.NNUE(768, hidden_size=8)
+    run_phase(train, resumed, path, checkpoint_path=state_path, resume_state=state)
+
+    for name, value in reference.state_dict().items():
+        assert torch.allclose(value, resumed.state_dict()[name], atol=1e-6), name
+    assert train.load_training_state(state_path)["epoch"] == 4
+
+
+def test_evaluate_model_matches_per_batch_reference(train, tmp_path):
+    path = tmp_path / "data.bin"
+    random_records(300, seed=23).tofile(path)
+    loader = make_dataloader(ChessBitboardDataset(path), batch_size=64, num_workers=0, pin_memory=False)
+    torch.manual_seed(1)
+    model = train.NNUE(768, hidden_size=8)
+
+    bce, mse, baseline, r2 = train.evaluate_model(model, loader, torch.device("cpu"), 0.6, 400.0)
+
+    x, wdl, eval_cp = ChessBitboardDataset(path).get_batch(list(range(300)))
+    y = train.blend_targets(wdl, eval_cp, 0.6, 400.0)
+    with torch.no_grad():
+        logits = model(x)
+    assert bce == pytest.approx(torch.nn.functional.binary_cross_entropy_with_logits(logits, y).item(), rel=1e-5)
+    assert mse == pytest.approx(torch.mean((torch.sigmoid(logits) - y) ** 2).item(), rel=1e-5)
+    assert baseline == pytest.approx(torch.var(y, unbiased=False).item(), rel=1e-4)
+
+
+def test_early_stopping_counts_evaluations_without_improvement(train):
+    stopper = train.EarlyStopping(patience=2, min_delta=0.01)
+
+    assert stopper.update(1.0)
+    assert not stopper.update(0.995)
+    assert not stopper.should_stop
+    assert stopper.update(0.9)
+    assert not stopper.update(0.9)
+    assert not stopper.update(0.95)
+    assert stopper.should_stop
+    assert not train.EarlyStopping(patience=0).should_stop
+
+
+def test_training_stops_once_validation_plateaus(train, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "data.bin"
+    random_records(200, seed=24).tofile(path)
+    ds = ChessBitboardDataset(path)
+    eval_loader = make_dataloader(ds, batch_size=64, num_workers=0, pin_memory=False, seed=0, subsample=50)
+    torch.manual_seed(0)
+    model = train.NNUE(768, hidden_size=8)
+
+    # An impossible min_delta: every evaluation after the first is a non-improvement
+    train_steps = []
+    model.register_forward_pre_hook(lambda m, a: train_steps.append(1) if m.training else None)
+    run_phase(train, model, path, eval_loader=eval_loader, eval_every=2, patience=3, min_delta=10.0)
+
+    # First eval at step 2 sets the best, the three after it (steps 4, 6, 8) exhaust patience
+    assert len(train_steps) == 8
+
+
+def train_losses(train, model, path, precision="fp32", steps=6):
+    """Per-batch training losses of a few optimizer steps, starting from the same weights."""
+    ds = ChessBitboardDataset(path)
+    loader = make_dataloader(ds, batch_size=64, num_workers=0, pin_memory=False, shuffle=True, seed=4)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    losses = []
+    for step, (x, wdl, eval_cp) in enumerate(loader):
+        if step == steps:
+            break
+        y = train.blend_targets(wdl, eval_cp, 0.6, 400.0)
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=precision == "bf16"):
+            logits = model(x)
+        loss = torch.nn.functional.binary_cross_entropy_with_logits(logits.float(), y)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        losses.append(loss.item())
+    return losses
+
+
+def fresh_model(train):
+    torch.manual_seed(2)
+    return train.NNUE(768, hidden_size=32)
+
+
+def test_bf16_autocast_keeps_fp32_weights_and_close_losses(train, tmp_path):
+    path = tmp_path / "data.bin"
+    random_records(512, seed=25).tofile(path)
+
+    reference = train_losses(train, fresh_model(train), path)
+    model = fresh_model(train)
+    losses = train_losses(train, model, path, precision="bf16")
+
+    assert all(p.dtype == torch.float32 for p in model.parameters())
+    assert losses == pytest.approx(reference, abs=2e-2)
+
+
+def test_compiled_model_matches_eager(train, tmp_path):
+    path = tmp_path / "data.bin"
+    random_records(512, seed=26).tofile(path)
+    model = fresh_model(train)
+    compiled = torch.compile(model)
+    try:
+        compiled(torch.zeros(1, 768))
+    except Exception as e:  # no working compiler toolchain
+        pytest.skip(f"torch.compile unavailable: {e}")
+
+    reference = train_losses(train, fresh_model(train), path)
+    losses = train_losses(train, compiled, path)
+
+    assert losses == pytest.approx(reference, abs=1e-4)
+    assert train.unwrap(compiled) is model
+
+
+def test_device_sum_stays_float32_and_matches_float64(train):
+    values = torch.rand(20000, 2, generator=torch.Generator().manual_seed(0)) * 1000
+    totals = train.DeviceSum(2, torch.device("cpu"), offset=0.5)
+
+    for row in values:
+        totals.add(row)
+
+    assert totals.sum.dtype == torch.float32 and totals.compensation.dtype == torch.float32
+    expected = (values.double().sum(0) + 0.5).tolist()
+    assert totals.tolist() == pytest.approx(expected, rel=1e-9)
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from data import record_dtype
+from zobrist import DEFAULT, zobrist_keys
+
+chess = pytest.importorskip("chess")
+import chess.polyglot  # noqa: E402
+
+PIECE_FIELDS = {
+    chess.PAWN: "bb_pawns",
+    chess.KNIGHT: "bb_knights",
+    chess.BISHOP: "bb_bishops",
+    chess.ROOK: "bb_rooks",
+    chess.QUEEN: "bb_queens",
+    chess.KING: "bb_kings",
+}
+
+
+def board_to_record(board):
+    rec = np.zeros(1, dtype=record_dtype)
+    for piece_type, field in PIECE_FIELDS.items():
+        rec[field] = int(board.pieces_mask(piece_type, chess.WHITE) | board.pieces_mask(piece_type, chess.BLACK))
+    rec["bb_white"] = int(board.occupied_co[chess.WHITE])
+    rec["bb_black"] = int(board.occupied_co[chess.BLACK])
+    rec["stm"] = 7 if board.turn == chess.WHITE else 0
+    castling = 0
+    castling |= 1 if board.has_queenside_castling_rights(chess.WHITE) else 0
+    castling |= 2 if board.has_kingside_castling_rights(chess.WHITE) else 0
+    castling |= 4 if board.has_queenside_castling_rights(chess.BLACK) else 0
+    castling |= 8 if board.has_kingside_castling_rights(chess.BLACK) else 0
+    rec["castling"] = castling
+    rec["ep_file"] = board.ep_square or 0
+    return rec
+
+
+def test_start_position_matches_engine_default():
+    rec = board_to_record(chess.Board())
+
+    assert int(zobrist_keys(rec)[0]) == DEFAULT
+
+
+def test_matches_polyglot_on_random_games():
+    rng = np.random.default_rng(3)
+    boards = []
+    for _ in range(20):
+        board = chess.Board()
+        for _ in range(int(rng.integers(1, 80))):
+            moves = list(board.legal_moves)
+            if not moves or board.ep_square is not None:
+                break
+            board.push(moves[int(rng.integers(len(moves)))])
+            boards.append(board.copy())
+    boards = [b for b in boards if b.ep_square is None]
+    recs = np.concatenate([board_to_record(b) for b in boards])
+
+    keys = zobrist_keys(recs, chunk_size=7)
+
+    assert [int(k) for k in keys] == [chess.polyglot.zobrist_hash(b) for b in boards]
+
+
+def test_en_passant_only_hashed_when_capturable():
+    capturable = chess.Board("rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3")
+    not_capturable = chess.Board("rnbqkbnr/pppp1ppp/8/8/4p3/8/PPPPPPPP/RNBQKBNR w KQkq e6 0 2")
+    recs = np.concatenate([board_to_record(capturable), board_to_record(not_capturable)])
+    without_ep = recs.copy()
+    without_ep["ep_file"] = 0
+
+    keys = zobrist_keys(recs)
+
+    assert int(keys[0]) == chess.polyglot.zobrist_hash(capturable)
+    assert int(keys[0]) != int(zobrist_keys(without_ep)[0])
+    assert int(keys[1]) == int(zobrist_keys(without_ep)[1])